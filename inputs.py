@@ -168,7 +168,7 @@ def _load_sbm(modelopts):
 
     #Assign epsilons for fitting. Default: All pair interactions
     if modelopts["parameters_to_fit_file"] is None:
-        parameters_to_fit = np.arange(np.shape(model.Hamiltonian._pairs)[0])
+        parameters_to_fit = np.arange(model.Hamiltonian.n_pairs)
     else:
         parameters_to_fit = np.loadtxt(modelopts["parameters_to_fit_file"], comments="#").astype(int)
 
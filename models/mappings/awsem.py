@@ -124,7 +124,7 @@ class AwsemMapping(object):
     def map_traj(self, traj):
         """Return new Trajectory object with AWSEM topology and xyz"""
         # Direct slicing for CA, CB, O. 
-        cacbo_xyz = np.zeros((traj.n_frames, self.topology.n_atoms, 3))
+        cacbo_xyz = np.zeros((traj.n_frames, self.topology.n_atoms, 3), traj.xyz.dtype)
         cacbo_xyz[:, self._CACBO_idxs[:,1], :] = traj.xyz[:, self._CACBO_idxs[:,0], :]
         # HB is interpolated from other atoms.
         if not (len(self._HB_idxs) == 0):
@@ -396,20 +396,41 @@ class AwsemBackboneMapping(object):
 
     def map_traj(self, traj):
         """Map coarse-grained coordinates to all-atom backbone coordinates"""
-        newxyz = np.zeros((traj.n_frames, self.topology.n_atoms, 3))
-        newxyz[:,self._CACBO_idxs[:,1],:] = traj.xyz[:,self._CACBO_idxs[:,0]]
+        return md.Trajectory(self.map_xyz(traj.xyz), self.topology)
+
+    def map_xyz(self, xyz):
+        """Map a coarse-grained coordinate array to backbone coordinates
+
+        Parameters
+        ----------
+        xyz : array_like (n_frames, n_atoms, 3)
+            Coordinates of the three-bead (CA, CB, O) representation, e.g.
+            a np.memmap.
+
+        Returns
+        -------
+        newxyz : np.ndarray (n_frames, n_backbone_atoms, 3)
+        """
+        # Keep the precision of xyz (float32 for mdtraj) instead of upcasting.
+        xyz = np.asarray(xyz)
+        dtype = xyz.dtype
+        N_coeff = self._N_coeff.astype(dtype)
+        C_coeff = self._C_coeff.astype(dtype)
+        H_coeff = self._H_coeff.astype(dtype)
+        newxyz = np.zeros((xyz.shape[0], self.topology.n_atoms, 3), dtype)
+        newxyz[:,self._CACBO_idxs[:,1],:] = xyz[:,self._CACBO_idxs[:,0]]
 
         # interpolate N, C, and H
-        newxyz[:, self._N_idxs[:,3], :] = self._N_coeff[0]*traj.xyz[:, self._N_idxs[:,0], :] +\
-                                        self._N_coeff[1]*traj.xyz[:, self._N_idxs[:,1], :] +\
-                                        self._N_coeff[2]*traj.xyz[:, self._N_idxs[:,2], :]
-        newxyz[:, self._C_idxs[:,3], :] = self._C_coeff[0]*traj.xyz[:, self._C_idxs[:,0], :] +\
-                                        self._C_coeff[1]*traj.xyz[:, self._C_idxs[:,1], :] +\
-                                        self._C_coeff[2]*traj.xyz[:, self._C_idxs[:,2], :]
-        newxyz[:, self._H_idxs[:,3], :] = self._H_coeff[0]*traj.xyz[:, self._H_idxs[:,0], :] +\
-                                        self._H_coeff[1]*traj.xyz[:, self._H_idxs[:,1], :] +\
-                                        self._H_coeff[2]*traj.xyz[:, self._H_idxs[:,2], :]
-        return md.Trajectory(newxyz, self.topology)
+        newxyz[:, self._N_idxs[:,3], :] = N_coeff[0]*xyz[:, self._N_idxs[:,0], :] +\
+                                        N_coeff[1]*xyz[:, self._N_idxs[:,1], :] +\
+                                        N_coeff[2]*xyz[:, self._N_idxs[:,2], :]
+        newxyz[:, self._C_idxs[:,3], :] = C_coeff[0]*xyz[:, self._C_idxs[:,0], :] +\
+                                        C_coeff[1]*xyz[:, self._C_idxs[:,1], :] +\
+                                        C_coeff[2]*xyz[:, self._C_idxs[:,2], :]
+        newxyz[:, self._H_idxs[:,3], :] = H_coeff[0]*xyz[:, self._H_idxs[:,0], :] +\
+                                        H_coeff[1]*xyz[:, self._H_idxs[:,1], :] +\
+                                        H_coeff[2]*xyz[:, self._H_idxs[:,2], :]
+        return newxyz
 
 if __name__ == "__main__":
 
@@ -82,7 +82,8 @@ class CalphaCbetaMapping(object):
 
     def map_traj(self, traj):
         """Return new Trajectory object with cacb topology and xyz"""
-        cacb_xyz = np.zeros((traj.n_frames, self.topology.n_atoms, 3))
+        # Keep the precision of traj (float32 for mdtraj) instead of upcasting.
+        cacb_xyz = np.zeros((traj.n_frames, self.topology.n_atoms, 3), traj.xyz.dtype)
 
         for res in self.topology.residues:
             cacb_xyz[:,self._ca_idxs[res.index,1],:] = \
@@ -93,10 +94,10 @@ class CalphaCbetaMapping(object):
                 new_idx = self._sidechain_idxs[res.index][1]
                 sc_mass = self._sidechain_mass[res.index]
                 tot_mass = np.sum(sc_mass)
+                weights = (sc_mass/tot_mass).astype(traj.xyz.dtype)
 
                 res_frms = traj.xyz[:,old_idxs,:]
-                sc_com_xyz = np.array(map(lambda frm: \
-                        np.sum(frm.T*sc_mass/tot_mass, axis=1), res_frms))
+                sc_com_xyz = np.einsum("fak,a->fk", res_frms, weights)
 
                 cacb_xyz[:,new_idx,:] = sc_com_xyz
 
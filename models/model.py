@@ -5,9 +5,9 @@ from . import potentials
 
 class Model(object):
     """Model class """
-    def __init__(self, topology, bead_repr="CA"):
+    def __init__(self, topology, bead_repr="CA", storage="objects"):
         self.mapping = mappings.assign_mapping(bead_repr, topology)
-        self.Hamiltonian = potentials.Hamiltonian()
+        self.Hamiltonian = potentials.Hamiltonian(self.mapping.top, storage=storage)
 
     def describe(self):
         #TODO: What is the best description?
@@ -29,15 +29,39 @@ class Model(object):
         self.params_to_fit_indices = params_to_fit_indices
         self.fitted_epsilons = []
         self.fitted_function_types = []
+        epsilons = self.Hamiltonian._epsilons
+        function_types = self.Hamiltonian._pair_function_type_labels
         for i in params_to_fit_indices:
-            self.fitted_epsilons.append(self.Hamiltonian._epsilons[i])
-            self.fitted_function_types.append(self.Hamiltonian._pair_function_type_labels[i])
+            self.fitted_epsilons.append(epsilons[i])
+            self.fitted_function_types.append(function_types[i])
+
+    def set_precision(self, precision="double", accumulate="double"):
+        """Floating point precision of energy evaluations
+
+        See Hamiltonian.set_precision.
+        """
+        self.Hamiltonian.set_precision(precision, accumulate)
+
+    def calc_dV_depsilons(self, traj, out=None):
+        """dV/deps matrix (n_frames, n_params) of the fitted epsilons
+
+        See Hamiltonian.calc_dV_depsilons.
+        """
+        return self.Hamiltonian.calc_dV_depsilons(traj,
+                    params_to_fit_indices=self.params_to_fit_indices, out=out)
 
     def output_epsilons(self):
         params = self.Hamiltonian._epsilons
         for idx, i in enumerate(self.params_to_fit_indices):
             params[i] = self.fitted_epsilons[idx]
 
+        # The file has one line per pair, so every pair needs an epsilon.
+        missing = np.isnan(params)
+        if np.any(missing):
+            labels = np.array(self.Hamiltonian._pair_function_type_labels)[missing]
+            raise ValueError("Can't write params: {} pairs have no epsilon ({})".format(
+                                np.sum(missing), ", ".join(sorted(set(labels)))))
+
         f = open("params", "w")
         f.write("# Fitted Parameters\n")
         for param in params:
@@ -54,8 +54,7 @@ class GromacsFiles(object):
         self._tabled_pots = []
         self._tables = []
         self._tablenames = []
-        for i in range(self.model.Hamiltonian.n_pairs):
-            pot = self.model.Hamiltonian._pairs[i]
+        for pot in self.model.Hamiltonian.pairs:
             if not self._check_supported(pot):
                 self._tabled_pots.append(pot)
 
@@ -271,10 +270,10 @@ class GromacsFiles(object):
         else:
             pairs_top = " [ pairs ]\n"
             pairs_top += " ;   i      j type      c10               c12  \n"
-            for i in range(self.model.Hamiltonian.n_pairs):
-                pot = self.model.Hamiltonian._pairs[i]
+            for pot in self.model.Hamiltonian.pairs:
                 # How are LJ126 interactions defined? By atomtypes(?)
-                if pot not in self._tabled_pots:
+                # Unsupported potentials were written as tables instead.
+                if self._check_supported(pot):
                     atm_idxs = "{:>6} {:>6}".format(pot.atmi.index + 1, pot.atmj.index + 1)
                     if pot.prefix_label == "LJ1210":
                         func = 1
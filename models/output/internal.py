@@ -34,6 +34,9 @@ class InternalFiles(object):
         suffix : str, Default=""
             Save the files with some suffix. e.g. sufix="_test" saves
             model_builder_test and pairwise_params_test
+        
+        Raises ValueError if a pair has no epsilon (e.g. FLATWELL, CUSTOM),
+        as model_params holds one epsilon for each pair.
                 
         """        
        
@@ -51,7 +54,7 @@ class InternalFiles(object):
     def _generate_pairwise_string(self):
         pairwise_string = "#    pairs         param         potential_type   other_params\n"
         count = 0
-        for pot in self.model.Hamiltonian._pairs:
+        for pot in self.model.Hamiltonian.pairs:
             index_i = pot.atmi.index + 1
             index_j = pot.atmj.index + 1
             potential_type = pot.prefix_label
@@ -70,8 +73,16 @@ class InternalFiles(object):
         return pairwise_string
     
     def _generate_model_params_string(self):
+        # Line k holds the epsilon of pair k, so every pair needs one.
+        epsilons = self.model.Hamiltonian._epsilons
+        missing = np.isnan(epsilons)
+        if np.any(missing):
+            labels = np.array(self.model.Hamiltonian._pair_function_type_labels)[missing]
+            raise ValueError("Can't write model_params: {} pairs have no epsilon ({})".format(
+                                np.sum(missing), ", ".join(sorted(set(labels)))))
+
         model_params_string = "# model parameters\n"
-        for idx,eps in enumerate(self.model.Hamiltonian._epsilons):
+        for idx,eps in enumerate(epsilons):
             model_params_string += "%f\n" % eps
             
         return model_params_string
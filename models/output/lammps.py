@@ -63,15 +63,13 @@ class LammpsFiles(object):
         top_string += "\n"
 
         top_string += "Bond Coeffs\n\n"
-        for i in range(self.model.Hamiltonian.n_bonds):
+        for i, bond in enumerate(self.model.Hamiltonian.bonds):
             # CHECK UNITS
-            bond = self.model.Hamiltonian._bonds[i]
             top_string += "{:>12d} {:>6.3f} {:>6.3f}\n".format(i + 1, bond.kb, bond.r0*10.)
         top_string += "\n"
 
         top_string += "Bonds\n\n"
-        for i in range(self.model.Hamiltonian.n_bonds):
-            bond = self.model.Hamiltonian._bonds[i]
+        for i, bond in enumerate(self.model.Hamiltonian.bonds):
             top_string += "{:>11d} {:>5d} {:>5d} {:>5d}\n".format(i + 1, i + 1, bond.atmi.index + 1, bond.atmj.index + 1)
         top_string += "\n"
 
@@ -5,4 +5,11 @@ from .awsemhamiltonian import AwsemHamiltonian
 
 from . import pairwise
 from . import bonded
+from . import compiled
+from . import storage
+from . import geometry
+from . import reweighting
+from . import accumulators
+from . import tabulated
+from . import kernels
 from . import awsem
@@ -0,0 +1,175 @@
+"""Running statistics of energy derivatives over long trajectories"""
+
+import numpy as np
+
+from . import geometry
+
+class DerivativeAccumulator(object):
+
+    def __init__(self, hamiltonian, params_to_fit_indices=None, n_observables=0,
+                 selection=None):
+        """Running mean and covariance of dV/deps over streamed frames
+
+        Each chunk of frames is reduced to its mean and centered sums of
+        products (one matrix product per chunk), which are merged into the
+        running totals with the pairwise update of Chan et al. Only the
+        (n_params, n_params) sums are kept, never the (n_frames, n_params)
+        matrix. Accumulators of separate workers are combined with merge.
+
+        Parameters
+        ----------
+        hamiltonian : Hamiltonian
+
+        params_to_fit_indices : array(int) (opt.)
+            Indices of the fitted pairs, see Model.assign_fitted_epsilons.
+            Default is all pairs.
+        n_observables : int (opt.)
+            Number of observables to keep cross-covariances with.
+        selection : storage.ParameterSelection or str (opt.)
+            Accumulate the derivatives with respect to these parameters
+            instead of the epsilons, see Hamiltonian.calc_dV_dparams.
+
+        """
+        if (selection is not None) and (params_to_fit_indices is not None):
+            raise ValueError("Give either params_to_fit_indices or selection")
+        if isinstance(selection, str):
+            selection = hamiltonian.select_parameters(selection)
+        if (params_to_fit_indices is None) and (selection is None):
+            params_to_fit_indices = np.arange(hamiltonian.compile().n_pairs)
+
+        self.hamiltonian = hamiltonian
+        self.selection = selection
+        if selection is None:
+            self.params_to_fit_indices = np.asarray(params_to_fit_indices, int)
+            n_params = len(self.params_to_fit_indices)
+        else:
+            self.params_to_fit_indices = None
+            n_params = len(selection)
+
+        self.n_frames = 0
+        self._mean = np.zeros(n_params, float)
+        self._M2 = np.zeros((n_params, n_params), float)
+        self._obs_mean = np.zeros(n_observables, float)
+        self._obs_M2 = np.zeros((n_observables, n_observables), float)
+        self._cross_M2 = np.zeros((n_params, n_observables), float)
+
+    @property
+    def n_params(self):
+        return self._mean.shape[0]
+
+    @property
+    def n_observables(self):
+        return self._obs_mean.shape[0]
+
+    def add_traj(self, traj, observables=None, chunk_size=None):
+        """Add the frames of a trajectory
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        observables : function (opt.)
+            Called with each chunk of traj, returns an array of shape
+            (n_chunk_frames, n_observables).
+        chunk_size : int (opt.)
+            Number of frames evaluated at once. By default as many as keep
+            the derivatives of a chunk to 2**24 values (see
+            geometry.frames_per_chunk).
+        """
+        if chunk_size is None:
+            chunk_size = geometry.frames_per_chunk(self.n_params)
+        for frames in geometry.frame_chunks(traj.n_frames, chunk_size):
+            chunk = traj[frames]
+            if self.selection is None:
+                dVdeps = self.hamiltonian.calc_dV_depsilons(chunk, self.params_to_fit_indices)
+            else:
+                dVdeps = self.hamiltonian.calc_dV_dparams(chunk, self.selection)
+            obs = None if observables is None else observables(chunk)
+            self.add_chunk(dVdeps, obs)
+
+    def add_chunk(self, dVdeps, obs=None):
+        """Add frames given their dV/deps and observables
+
+        Parameters
+        ----------
+        dVdeps : np.ndarray (n_chunk_frames, n_params)
+
+        obs : np.ndarray (n_chunk_frames, n_observables) (opt.)
+            Required if the accumulator keeps observables.
+        """
+        dVdeps = np.asarray(dVdeps, float)
+        n = dVdeps.shape[0]
+        if obs is None:
+            if self.n_observables > 0:
+                raise ValueError("Expected {} observables for each frame".format(self.n_observables))
+            obs = np.zeros((n, 0), float)
+        obs = np.asarray(obs, float).reshape(n, -1)
+        if n == 0:
+            return
+
+        mean = np.mean(dVdeps, axis=0)
+        obs_mean = np.mean(obs, axis=0)
+        centered = dVdeps - mean
+        obs_centered = obs - obs_mean
+
+        chunk = DerivativeAccumulator.__new__(DerivativeAccumulator)
+        chunk.n_frames = n
+        chunk._mean = mean
+        chunk._M2 = np.dot(centered.T, centered)
+        chunk._obs_mean = obs_mean
+        chunk._obs_M2 = np.dot(obs_centered.T, obs_centered)
+        chunk._cross_M2 = np.dot(centered.T, obs_centered)
+        self.merge(chunk)
+
+    def merge(self, other):
+        """Add the frames accumulated by another accumulator
+
+        Parameters
+        ----------
+        other : DerivativeAccumulator
+            Accumulator over the same parameters and observables, e.g. from
+            a separate worker.
+
+        Returns
+        -------
+        self : DerivativeAccumulator
+        """
+        if (other._M2.shape != self._M2.shape) or (other._cross_M2.shape != self._cross_M2.shape):
+            raise ValueError("Can't merge accumulators of different parameters or observables")
+        if other.n_frames == 0:
+            return self
+
+        n = self.n_frames + other.n_frames
+        factor = float(self.n_frames)*other.n_frames/n
+        delta = other._mean - self._mean
+        obs_delta = other._obs_mean - self._obs_mean
+
+        self._M2 += other._M2 + factor*np.outer(delta, delta)
+        self._obs_M2 += other._obs_M2 + factor*np.outer(obs_delta, obs_delta)
+        self._cross_M2 += other._cross_M2 + factor*np.outer(delta, obs_delta)
+        self._mean += delta*(float(other.n_frames)/n)
+        self._obs_mean += obs_delta*(float(other.n_frames)/n)
+        self.n_frames = n
+        return self
+
+    @property
+    def mean(self):
+        """Mean of dV/deps, (n_params,)"""
+        return self._mean.copy()
+
+    @property
+    def observable_mean(self):
+        """Mean of the observables, (n_observables,)"""
+        return self._obs_mean.copy()
+
+    def covariance(self, ddof=0):
+        """Covariance of dV/deps, (n_params, n_params)"""
+        return self._M2/(self.n_frames - ddof)
+
+    def observable_covariance(self, ddof=0):
+        """Covariance of the observables, (n_observables, n_observables)"""
+        return self._obs_M2/(self.n_frames - ddof)
+
+    def cross_covariance(self, ddof=0):
+        """Covariance of dV/deps with the observables, (n_params, n_observables)"""
+        return self._cross_M2/(self.n_frames - ddof)
@@ -9,6 +9,8 @@ from model_builder.models.mappings import AwsemBackboneMapping
 
 from . import util
 from . import awsem
+from . import compiled
+from . import geometry
 
 class AwsemHamiltonian(object):
 
@@ -38,6 +40,7 @@ class AwsemHamiltonian(object):
         self.three_bead_topology = three_bead_topology
         self.backbone_mapping = AwsemBackboneMapping(three_bead_topology)
         self.topology = self.backbone_mapping.topology
+        self._precision = compiled.precision_dtypes()
 
         self._get_terminal_residues()
 
@@ -45,6 +48,38 @@ class AwsemHamiltonian(object):
     def top(self):
         return self.topology
 
+    def _xyz(self, traj):
+        """Coordinates of a Trajectory, or an xyz array with a frame axis
+
+        Arrays are used as they are, e.g. a np.memmap, and like the mapped
+        backbone trajectories they have no periodic box.
+        """
+        if isinstance(traj, md.Trajectory):
+            return traj.xyz
+        xyz = np.asarray(traj)
+        return xyz[np.newaxis] if xyz.ndim == 2 else xyz
+
+    def _backbone_xyz(self, traj):
+        """Backbone coordinates of a three-bead Trajectory or xyz array"""
+        return self.backbone_mapping.map_xyz(self._xyz(traj))
+
+    def set_precision(self, precision="double", accumulate="double"):
+        """Floating point precision of the energy arrays
+
+        With precision="single" local densities and per-interaction energies
+        are stored in float32, like the coordinates from mdtraj and the
+        backbone mapping. Total energies are summed in the accumulate
+        precision.
+
+        Parameters
+        ----------
+        precision : str [single, double] (opt.)
+
+        accumulate : str [single, double] (opt.)
+
+        """
+        self._precision = compiled.precision_dtypes(precision, accumulate)
+
     def _set_charged_residues(self, charged_residues):
         self._charged_residues = charged_residues
 
@@ -572,42 +607,43 @@ class AwsemHamiltonian(object):
 #            local_density[:,i] = np.sum(direct.theta_I(md.compute_distances(traj, pairs)), axis=1)
 #        return local_density
 
-    def _calculate_local_density(self, traj):
+    def _calculate_local_density(self, xyz):
         """Calculate local protein density around each residue"""
 
-        local_density = np.zeros((traj.n_frames, traj.n_residues))
+        top = self.topology
+        local_density = np.zeros((xyz.shape[0], top.n_residues), self._precision["dtype"])
         direct = self.potential_forms["DIRECT"]
 
         is_gly_ca = lambda atom: ((atom.residue.name == "GLY") and (atom.name == "CA"))
         is_other_cb = lambda atom: ((atom.residue.name != "GLY") and (atom.name == "CB"))
         not_neighbors = lambda atom, idxs: not (atom.residue.index in idxs)
 
-        for i in range(traj.n_residues):
+        for i in range(top.n_residues):
             # compute local density of residue
-            res = traj.top.residue(i)
+            res = top.residue(i)
             if res.name == "GLY":
-                idx1 = traj.top.select("resid {} and name CA".format(res.index))
+                idx1 = top.select("resid {} and name CA".format(res.index))[0]
             else:
-                idx1 = traj.top.select("resid {} and name CB".format(res.index))
+                idx1 = top.select("resid {} and name CB".format(res.index))[0]
 
             # If terminal
             if res.index in self._n_terminal_residues:
-                pairs = np.array([ [idx1, atom.index] for atom in traj.top.atoms \
+                pairs = np.array([ [idx1, atom.index] for atom in top.atoms \
                         if is_gly_ca(atom) and not_neighbors(atom, [res.index, res.index + 1]) ] +\
-                        [ [idx1, atom.index] for atom in traj.top.atoms \
+                        [ [idx1, atom.index] for atom in top.atoms \
                         if is_other_cb(atom) and not_neighbors(atom, [res.index, res.index + 1]) ])
             elif res.index in self._c_terminal_residues:
-                pairs = np.array([ [idx1, atom.index] for atom in traj.top.atoms \
+                pairs = np.array([ [idx1, atom.index] for atom in top.atoms \
                         if is_gly_ca(atom) and not_neighbors(atom, [res.index, res.index - 1]) ] +\
-                        [ [idx1, atom.index] for atom in traj.top.atoms \
+                        [ [idx1, atom.index] for atom in top.atoms \
                         if is_other_cb(atom) and not_neighbors(atom, [res.index, res.index - 1]) ])
             else:
-                pairs = np.array([ [idx1, atom.index] for atom in traj.top.atoms \
+                pairs = np.array([ [idx1, atom.index] for atom in top.atoms \
                         if is_gly_ca(atom) and not_neighbors(atom, [res.index - 1, res.index, res.index + 1]) ] +\
-                        [ [ idx1, atom.index] for atom in traj.top.atoms \
+                        [ [ idx1, atom.index] for atom in top.atoms \
                         if is_other_cb(atom) and not_neighbors(atom, [res.index - 1, res.index, res.index + 1]) ])
 
-            local_density[:,i] = np.sum(direct.theta_I(md.compute_distances(traj, pairs)), axis=1)
+            local_density[:,i] = np.sum(direct.theta_I(geometry.distances(xyz, pairs)), axis=1)
         return local_density
 
     def calculate_burial_energy(self, traj, local_density=None, total=True):
@@ -615,8 +651,9 @@ class AwsemHamiltonian(object):
 
         Parameters
         ----------
-        traj : mdtraj.Trajectory
-            Trajectory to calculate energy over.
+        traj : mdtraj.Trajectory or np.ndarray (n_frames, n_atoms, 3)
+            Trajectory to calculate energy over, or the coordinates of its
+            three-bead representation without a periodic box.
         local_density : np.ndarray (traj.n_frames, traj.n_residues)
             Local protein density around each residue for all frames in traj.
         sum : opt, bool
@@ -626,15 +663,15 @@ class AwsemHamiltonian(object):
         burial = self.potential_forms["BURIAL"]
 
         if local_density is None:
-            bb_traj = self.backbone_mapping.map_traj(traj)
-            res_local_density = self._calculate_local_density(bb_traj)
+            res_local_density = self._calculate_local_density(self._backbone_xyz(traj))
         else:
             res_local_density = local_density
 
+        n_frames = res_local_density.shape[0]
         if total:
-            Vburial = np.zeros(traj.n_frames, float)
+            Vburial = np.zeros(n_frames, self._precision["accumulate"])
         else:
-            Vburial = np.zeros((traj.n_frames, self.top.n_residues), float)
+            Vburial = np.zeros((n_frames, self.top.n_residues), self._precision["dtype"])
 
         for i in range(self.top.n_residues):
             if total:
@@ -649,8 +686,9 @@ class AwsemHamiltonian(object):
 
         Parameters
         ----------
-        traj : mdtraj.Trajectory
-            Trajectory to calculate energy over.
+        traj : mdtraj.Trajectory or np.ndarray (n_frames, n_atoms, 3)
+            Trajectory to calculate energy over, or the coordinates of its
+            three-bead representation without a periodic box.
         total : opt, bool
             If true (default) return the sum of the burial potentials. If
             false, return the burial energy of each individual residue.
@@ -661,13 +699,13 @@ class AwsemHamiltonian(object):
         """
         direct = self.potential_forms["DIRECT"]
 
-        bb_traj = self.backbone_mapping.map_traj(traj)
-        r = md.compute_distances(bb_traj, self._contact_pairs)
+        bb_xyz = self._backbone_xyz(traj)
+        r = geometry.distances(bb_xyz, self._contact_pairs)
 
         if total:
-            Vdirect = np.zeros(bb_traj.n_frames, float)
+            Vdirect = np.zeros(bb_xyz.shape[0], self._precision["accumulate"])
         else:
-            Vdirect = np.zeros((bb_traj.n_frames, self.n_pairs), float)
+            Vdirect = np.zeros((bb_xyz.shape[0], self.n_pairs), self._precision["dtype"])
 
         for i in range(self.n_pairs):
             if dgamma:
@@ -686,8 +724,9 @@ class AwsemHamiltonian(object):
 
         Parameters
         ----------
-        traj : mdtraj.Trajectory
-            Trajectory to calculate energy over.
+        traj : mdtraj.Trajectory or np.ndarray (n_frames, n_atoms, 3)
+            Trajectory to calculate energy over, or the coordinates of its
+            three-bead representation without a periodic box.
         total : opt, bool
             If true (default) return the sum of the burial potentials. If
             false, return the burial energy of each individual residue.
@@ -699,22 +738,22 @@ class AwsemHamiltonian(object):
         """
         water = self.potential_forms["WATER"]
 
-        bb_traj = self.backbone_mapping.map_traj(traj)
-        r = md.compute_distances(bb_traj, self._contact_pairs)
+        bb_xyz = self._backbone_xyz(traj)
+        r = geometry.distances(bb_xyz, self._contact_pairs)
 
         if local_density is None:
-            res_local_density = self._calculate_local_density(bb_traj)
+            res_local_density = self._calculate_local_density(bb_xyz)
         else:
             res_local_density = local_density
 
         if total:
-            Vwater = np.zeros(bb_traj.n_frames, float)
+            Vwater = np.zeros(bb_xyz.shape[0], self._precision["accumulate"])
         else:
-            Vwater = np.zeros((bb_traj.n_frames, self.n_pairs), float)
+            Vwater = np.zeros((bb_xyz.shape[0], self.n_pairs), self._precision["dtype"])
 
         if split:
-            split_water = np.zeros((bb_traj.n_frames, self.n_pairs), float)
-            split_protein = np.zeros((bb_traj.n_frames, self.n_pairs), float)
+            split_water = np.zeros((bb_xyz.shape[0], self.n_pairs), self._precision["dtype"])
+            split_protein = np.zeros((bb_xyz.shape[0], self.n_pairs), self._precision["dtype"])
 
         for i in range(self.n_pairs):
             rhoi = res_local_density[:,self._contact_res_idxs[i,0]]
@@ -744,22 +783,23 @@ class AwsemHamiltonian(object):
 
         Parameters
         ----------
-        traj : mdtraj.Trajectory
-            Trajectory to calculate energy over.
+        traj : mdtraj.Trajectory or np.ndarray (n_frames, n_atoms, 3)
+            Trajectory to calculate energy over, or the coordinates of its
+            three-bead representation without a periodic box.
         sum : opt, bool
             If true (default) return the sum of the burial potentials. If
             false, return the burial energy of each individual residue.
         """
         debye = self.potential_forms["DEBYE"]
 
-        bb_traj = self.backbone_mapping.map_traj(traj)
+        bb_xyz = self._backbone_xyz(traj)
 
-        r = md.compute_distances(bb_traj, self._debye_pairs)
+        r = geometry.distances(bb_xyz, self._debye_pairs)
 
         if total:
-            Vdebye = np.zeros(bb_traj.n_frames, float)
+            Vdebye = np.zeros(bb_xyz.shape[0], self._precision["accumulate"])
         else:
-            Vdebye = np.zeros((bb_traj.n_frames, self.n_debye_pairs), float)
+            Vdebye = np.zeros((bb_xyz.shape[0], self.n_debye_pairs), self._precision["dtype"])
 
         for i in range(self.n_debye_pairs):
             qi = self._debye_charges[i,0]
@@ -776,8 +816,9 @@ class AwsemHamiltonian(object):
 
         Parameters
         ----------
-        traj : mdtraj.Trajectory
-            Trajectory to calculate energy over.
+        traj : mdtraj.Trajectory or np.ndarray (n_frames, n_atoms, 3)
+            Trajectory to calculate energy over, or the coordinates of its
+            three-bead representation without a periodic box.
         local_density : np.ndarray (traj.n_frames, traj.n_residues)
             Local protein density around each residue for all frames in traj.
         sum : opt, bool
@@ -786,20 +827,20 @@ class AwsemHamiltonian(object):
         """
         helix = self.potential_forms["HELIX"]
 
-        bb_traj = self.backbone_mapping.map_traj(traj)
+        bb_xyz = self._backbone_xyz(traj)
 
-        r_ON = md.compute_distances(bb_traj, self._helix_ON_pairs)
-        r_OH = md.compute_distances(bb_traj, self._helix_OH_pairs)
+        r_ON = geometry.distances(bb_xyz, self._helix_ON_pairs)
+        r_OH = geometry.distances(bb_xyz, self._helix_OH_pairs)
 
         if local_density is None:
-            res_local_density = self._calculate_local_density(bb_traj)
+            res_local_density = self._calculate_local_density(bb_xyz)
         else:
             res_local_density = local_density
 
         if total:
-            Vhelix = np.zeros(bb_traj.n_frames, float)
+            Vhelix = np.zeros(bb_xyz.shape[0], self._precision["accumulate"])
         else:
-            Vhelix = np.zeros((bb_traj.n_frames, self.n_alpha_helix), float)
+            Vhelix = np.zeros((bb_xyz.shape[0], self.n_alpha_helix), self._precision["dtype"])
 
         for i in range(self.n_alpha_helix):
             rhoi = res_local_density[:,self._helix_res_idxs[i,0]]
@@ -817,8 +858,9 @@ class AwsemHamiltonian(object):
 
         Parameters
         ----------
-        traj : mdtraj.Trajectory
-            Trajectory to calculate energy over.
+        traj : mdtraj.Trajectory or np.ndarray (n_frames, n_atoms, 3)
+            Trajectory to calculate energy over, or the coordinates of its
+            three-bead representation without a periodic box.
         sum : opt, bool
             If true (default) return the sum of the burial potentials. If
             false, return the burial energy of each individual residue.
@@ -826,16 +868,16 @@ class AwsemHamiltonian(object):
         rama = self.potential_forms["RAMA"]
         pro_rama = self.potential_forms["RAMA_PROLINE"]
 
-        bb_traj = self.backbone_mapping.map_traj(traj)
+        bb_xyz = self._backbone_xyz(traj)
 
         # where does AWSEM define 0.
-        phi = md.compute_dihedrals(bb_traj, self._phi_idxs)
-        psi = md.compute_dihedrals(bb_traj, self._psi_idxs)
+        phi = geometry.dihedrals(bb_xyz, self._phi_idxs)
+        psi = geometry.dihedrals(bb_xyz, self._psi_idxs)
 
         if total:
-            Vrama = np.zeros(bb_traj.n_frames, float)
+            Vrama = np.zeros(bb_xyz.shape[0], self._precision["accumulate"])
         else:
-            Vrama = np.zeros((bb_traj.n_frames, self.n_phi + self.n_pro_phi), float)
+            Vrama = np.zeros((bb_xyz.shape[0], self.n_phi + self.n_pro_phi), self._precision["dtype"])
 
         for i in range(self.n_phi):
             if total:
@@ -844,8 +886,8 @@ class AwsemHamiltonian(object):
                 Vrama[:, i] = rama.V(phi[:,i], psi[:,i])
 
         if self.n_pro_phi > 0:
-            pro_phi = md.compute_dihedrals(bb_traj, self._pro_phi_idxs)
-            pro_psi = md.compute_dihedrals(bb_traj, self._pro_psi_idxs)
+            pro_phi = geometry.dihedrals(bb_xyz, self._pro_phi_idxs)
+            pro_psi = geometry.dihedrals(bb_xyz, self._pro_psi_idxs)
             for i in range(self.n_pro_phi):
                 if total:
                     Vrama += pro_rama.V(pro_phi[:,i], pro_psi[:,i])
@@ -912,8 +954,9 @@ class AwsemHamiltonian(object):
 
         Parameters
         ----------
-        traj : mdtraj.Trajectory
-            Trajectory to calculate energy over.
+        traj : mdtraj.Trajectory or np.ndarray (n_frames, n_atoms, 3)
+            Trajectory to calculate energy over, or the coordinates of its
+            three-bead representation without a periodic box.
         total : opt, bool
             If true (default) return the sum of the burial potentials. If
             false, return the burial energy of each individual residue.
@@ -927,7 +970,8 @@ class AwsemHamiltonian(object):
 
         energy_list = []
         for idx, potential in enumerate(self.fragment_potentials):
-            distances = md.compute_distances(traj, potential.atom_pair_indices, periodic=False) * 10.
+            distances = geometry.distances(self._xyz(traj),
+                                           np.asarray(potential.atom_pair_indices)) * 10.
             if dgamma:
                 energy = potential.dVdgamma(distances)
             else:
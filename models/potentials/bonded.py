@@ -7,14 +7,44 @@ import numpy as np
 #############################################################################
 class BondPotential(object):
 
+    # Constructor arguments that parameterize the potential, in order.
+    _param_names = ()
+
+    # Leading _param_names that also identify the interaction (see _key), so
+    # terms on the same atoms with other parameters are kept apart.
+    _key_param_names = ()
+
     def __init__(self, atmi, atmj):
         self.atmi = atmi
         self.atmj = atmj
 
+    @classmethod
+    def block(cls, *params):
+        """Potential for a family of bonds evaluated all at once
+
+        Parameters
+        ----------
+        *params : array(float)
+            One array of shape (n_bonds,) for each name in _param_names.
+        """
+        return cls(None, None, *params)
+
+    def dV_dparam(self, r, name):
+        """dV/dparam for the parameter name, one of _param_names"""
+        if name not in self._param_names:
+            raise ValueError("{} has no parameter {}".format(self.prefix_label, name))
+        return getattr(self, "dVd" + name)(r)
+
     def describe(self):
         """interaction description"""
         return "{}:{:>12}{:>12}".format(self.prefix_label, self.atmi, self.atmj)
 
+    def _key(self):
+        """Identifies the interaction in a Hamiltonian, regardless of order"""
+        i, j = self.atmi.index, self.atmj.index
+        return ((self.prefix_label, min(i, j), max(i, j)) +
+                tuple( getattr(self, name) for name in self._key_param_names ))
+
     def __hash__(self):
         hash_value = hash(self.prefix_label)
         hash_value ^= hash(self.atmi)
@@ -27,6 +57,9 @@ class BondPotential(object):
 
 class HarmonicBondPotential(BondPotential):
 
+    _param_names = ("kb", "r0")
+    _key_param_names = ("kb", "r0")
+
     def __init__(self, atmi, atmj, kb, r0):
         BondPotential.__init__(self, atmi, atmj)
         self.prefix_label = "HARMONIC_BOND"
@@ -45,24 +78,59 @@ class HarmonicBondPotential(BondPotential):
     def d2Vdrdkb(self, r): 
         return (r - self.r0)
 
+    def d2Vdr2(self, r):
+        return self.kb*np.ones(np.shape(r))
+
+    def dVdr0(self, r):
+        return -self.kb*(r - self.r0)
+
     def __hash__(self):
-        return hash(frozenset(self.__dict__.items()))
+        hash_value = BondPotential.__hash__(self)
+        hash_value ^= hash(self.kb)
+        hash_value ^= hash(self.r0)
+        return hash_value
 
 ############################################################################
 # Angle potentials
 ############################################################################
 class AnglePotential(object):
 
+    _param_names = ()
+    _key_param_names = ()
+
     def __init__(self, atmi, atmj, atmk):
         self.atmi = atmi
         self.atmj = atmj
         self.atmk = atmk
 
+    @classmethod
+    def block(cls, *params):
+        """Potential for a family of angles evaluated all at once
+
+        Parameters
+        ----------
+        *params : array(float)
+            One array of shape (n_angles,) for each name in _param_names.
+        """
+        return cls(None, None, None, *params)
+
+    def dV_dparam(self, theta, name):
+        """dV/dparam for the parameter name, one of _param_names"""
+        if name not in self._param_names:
+            raise ValueError("{} has no parameter {}".format(self.prefix_label, name))
+        return getattr(self, "dVd" + name)(theta)
+
     def describe(self):
         """interaction description"""
         return "{}:{:>12}{:>12}{:>12}".format(
                 self.prefix_label, self.atmi, self.atmj, self.atmk)
 
+    def _key(self):
+        """Identifies the interaction in a Hamiltonian, regardless of order"""
+        idxs = (self.atmi.index, self.atmj.index, self.atmk.index)
+        return ((self.prefix_label,) + min(idxs, idxs[::-1]) +
+                tuple( getattr(self, name) for name in self._key_param_names ))
+
     def __hash__(self):
         hash_value = hash(self.prefix_label)
         hash_value ^= hash(self.atmi)
@@ -75,6 +143,9 @@ class AnglePotential(object):
 
 class HarmonicAnglePotential(AnglePotential):
 
+    _param_names = ("ka", "theta0")
+    _key_param_names = ("ka", "theta0")
+
     def __init__(self, atmi, atmj, atmk, ka, theta0):
         AnglePotential.__init__(self, atmi, atmj, atmk)
         self.prefix_label = "HARMONIC_ANGLE"
@@ -93,6 +164,12 @@ class HarmonicAnglePotential(AnglePotential):
     def d2Vdthetadka(self, theta): 
         return (theta - self.theta0)
 
+    def d2Vdtheta2(self, theta):
+        return self.ka*np.ones(np.shape(theta))
+
+    def dVdtheta0(self, theta):
+        return -self.ka*(theta - self.theta0)
+
     def __hash__(self):
         hash_value = AnglePotential.__hash__(self)
         hash_value ^= hash(self.ka)
@@ -104,17 +181,43 @@ class HarmonicAnglePotential(AnglePotential):
 ############################################################################
 class DihedralPotential(object):
 
+    _param_names = ()
+    _key_param_names = ()
+
     def __init__(self, atmi, atmj, atmk, atml):
         self.atmi = atmi
         self.atmj = atmj
         self.atmk = atmk
         self.atml = atml
 
+    @classmethod
+    def block(cls, *params):
+        """Potential for a family of dihedrals evaluated all at once
+
+        Parameters
+        ----------
+        *params : array(float)
+            One array of shape (n_dihedrals,) for each name in _param_names.
+        """
+        return cls(None, None, None, None, *params)
+
+    def dV_dparam(self, phi, name):
+        """dV/dparam for the parameter name, one of _param_names"""
+        if name not in self._param_names:
+            raise ValueError("{} has no parameter {}".format(self.prefix_label, name))
+        return getattr(self, "dVd" + name)(phi)
+
     def describe(self):
         """interaction description"""
         return "{}:{:>12}{:>12}{:>12}{:>12}".format(
                 self.prefix_label, self.atmi, self.atmj, self.atmk, self.atml)
 
+    def _key(self):
+        """Identifies the interaction in a Hamiltonian, regardless of order"""
+        idxs = (self.atmi.index, self.atmj.index, self.atmk.index, self.atml.index)
+        return ((self.prefix_label,) + min(idxs, idxs[::-1]) +
+                tuple( getattr(self, name) for name in self._key_param_names ))
+
     def __hash__(self):
         hash_value = hash(self.prefix_label)
         hash_value ^= hash(self.atmi)
@@ -128,6 +231,9 @@ class DihedralPotential(object):
 
 class HarmonicDihedralPotential(DihedralPotential):
 
+    _param_names = ("kd", "phi0")
+    _key_param_names = ("kd", "phi0")
+
     def __init__(self, atmi, atmj, atmk, atml, kd, phi0):
         DihedralPotential.__init__(self, atmi, atmj, atmk, atml)
         self.prefix_label = "HARMONIC_DIHEDRAL"
@@ -146,6 +252,12 @@ class HarmonicDihedralPotential(DihedralPotential):
     def d2Vdphidkd(self, phi): 
         return (phi - self.phi0)
 
+    def d2Vdphi2(self, phi):
+        return self.kd*np.ones(np.shape(phi))
+
+    def dVdphi0(self, phi):
+        return -self.kd*(phi - self.phi0)
+
     def __hash__(self):
         hash_value = DihedralPotential.__hash__(self)
         hash_value ^= hash(self.prefix_label) 
@@ -155,6 +267,10 @@ class HarmonicDihedralPotential(DihedralPotential):
 
 class CosineDihedralPotential(DihedralPotential):
 
+    _param_names = ("kd", "phi0", "mult")
+    _key_param_names = ("kd", "phi0", "mult")
+    _int_param_names = ("mult",)
+
     def __init__(self, atmi, atmj, atmk, atml, kd, phi0, mult):
         DihedralPotential.__init__(self, atmi, atmj, atmk, atml)
         self.prefix_label = "COSINE_DIHEDRAL"
@@ -174,6 +290,16 @@ class CosineDihedralPotential(DihedralPotential):
     def d2Vdphidkd(self, phi): 
         return self.mult*np.sin(self.mult*(phi - self.phi0))
 
+    def d2Vdphi2(self, phi):
+        return self.kd*(self.mult**2)*np.cos(self.mult*(phi - self.phi0))
+
+    def dVdphi0(self, phi):
+        return -self.kd*self.d2Vdphidkd(phi)
+
+    def dVdmult(self, phi):
+        # As if the multiplicity were continuous.
+        return self.kd*(phi - self.phi0)*np.sin(self.mult*(phi - self.phi0))
+
     def __hash__(self):
         hash_value = DihedralPotential.__hash__(self)
         hash_value ^= hash(self.prefix_label) 
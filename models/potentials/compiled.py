@@ -0,0 +1,350 @@
+"""Array-backed snapshot of a Hamiltonian"""
+
+import numpy as np
+
+from . import pairwise
+from . import kernels
+from . import neighbors
+from . import tabulated
+
+PRECISIONS = {"single":np.float32, "double":np.float64}
+
+def precision_dtypes(precision="double", accumulate="double"):
+    """Types of per-interaction values and of sums for a precision setting
+
+    Parameters
+    ----------
+    precision : str [single, double] (opt.)
+
+    accumulate : str [single, double] (opt.)
+
+    Returns
+    -------
+    dtypes : dict
+        "dtype" and "accumulate" numpy types.
+    """
+    for name, value in [("precision", precision), ("accumulate", accumulate)]:
+        if value not in PRECISIONS:
+            raise ValueError("{} must be 'single' or 'double', not {}".format(name, value))
+    return {"dtype":PRECISIONS[precision], "accumulate":PRECISIONS[accumulate]}
+
+def _readonly(array):
+    array.flags.writeable = False
+    return array
+
+def _labels(table):
+    if len(table) == 0:
+        return _readonly(np.zeros(0, str))
+    return _readonly(np.array(table.labels, str)[table.code_ids])
+
+def families(table, rows=None, dtype=float):
+    """Group interactions into families of the same potential
+
+    Parameters
+    ----------
+    table : InteractionTable
+        Interactions of one kind, e.g. Hamiltonian._tables["pairs"].
+    rows : array(int) (opt.)
+        Only group these interactions. columns then index into rows.
+    dtype : np.dtype (opt.)
+        Type of the parameter arrays. With np.float32 the blocks evaluate
+        float32 coordinates without upcasting to float64.
+
+    Returns
+    -------
+    families : list
+        (columns, block) tuples. columns are the positions of the family's
+    interactions in the table and block evaluates all of them at once on
+    coordinates of shape (n_frames, len(columns)).
+    """
+    if rows is None:
+        rows = np.arange(len(table))
+
+    fams = []
+    for code_id, pot_class in enumerate(table.classes):
+        columns = np.flatnonzero(table.code_ids[rows] == code_id)
+        if len(columns) == 0:
+            continue
+        if pot_class._param_names is None:
+            block = pairwise.PairPotentialGroup([ table.objects[i] for i in rows[columns] ])
+        else:
+            params = [ _readonly(table.params[rows[columns],k].astype(dtype))
+                        for k in range(len(pot_class._param_names)) ]
+            block = pot_class.block(*params)
+        fams.append((_readonly(columns), block))
+    return fams
+
+def family_energy(fams, x, sum=True, dtype=float, accumulate=float):
+    """Energy of a set of families given their coordinates
+
+    Parameters
+    ----------
+    fams : list
+        (columns, block) tuples from families().
+    x : np.ndarray (n_frames, n_interactions)
+        Distance, angle or dihedral of each interaction.
+    sum : bool (opt.)
+        If sum=True return the total energy.
+    dtype : np.dtype (opt.)
+        Type of the energy of each interaction when sum=False.
+    accumulate : np.dtype (opt.)
+        Type the total energy is summed in when sum=True.
+    """
+    if sum:
+        E = np.zeros(x.shape[0], accumulate)
+    else:
+        E = np.zeros(x.shape, dtype)
+
+    # Each family is one broadcast expression over its columns.
+    for columns, block in fams:
+        Vblock = block.V(x[:,columns])
+        if sum:
+            E += np.sum(Vblock, axis=1, dtype=accumulate)
+        else:
+            E[:,columns] = Vblock
+    return E
+
+def block_subset(block, columns):
+    """Block of only some columns of a family"""
+    if hasattr(type(block), "subset"):
+        # Tabulated and kernel blocks stay tabulated or compiled.
+        return block.subset(columns)
+    params = [ np.atleast_1d(getattr(block, name))[columns]
+                for name in block._param_names ]
+    return block.block(*params)
+
+def with_epsilon(block, eps):
+    """Copy of a family's block with its epsilons replaced by eps"""
+    params = [ eps if name == "eps" else getattr(block, name)
+                for name in block._param_names ]
+    return block.block(*params)
+
+def family_derivative(fams, x, deriv, dtype=float):
+    """Derivative of the energy of each interaction with respect to x
+
+    Parameters
+    ----------
+    fams : list
+        (columns, block) tuples from families().
+    x : np.ndarray (n_frames, n_interactions)
+        Distance, angle or dihedral of each interaction.
+    deriv : str
+        Name of the derivative method of the potentials, e.g. "dVdr".
+    dtype : np.dtype (opt.)
+
+    Returns
+    -------
+    dV : np.ndarray (n_frames, n_interactions)
+    """
+    dV = np.zeros(x.shape, dtype)
+    for columns, block in fams:
+        dV[:,columns] = getattr(block, deriv)(x[:,columns])
+    return dV
+
+def family_param_derivative(fams, x, param, dtype=float):
+    """Derivative of the energy of each interaction with respect to a parameter
+
+    Parameters
+    ----------
+    fams : list
+        (columns, block) tuples from families().
+    x : np.ndarray (n_frames, n_interactions)
+        Distance, angle or dihedral of each interaction.
+    param : str
+        Parameter name, e.g. eps, r0, width, kb.
+    dtype : np.dtype (opt.)
+
+    Returns
+    -------
+    dV : np.ndarray (n_frames, n_interactions)
+        Zero for interactions whose potential doesn't have param.
+    """
+    dV = np.zeros(x.shape, dtype)
+    for columns, block in fams:
+        if param in (getattr(block, "_param_names", None) or ()):
+            dV[:,columns] = block.dV_dparam(x[:,columns], param)
+    return dV
+
+def atom_adjacency(idxs):
+    """Interactions of each atom in compressed sparse row (CSR) form
+
+    Parameters
+    ----------
+    idxs : np.ndarray (n_interactions, n_atoms_per)
+        Atom indices of each interaction.
+
+    Returns
+    -------
+    indptr : np.ndarray (n_atoms + 1,)
+
+    indices : np.ndarray
+        The interactions of atom a are indices[indptr[a]:indptr[a + 1]],
+    in increasing order. n_atoms is the largest atom index plus one.
+    """
+    atoms = idxs.reshape(-1)
+    rows = np.repeat(np.arange(idxs.shape[0]), idxs.shape[1])
+    order = np.argsort(atoms, kind="stable")
+    counts = np.bincount(atoms, minlength=int(atoms.max(initial=-1)) + 1)
+    indptr = np.concatenate([[0], np.cumsum(counts)])
+    return _readonly(indptr), _readonly(rows[order])
+
+class CompiledHamiltonian(object):
+
+    def __init__(self, hamiltonian):
+        """Frozen, array-backed snapshot of a Hamiltonian
+
+        Holds everything needed to evaluate the Hamiltonian without touching
+        the interaction objects: atom index arrays, potential labels and the
+        parameters of each family packed into arrays. The arrays are
+        read-only. Hamiltonian.compile() builds a new snapshot whenever the
+        interactions or their parameters change.
+
+        The family parameters are stored in the precision chosen with
+        Hamiltonian.set_precision, given by dtype and accumulate_dtype.
+
+        Parameters
+        ----------
+        hamiltonian : Hamiltonian
+
+        """
+        bonds = hamiltonian._tables["bonds"]
+        angles = hamiltonian._tables["angles"]
+        dihedrals = hamiltonian._tables["dihedrals"]
+        pairs = hamiltonian._tables["pairs"]
+        self._set("dtype", np.dtype(hamiltonian._precision["dtype"]))
+        self._set("accumulate_dtype", np.dtype(hamiltonian._precision["accumulate"]))
+
+        self._set("bond_idxs", _readonly(bonds.atom_idxs.astype(int)))
+        self._set("angle_idxs", _readonly(angles.atom_idxs.astype(int)))
+        self._set("dihedral_idxs", _readonly(dihedrals.atom_idxs.astype(int)))
+        self._set("pair_idxs", _readonly(pairs.atom_idxs.astype(int)))
+
+        # Terms on the same quartet of atoms (e.g. the multiplicity 1 and 3
+        # cosine dihedrals) share one dihedral computation.
+        quartets, inverse = np.unique(self.dihedral_idxs, axis=0,
+                                      return_inverse=True)
+        self._set("dihedral_quartets", _readonly(quartets.reshape(-1, 4)))
+        self._set("dihedral_inverse", _readonly(inverse.reshape(-1)))
+
+        self._set("bond_labels", _labels(bonds))
+        self._set("angle_labels", _labels(angles))
+        self._set("dihedral_labels", _labels(dihedrals))
+        self._set("pair_labels", _labels(pairs))
+
+        pair_families = families(pairs, dtype=self.dtype)
+        if hamiltonian._pair_tabulation is not None:
+            pair_families = tabulated.tabulate_families(pair_families,
+                                    dtype=self.dtype, **hamiltonian._pair_tabulation)
+        for kind, fams in [("bond", families(bonds, dtype=self.dtype)),
+                           ("angle", families(angles, dtype=self.dtype)),
+                           ("dihedral", families(dihedrals, dtype=self.dtype)),
+                           ("pair", pair_families)]:
+            if hamiltonian._kernel_backend == "numba":
+                fams = kernels.accelerate_families(fams)
+            self._set(kind + "_families", fams)
+
+        # Not every pair potential has an epsilon (e.g. FLATWELL, CUSTOM).
+        eps = np.full(len(pairs), np.nan)
+        for code_id, pot_class in enumerate(pairs.classes):
+            if (pot_class._param_names is not None) and ("eps" in pot_class._param_names):
+                rows = (pairs.code_ids == code_id)
+                eps[rows] = pairs.params[rows,pot_class._param_names.index("eps")]
+        self._set("epsilons", _readonly(eps))
+        self._set("_adjacency", {})
+        self._set("_family_of", {})
+
+    def _set(self, name, value):
+        object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompiledHamiltonian is read-only")
+
+    @property
+    def n_bonds(self):
+        return self.bond_idxs.shape[0]
+
+    @property
+    def n_angles(self):
+        return self.angle_idxs.shape[0]
+
+    @property
+    def n_dihedrals(self):
+        return self.dihedral_idxs.shape[0]
+
+    @property
+    def n_pairs(self):
+        return self.pair_idxs.shape[0]
+
+    @property
+    def n_interactions(self):
+        return self.n_bonds + self.n_angles + self.n_dihedrals + self.n_pairs
+
+    def atom_adjacency(self, kind):
+        """CSR adjacency from atoms to interactions, see atom_adjacency
+
+        Built the first time it is asked for.
+
+        Parameters
+        ----------
+        kind : str [bonds, angles, dihedrals, pairs]
+        """
+        if kind not in self._adjacency:
+            self._adjacency[kind] = atom_adjacency(getattr(self, kind[:-1] + "_idxs"))
+        return self._adjacency[kind]
+
+    def family_subset(self, kind, rows):
+        """Families of one kind restricted to some interactions
+
+        Slices the compiled families instead of grouping the interactions
+        again. Families with all of their interactions in rows are kept as
+        they are, e.g. tabulated or compiled.
+
+        Parameters
+        ----------
+        kind : str [bonds, angles, dihedrals, pairs]
+
+        rows : array(int)
+            Sorted indices of the interactions.
+
+        Returns
+        -------
+        families : list
+            (columns, block) tuples, with columns indexing into rows.
+        """
+        fams = getattr(self, kind[:-1] + "_families")
+        if kind not in self._family_of:
+            family_of = np.zeros(getattr(self, "n_" + kind), int)
+            for f, (columns, block) in enumerate(fams):
+                family_of[columns] = f
+            self._family_of[kind] = _readonly(family_of)
+
+        family_of = self._family_of[kind][rows]
+        subset = []
+        for f, (columns, block) in enumerate(fams):
+            positions = np.flatnonzero(family_of == f)
+            if len(positions) == len(columns):
+                subset.append((_readonly(positions), block))
+            elif len(positions) > 0:
+                in_family = np.searchsorted(columns, rows[positions])
+                subset.append((_readonly(positions), block_subset(block, in_family)))
+        return subset
+
+    def atom_interactions(self, kind, atoms):
+        """Indices of the interactions of one kind involving any of atoms
+
+        Parameters
+        ----------
+        kind : str [bonds, angles, dihedrals, pairs]
+
+        atoms : int or array(int)
+
+        Returns
+        -------
+        rows : np.ndarray
+            Sorted indices of the interactions.
+        """
+        indptr, indices = self.atom_adjacency(kind)
+        atoms = np.atleast_1d(np.asarray(atoms, int))
+        atoms = atoms[atoms < len(indptr) - 1]
+        counts = indptr[atoms + 1] - indptr[atoms]
+        return np.unique(indices[neighbors._ranges(indptr[atoms], counts)])
@@ -0,0 +1,529 @@
+"""Internal coordinates computed directly from coordinate arrays
+
+Follows the conventions of mdtraj.compute_distances, compute_angles and
+compute_dihedrals (with periodic=True) so energies match the calc_* methods,
+but works on plain (n_frames, n_atoms, 3) arrays so that all the internal
+coordinates of a chunk of frames come from one read of the coordinates.
+Periodic boundaries use the minimum image convention. A box is given per
+frame either as rectangular box lengths (n_frames, 3) or, for triclinic
+unit cells, as box vectors (n_frames, 3, 3) with one vector per row.
+"""
+
+import collections
+import hashlib
+import itertools
+import numpy as np
+import scipy.sparse
+
+def traj_box(traj):
+    """Box of each frame, or None if traj has no unit cell
+
+    Parameters
+    ----------
+    traj : mdtraj.Trajectory
+
+    Returns
+    -------
+    box : np.ndarray (n_frames, 3), (n_frames, 3, 3) or None
+        Box lengths of rectangular unit cells, otherwise the box vectors.
+    """
+    if traj.unitcell_lengths is None:
+        return None
+    if not np.allclose(traj.unitcell_angles, 90.):
+        return traj.unitcell_vectors
+    return traj.unitcell_lengths
+
+def is_triclinic(box):
+    """Whether box holds box vectors rather than box lengths"""
+    return np.ndim(box) == 3
+
+def minimum_image(d, box):
+    """Shortest periodic image of the vectors d, (n_frames, n, 3)
+
+    Parameters
+    ----------
+    d : np.ndarray (n_frames, n, 3)
+
+    box : np.ndarray (n_frames, 3) or (n_frames, 3, 3)
+        Box lengths or box vectors of each frame, see traj_box.
+    """
+    box = np.asarray(box)
+    if not is_triclinic(box):
+        box = box[:,np.newaxis,:]
+        return d - box*np.round(d/box)
+
+    # Wrap in fractional coordinates, then check the neighboring images
+    # since the wrapped vector isn't always the shortest in a skewed box.
+    fractional = np.matmul(d, np.linalg.inv(box))
+    d = np.matmul(fractional - np.round(fractional), box).astype(d.dtype, copy=False)
+    best = d.copy()
+    best_r2 = np.sum(d**2, axis=2)
+    for image in itertools.product((-1, 0, 1), repeat=3):
+        if image == (0, 0, 0):
+            continue
+        shifted = d + np.matmul(np.array(image, float), box)[:,np.newaxis,:]
+        r2 = np.sum(shifted**2, axis=2)
+        closer = r2 < best_r2
+        best[closer] = shifted[closer]
+        best_r2[closer] = r2[closer]
+    return best
+
+def displacements(xyz, idxs_from, idxs_to, box=None):
+    """Vectors from atoms idxs_from to atoms idxs_to, (n_frames, n, 3)"""
+    d = xyz[:,idxs_to,:] - xyz[:,idxs_from,:]
+    if box is not None:
+        d = minimum_image(d, box)
+    return d
+
+def distances(xyz, pairs, box=None):
+    """Distance between each pair of atoms, (n_frames, n_pairs)"""
+    d = displacements(xyz, pairs[:,0], pairs[:,1], box)
+    return np.sqrt(np.einsum("fnk,fnk->fn", d, d))
+
+def angles(xyz, triplets, box=None):
+    """Angle at the middle atom of each triplet, (n_frames, n_angles)"""
+    u = displacements(xyz, triplets[:,1], triplets[:,0], box)
+    v = displacements(xyz, triplets[:,1], triplets[:,2], box)
+    u /= np.sqrt(np.sum(u**2, axis=2))[:,:,np.newaxis]
+    v /= np.sqrt(np.sum(v**2, axis=2))[:,:,np.newaxis]
+    return np.arccos(np.clip(np.sum(u*v, axis=2), -1., 1.))
+
+def dihedrals(xyz, quartets, box=None):
+    """Dihedral angle of each quartet in [-pi, pi], (n_frames, n_dihedrals)"""
+    b1 = displacements(xyz, quartets[:,0], quartets[:,1], box)
+    b2 = displacements(xyz, quartets[:,1], quartets[:,2], box)
+    b3 = displacements(xyz, quartets[:,2], quartets[:,3], box)
+    c1 = np.cross(b2, b3)
+    c2 = np.cross(b1, b2)
+    p1 = np.sum(b1*c1, axis=2)*np.sqrt(np.sum(b2**2, axis=2))
+    p2 = np.sum(c1*c2, axis=2)
+    return np.arctan2(p1, p2)
+
+def frame_chunks(n_frames, chunk_size):
+    """Slices covering n_frames in chunks of at most chunk_size frames"""
+    for start in range(0, n_frames, chunk_size):
+        yield slice(start, min(start + chunk_size, n_frames))
+
+def frames_per_chunk(n_columns, max_values=2**24):
+    """Number of frames such that a (frames, n_columns) array stays small"""
+    return max(1, max_values//max(n_columns, 1))
+
+def distance_gradients(xyz, pairs, box=None):
+    """Distances and their gradients with respect to the atoms of each pair
+
+    Returns
+    -------
+    r : np.ndarray (n_frames, n_pairs)
+
+    grad : np.ndarray (n_frames, n_pairs, 2, 3)
+        Derivative of r with respect to the position of atom i and atom j.
+    """
+    d = displacements(xyz, pairs[:,0], pairs[:,1], box)
+    r = np.sqrt(np.sum(d**2, axis=2))
+    unit = d/r[:,:,np.newaxis]
+    return r, np.stack([-unit, unit], axis=2)
+
+def angle_gradients(xyz, triplets, box=None):
+    """Angles and their gradients with respect to the atoms of each triplet
+
+    Returns
+    -------
+    theta : np.ndarray (n_frames, n_angles)
+
+    grad : np.ndarray (n_frames, n_angles, 3, 3)
+        Derivative of theta with respect to the position of each atom.
+    """
+    u = displacements(xyz, triplets[:,1], triplets[:,0], box)
+    v = displacements(xyz, triplets[:,1], triplets[:,2], box)
+    norm_u = np.sqrt(np.sum(u**2, axis=2))[:,:,np.newaxis]
+    norm_v = np.sqrt(np.sum(v**2, axis=2))[:,:,np.newaxis]
+    u /= norm_u
+    v /= norm_v
+    cos_theta = np.clip(np.sum(u*v, axis=2), -1., 1.)[:,:,np.newaxis]
+    theta = np.arccos(cos_theta[:,:,0])
+
+    # The gradient is singular for straight angles; keep it finite.
+    sin_theta = np.maximum(np.sqrt(1. - cos_theta**2), 1e-8)
+    grad_i = (cos_theta*u - v)/(norm_u*sin_theta)
+    grad_k = (cos_theta*v - u)/(norm_v*sin_theta)
+    return theta, np.stack([grad_i, -(grad_i + grad_k), grad_k], axis=2)
+
+def dihedral_gradients(xyz, quartets, box=None):
+    """Dihedrals and their gradients with respect to the atoms of each quartet
+
+    Uses the expressions of Blondel and Karplus, J. Comput. Chem. 17 (1996).
+
+    Returns
+    -------
+    phi : np.ndarray (n_frames, n_dihedrals)
+
+    grad : np.ndarray (n_frames, n_dihedrals, 4, 3)
+        Derivative of phi with respect to the position of each atom.
+    """
+    b1 = displacements(xyz, quartets[:,0], quartets[:,1], box)
+    b2 = displacements(xyz, quartets[:,1], quartets[:,2], box)
+    b3 = displacements(xyz, quartets[:,2], quartets[:,3], box)
+    c1 = np.cross(b2, b3)
+    c2 = np.cross(b1, b2)
+    norm_b2 = np.sqrt(np.sum(b2**2, axis=2))
+    p1 = np.sum(b1*c1, axis=2)*norm_b2
+    p2 = np.sum(c1*c2, axis=2)
+    phi = np.arctan2(p1, p2)
+
+    norm_b2 = norm_b2[:,:,np.newaxis]
+    grad_i = -norm_b2*c2/np.sum(c2**2, axis=2)[:,:,np.newaxis]
+    grad_l = norm_b2*c1/np.sum(c1**2, axis=2)[:,:,np.newaxis]
+    f1 = (np.sum(b1*b2, axis=2)[:,:,np.newaxis])/norm_b2**2
+    f3 = (np.sum(b3*b2, axis=2)[:,:,np.newaxis])/norm_b2**2
+    grad_j = -(1. + f1)*grad_i + f3*grad_l
+    grad_k = f1*grad_i - (1. + f3)*grad_l
+    return phi, np.stack([grad_i, grad_j, grad_k, grad_l], axis=2)
+
+def _outer(a, b):
+    """Outer products of per-interaction gradients, (..., m, 3, m, 3)"""
+    return np.einsum("fnax,fnby->fnaxby", a, b)
+
+def _to_atoms(grad, hess, mapping):
+    """Derivatives with respect to the vectors of each interaction to its atoms
+
+    Parameters
+    ----------
+    grad : np.ndarray (n_frames, n, n_vectors, 3)
+
+    hess : np.ndarray (n_frames, n, n_vectors, 3, n_vectors, 3)
+
+    mapping : np.ndarray (n_atoms_per, n_vectors)
+        Derivative of each vector with respect to each atom.
+    """
+    grad = np.einsum("am,fnmx->fnax", mapping, grad)
+    hess = np.einsum("am,bp,fnmxpy->fnaxby", mapping, mapping, hess)
+    return grad, hess
+
+def distance_hessians(xyz, pairs, box=None):
+    """Distances with their gradients and second derivatives
+
+    Returns
+    -------
+    r : np.ndarray (n_frames, n_pairs)
+
+    grad : np.ndarray (n_frames, n_pairs, 2, 3)
+        As in distance_gradients.
+    hess : np.ndarray (n_frames, n_pairs, 2, 3, 2, 3)
+        Second derivative of r with respect to the positions of two atoms of
+        the pair.
+    """
+    d = displacements(xyz, pairs[:,0], pairs[:,1], box)
+    r = np.sqrt(np.sum(d**2, axis=2))
+    unit = d/r[:,:,np.newaxis]
+    projection = np.eye(3) - np.einsum("fnx,fny->fnxy", unit, unit)
+    hess = (projection/r[:,:,np.newaxis,np.newaxis])[:,:,np.newaxis,:,np.newaxis,:]
+    grad, hess = _to_atoms(unit[:,:,np.newaxis,:], hess, np.array([[-1.], [1.]]))
+    return r, grad, hess
+
+def angle_hessians(xyz, triplets, box=None):
+    """Angles with their gradients and second derivatives
+
+    Returns
+    -------
+    theta : np.ndarray (n_frames, n_angles)
+
+    grad : np.ndarray (n_frames, n_angles, 3, 3)
+        As in angle_gradients.
+    hess : np.ndarray (n_frames, n_angles, 3, 3, 3, 3)
+        Second derivative of theta with respect to the positions of two atoms
+        of the triplet.
+    """
+    a = displacements(xyz, triplets[:,1], triplets[:,0], box)
+    b = displacements(xyz, triplets[:,1], triplets[:,2], box)
+    norm_a = np.sqrt(np.sum(a**2, axis=2))[:,:,np.newaxis,np.newaxis]
+    norm_b = np.sqrt(np.sum(b**2, axis=2))[:,:,np.newaxis,np.newaxis]
+    u = a/norm_a[:,:,:,0]
+    v = b/norm_b[:,:,:,0]
+    cos_theta = np.clip(np.sum(u*v, axis=2), -1., 1.)
+    theta = np.arccos(cos_theta)
+    sin_theta = np.maximum(np.sqrt(1. - cos_theta**2), 1e-8)[:,:,np.newaxis,np.newaxis]
+    c = cos_theta[:,:,np.newaxis,np.newaxis]
+
+    # Derivatives of cos(theta) = u.v with respect to the vectors a and b.
+    g_a = (v - c[:,:,:,0]*u)/norm_a[:,:,:,0]
+    g_b = (u - c[:,:,:,0]*v)/norm_b[:,:,:,0]
+    uu = np.einsum("fnx,fny->fnxy", u, u)
+    vv = np.einsum("fnx,fny->fnxy", v, v)
+    uv = np.einsum("fnx,fny->fnxy", u, v)
+    h_aa = -(np.einsum("fnx,fny->fnxy", u, g_a) + np.einsum("fnx,fny->fnxy", g_a, u))/norm_a \
+            - c*(np.eye(3) - uu)/norm_a**2
+    h_bb = -(np.einsum("fnx,fny->fnxy", v, g_b) + np.einsum("fnx,fny->fnxy", g_b, v))/norm_b \
+            - c*(np.eye(3) - vv)/norm_b**2
+    h_ab = (np.eye(3) - uu - vv + c*uv)/(norm_a*norm_b)
+    grad_cos = np.stack([g_a, g_b], axis=2)
+    hess_cos = np.stack([np.stack([h_aa, h_ab], axis=3),
+                         np.stack([np.swapaxes(h_ab, 2, 3), h_bb], axis=3)], axis=2)
+
+    # theta = arccos(cos(theta))
+    s = sin_theta[:,:,:,:,np.newaxis,np.newaxis]
+    grad = -grad_cos/sin_theta
+    hess = -hess_cos/s - (c[:,:,:,:,np.newaxis,np.newaxis]/s**3)*_outer(grad_cos, grad_cos)
+    grad, hess = _to_atoms(grad, hess, np.array([[1., 0.], [-1., -1.], [0., 1.]]))
+    return theta, grad, hess
+
+def _dot_derivatives(vectors, p, q):
+    """Gradient and second derivative of vectors[p].vectors[q]"""
+    f, n = vectors.shape[:2]
+    grad = np.zeros((f, n, 3, 3))
+    grad[:,:,p] += vectors[:,:,q]
+    grad[:,:,q] += vectors[:,:,p]
+    hess = np.zeros((3, 3, 3, 3))
+    hess[p,:,q,:] += np.eye(3)
+    hess[q,:,p,:] += np.eye(3)
+    return grad, hess
+
+def _levi_civita(w):
+    """Matrices e_abc*w_c, (n_frames, n, 3, 3)"""
+    e = np.zeros((3, 3, 3))
+    e[0,1,2] = e[1,2,0] = e[2,0,1] = 1.
+    e[0,2,1] = e[2,1,0] = e[1,0,2] = -1.
+    return np.einsum("abc,fnc->fnab", e, w)
+
+def dihedral_hessians(xyz, quartets, box=None):
+    """Dihedrals with their gradients and second derivatives
+
+    The dihedral is atan2(y, x) with y = b1.(b2 x b3)|b2| and
+    x = (b1.b2)(b2.b3) - (b2.b2)(b1.b3), polynomials in the bond vectors b1,
+    b2 and b3 apart from |b2|, which are differentiated directly.
+
+    Returns
+    -------
+    phi : np.ndarray (n_frames, n_dihedrals)
+
+    grad : np.ndarray (n_frames, n_dihedrals, 4, 3)
+        As in dihedral_gradients.
+    hess : np.ndarray (n_frames, n_dihedrals, 4, 3, 4, 3)
+        Second derivative of phi with respect to the positions of two atoms
+        of the quartet.
+    """
+    b = np.stack([displacements(xyz, quartets[:,0], quartets[:,1], box),
+                  displacements(xyz, quartets[:,1], quartets[:,2], box),
+                  displacements(xyz, quartets[:,2], quartets[:,3], box)], axis=2)
+    f, n = b.shape[:2]
+
+    # x = d01*d12 - d11*d02 with dpq = b[p].b[q]
+    dots = {}
+    for p, q in [(0, 1), (1, 2), (1, 1), (0, 2)]:
+        dots[p, q] = (np.sum(b[:,:,p]*b[:,:,q], axis=2),) + _dot_derivatives(b, p, q)
+    x = np.zeros((f, n))
+    grad_x = np.zeros((f, n, 3, 3))
+    hess_x = np.zeros((f, n, 3, 3, 3, 3))
+    for sign, first, second in [(1., (0, 1), (1, 2)), (-1., (1, 1), (0, 2))]:
+        d1, g1, h1 = dots[first]
+        d2, g2, h2 = dots[second]
+        x += sign*d1*d2
+        grad_x += sign*(d2[:,:,np.newaxis,np.newaxis]*g1 + d1[:,:,np.newaxis,np.newaxis]*g2)
+        hess_x += sign*(d2[:,:,np.newaxis,np.newaxis,np.newaxis,np.newaxis]*h1 +
+                        d1[:,:,np.newaxis,np.newaxis,np.newaxis,np.newaxis]*h2 +
+                        _outer(g1, g2) + _outer(g2, g1))
+
+    # y = T*N with T = b1.(b2 x b3) and N = |b2|
+    T = np.sum(b[:,:,0]*np.cross(b[:,:,1], b[:,:,2]), axis=2)
+    grad_T = np.stack([np.cross(b[:,:,1], b[:,:,2]), np.cross(b[:,:,2], b[:,:,0]),
+                       np.cross(b[:,:,0], b[:,:,1])], axis=2)
+    hess_T = np.zeros((f, n, 3, 3, 3, 3))
+    for p, q, w in [(0, 1, 2), (1, 2, 0), (2, 0, 1)]:
+        hess_T[:,:,p,:,q,:] = _levi_civita(b[:,:,w])
+        hess_T[:,:,q,:,p,:] = -_levi_civita(b[:,:,w])
+    N = np.sqrt(np.sum(b[:,:,1]**2, axis=2))
+    grad_N = np.zeros((f, n, 3, 3))
+    grad_N[:,:,1] = b[:,:,1]/N[:,:,np.newaxis]
+    hess_N = np.zeros((f, n, 3, 3, 3, 3))
+    hess_N[:,:,1,:,1,:] = (np.eye(3) - np.einsum("fnx,fny->fnxy", grad_N[:,:,1],
+                                grad_N[:,:,1]))/N[:,:,np.newaxis,np.newaxis]
+    y = T*N
+    grad_y = N[:,:,np.newaxis,np.newaxis]*grad_T + T[:,:,np.newaxis,np.newaxis]*grad_N
+    hess_y = (N[:,:,np.newaxis,np.newaxis,np.newaxis,np.newaxis]*hess_T +
+              T[:,:,np.newaxis,np.newaxis,np.newaxis,np.newaxis]*hess_N +
+              _outer(grad_T, grad_N) + _outer(grad_N, grad_T))
+
+    # phi = atan2(y, x)
+    rho = (x**2 + y**2)[:,:,np.newaxis,np.newaxis]
+    x4 = x[:,:,np.newaxis,np.newaxis]
+    y4 = y[:,:,np.newaxis,np.newaxis]
+    grad = (x4*grad_y - y4*grad_x)/rho
+    x6 = x4[:,:,:,:,np.newaxis,np.newaxis]
+    y6 = y4[:,:,:,:,np.newaxis,np.newaxis]
+    rho6 = rho[:,:,:,:,np.newaxis,np.newaxis]
+    hess = ((x6*hess_y - y6*hess_x + _outer(grad_y, grad_x) - _outer(grad_x, grad_y))/rho6
+            - 2.*_outer(grad, x4*grad_x + y4*grad_y)/rho6)
+    hess = 0.5*(hess + np.transpose(hess, (0, 1, 4, 5, 2, 3)))
+    mapping = np.array([[-1., 0., 0.], [1., -1., 0.], [0., 1., -1.], [0., 0., 1.]])
+    grad, hess = _to_atoms(grad, hess, mapping)
+    return np.arctan2(y, x), grad, hess
+
+def chain_hessian(dV, d2V, grad, hess):
+    """Second derivatives of V(q) with respect to the atoms of each interaction
+
+    Parameters
+    ----------
+    dV, d2V : np.ndarray (n_frames, n)
+        First and second derivative of the potential of each interaction
+        with respect to its coordinate q.
+    grad : np.ndarray (n_frames, n, n_atoms_per, 3)
+        Gradient of q, see *_hessians.
+    hess : np.ndarray (n_frames, n, n_atoms_per, 3, n_atoms_per, 3)
+        Second derivative of q.
+
+    Returns
+    -------
+    blocks : np.ndarray (n_frames, n, n_atoms_per, 3, n_atoms_per, 3)
+    """
+    expand = (slice(None), slice(None)) + (np.newaxis,)*4
+    return d2V[expand]*_outer(grad, grad) + dV[expand]*hess
+
+def sparse_hessian(terms, n_atoms):
+    """Sum per-interaction blocks into one sparse matrix
+
+    Parameters
+    ----------
+    terms : list
+        (blocks, idxs) tuples with blocks of shape
+    (n, n_atoms_per, 3, n_atoms_per, 3) for one frame, see chain_hessian, and
+    idxs the atom indices (n, n_atoms_per) of the interactions.
+    n_atoms : int
+
+    Returns
+    -------
+    hessian : scipy.sparse.csr_matrix (3*n_atoms, 3*n_atoms)
+        Entry (3*a + x, 3*b + y) is the derivative with respect to
+    coordinate x of atom a and coordinate y of atom b.
+    """
+    data, rows, cols = [np.zeros(0)], [np.zeros(0, int)], [np.zeros(0, int)]
+    for blocks, idxs in terms:
+        n, k = idxs.shape
+        dofs = (3*idxs[:,:,np.newaxis] + np.arange(3)).reshape(n, 3*k)
+        data.append(blocks.reshape(-1))
+        rows.append(np.repeat(dofs, 3*k, axis=1).reshape(-1))
+        cols.append(np.tile(dofs, (1, 3*k)).reshape(-1))
+    return scipy.sparse.coo_matrix((np.concatenate(data),
+                (np.concatenate(rows), np.concatenate(cols))),
+                shape=(3*n_atoms, 3*n_atoms)).tocsr()
+
+def scatter_to_atoms(vectors, idxs, n_atoms):
+    """Sum vectors on the atoms of each interaction onto the atoms
+
+    Parameters
+    ----------
+    vectors : np.ndarray (n_frames, n_interactions, n_atoms_per, 3)
+        Vector on each atom of each interaction, e.g. its force.
+    idxs : np.ndarray (n_interactions, n_atoms_per)
+        Atom indices of each interaction.
+    n_atoms : int
+
+    Returns
+    -------
+    total : np.ndarray (n_frames, n_atoms, 3)
+    """
+    n_frames = vectors.shape[0]
+    bins = (np.arange(n_frames)[:,np.newaxis]*n_atoms + idxs.reshape(1, -1)).reshape(-1)
+    total = np.zeros((n_frames*n_atoms, 3), vectors.dtype)
+    for k in range(3):
+        total[:,k] = np.bincount(bins, weights=vectors[...,k].reshape(-1),
+                                 minlength=n_frames*n_atoms)
+    return total.reshape(n_frames, n_atoms, 3)
+
+class GeometryCache(object):
+
+    def __init__(self, traj, max_bytes=2**30, chunk_size=None):
+        """Memoized distances, angles and dihedrals of one trajectory
+
+        Values are computed for all frames of traj the first time an index
+        set is asked for and kept until the cache holds more than max_bytes,
+        when the least recently used index sets are dropped first. Index
+        sets too large for the budget are computed for the requested frames
+        only. Returned arrays are read-only.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        max_bytes : int (opt.)
+            Memory budget of the cached arrays.
+        chunk_size : int (opt.)
+            Number of frames computed at once. By default as many as keep
+            the values of a chunk to 2**24 (see frames_per_chunk).
+
+        """
+        self.traj = traj
+        self.max_bytes = max_bytes
+        self.chunk_size = chunk_size
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._box = traj_box(traj)
+        self._entries = collections.OrderedDict()
+
+    def _compute(self, kind, idxs, frames):
+        function = {"distances":distances, "angles":angles, "dihedrals":dihedrals}[kind]
+        xyz = self.traj.xyz[frames]
+        box = None if self._box is None else self._box[frames]
+        values = np.zeros((xyz.shape[0], len(idxs)), xyz.dtype)
+        chunk_size = self.chunk_size
+        if chunk_size is None:
+            chunk_size = frames_per_chunk(len(idxs))
+        for chunk in frame_chunks(xyz.shape[0], chunk_size):
+            values[chunk] = function(xyz[chunk], idxs, None if box is None else box[chunk])
+        return values
+
+    def get(self, kind, idxs, frames=slice(None), columns=None):
+        """Distances, angles or dihedrals of an index set
+
+        Parameters
+        ----------
+        kind : str [distances, angles, dihedrals]
+
+        idxs : np.ndarray (n, 2), (n, 3) or (n, 4)
+            Atom indices of each pair, triplet or quartet.
+        frames : slice or array(int) (opt.)
+            Frames to return.
+        columns : array(int) (opt.)
+            Only return these columns. The whole index set is cached, so
+        subsets of e.g. all pair interactions share one entry.
+
+        Returns
+        -------
+        values : np.ndarray (n_frames, n)
+        """
+        idxs = np.ascontiguousarray(idxs, int)
+        key = (kind, idxs.shape, hashlib.sha1(idxs.tobytes()).hexdigest())
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            values = self._entries[key][frames]
+            return values if columns is None else values[:,columns]
+
+        self.misses += 1
+        n_bytes = self.traj.n_frames*len(idxs)*self.traj.xyz.dtype.itemsize
+        if n_bytes > self.max_bytes:
+            return self._compute(kind, idxs if columns is None else idxs[columns], frames)
+
+        values = self._compute(kind, idxs, slice(None))
+        values.flags.writeable = False
+        self._entries[key] = values
+        self.n_bytes += values.nbytes
+        while self.n_bytes > self.max_bytes:
+            self.n_bytes -= self._entries.popitem(last=False)[1].nbytes
+        return values[frames] if columns is None else values[frames][:,columns]
+
+    def distances(self, pairs, frames=slice(None)):
+        """Distance between each pair of atoms, (n_frames, n_pairs)"""
+        return self.get("distances", pairs, frames)
+
+    def angles(self, triplets, frames=slice(None)):
+        """Angle at the middle atom of each triplet, (n_frames, n_angles)"""
+        return self.get("angles", triplets, frames)
+
+    def dihedrals(self, quartets, frames=slice(None)):
+        """Dihedral angle of each quartet, (n_frames, n_dihedrals)"""
+        return self.get("dihedrals", quartets, frames)
+
+    def clear(self):
+        """Drop all cached arrays"""
+        self._entries.clear()
+        self.n_bytes = 0
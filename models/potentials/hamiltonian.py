@@ -1,16 +1,27 @@
+import contextlib
+import itertools
 import numpy as np
 
 import mdtraj as md
+import scipy.optimize
+import scipy.sparse
+import scipy.sparse.linalg
 
 from . import pairwise
 from . import bonded
 
 from . import util
+from . import compiled
+from . import geometry
+from . import kernels
+from . import neighbors
+from . import tabulated
+from . import storage as _storage
 
 class Hamiltonian(object):
     """Model Hamiltonian"""
 
-    def __init__(self):
+    def __init__(self, topology=None, storage="objects"):
         """Hamiltonian
 
         The Hamiltonian holds the potential energy function for the system. The
@@ -18,6 +29,18 @@ class Hamiltonian(object):
         angles, dihedrals, and pairwise potentials. Interactions need to be
         added after the Hamiltonian is initialized.
 
+        Parameters
+        ----------
+        topology : mdtraj.Topology (opt.)
+            Topology of the mapped model. Needed to add interactions by atom
+            index, e.g. with add_pairs_from_arrays.
+        storage : str [objects, arrays] (opt.)
+            How interactions are stored. Every interaction is kept in typed
+            NumPy columns (see storage.InteractionTable). With "objects" the
+            potential objects are kept as well. With "arrays" they are only
+            created on demand when accessing _pairs, pairs etc., which cuts
+            memory use for models with millions of interactions.
+
         Note
         ----
         A Hamiltonian is intended to be used as a sub-element of a Model object
@@ -25,14 +48,43 @@ class Hamiltonian(object):
         without a Mapping (a description of the molecular topology) because the
         interaction function make specific reference to atom indices.
 
+        In both storage modes the interaction objects read their parameters
+        from the tables. Assigning to a parameter, e.g. H._pairs[0].r0 = 0.6
+        or set_epsilon, writes it back and drops the compiled snapshot (see
+        storage.TableParameter), even for the temporary objects of
+        storage="arrays". The atoms of a stored interaction are read-only.
+        CUSTOM pairs are kept as plain objects; their args are not tracked.
+
         """
 
-        self._bonds = []
-        self._angles = []
-        self._dihedrals = []
-        self._pairs = []
+        if storage not in ["objects", "arrays"]:
+            raise ValueError("storage must be 'objects' or 'arrays', not {}".format(storage))
+
+        self.topology = topology
+        self._storage = storage
+        self._tables = {"bonds":_storage.InteractionTable(_storage.BOND_ATOMS, topology, self, "bonds"),
+                "angles":_storage.InteractionTable(_storage.ANGLE_ATOMS, topology, self, "angles"),
+                "dihedrals":_storage.InteractionTable(_storage.DIHEDRAL_ATOMS, topology, self, "dihedrals"),
+                "pairs":_storage.InteractionTable(_storage.PAIR_ATOMS, topology, self, "pairs")}
+        if storage == "arrays":
+            self._bonds = self._tables["bonds"]
+            self._angles = self._tables["angles"]
+            self._dihedrals = self._tables["dihedrals"]
+            self._pairs = self._tables["pairs"]
+        else:
+            self._bonds = []
+            self._angles = []
+            self._dihedrals = []
+            self._pairs = []
+        self._index = dict.fromkeys(self._tables)
+        self._contact_groups = {}
         self._default_parameters = {}
         self._default_potentials = {}
+        self._compiled = None
+        self._pair_tabulation = None
+        self._precision = compiled.precision_dtypes()
+        self._geometry_cache = None
+        self._kernel_backend = "numpy"
 
     def __str__(self):
         return "<%s>" % (self._string_summary_basic())
@@ -92,23 +144,188 @@ class Hamiltonian(object):
     @property
     def potentials(self):
         """Iterator over all interactions"""
-        pots = self._bonds + self._angles + self._dihedrals + self._pairs
+        pots = itertools.chain(self._bonds, self._angles, self._dihedrals, self._pairs)
         for pot in pots:
             yield pot
 
     @property
     def _epsilons(self):
-        eps = []
-        for p in self._pairs:
-            eps.append(p.eps)
-        return eps
+        """Epsilon of each pair, NaN for pairs without one (e.g. FLATWELL)"""
+        return self.compile().epsilons.tolist()
 
     @property
     def _pair_function_type_labels(self):
-        labs = []
-        for p in self._pairs:
-            labs.append(p.prefix_label)
-        return labs
+        return self.compile().pair_labels.tolist()
+
+    def compile(self):
+        """Array-backed snapshot of the Hamiltonian
+
+        The snapshot holds the atom index arrays, potential labels and
+        per-family parameter arrays of every interaction. It is cached until
+        an interaction is added or a parameter is changed (with set_epsilon,
+        set_parameters or by assigning to a stored object), so repeated
+        energy evaluations skip the interaction objects entirely.
+
+        Returns
+        -------
+        compiled : CompiledHamiltonian
+        """
+        if self._compiled is None:
+            self._compiled = compiled.CompiledHamiltonian(self)
+        return self._compiled
+
+    def use_tabulated_pairs(self, kind="cubic", ds=0.01, tail_tol=1e-10, max_bytes=2**26,
+                            codes=tabulated.TRANSCENDENTAL):
+        """Evaluate transcendental pair potentials by interpolating tables
+
+        The exp or tanh of the pair families in codes is interpolated from a
+        table of the reduced distance (r - r0)/width, instead of being
+        called for every pair and frame. One table serves every pair, so
+        its size doesn't grow with the number of pairs or of distinct r0.
+        Check the accuracy with tabulation_errors. Undo with
+        use_analytic_pairs.
+
+        A table lookup costs about as much as one np.exp, so the composite
+        potentials (LJ12GAUSSIAN, LJ12TANHREP, LJ12GAUSSIANTANH) gain the
+        most.
+
+        Parameters
+        ----------
+        kind : str [linear, cubic] (opt.)
+            Interpolation order, see tabulated.TabulatedPairPotential.
+        ds : float (opt.)
+            Grid spacing in units of width.
+        tail_tol : float (opt.)
+            The tables end where the exp or tanh is within tail_tol of its
+            limit.
+        max_bytes : int (opt.)
+            Families whose tables would be larger stay analytic, with a
+            warning.
+        codes : list (opt.)
+            Labels of the pair potentials to tabulate.
+        """
+        self._pair_tabulation = {"kind":kind, "ds":ds, "tail_tol":tail_tol,
+                                 "max_bytes":max_bytes, "codes":tuple(codes)}
+        self._invalidate()
+
+    def use_analytic_pairs(self):
+        """Evaluate all pair potentials analytically"""
+        self._pair_tabulation = None
+        self._invalidate()
+
+    def tabulation_errors(self, n_points=8):
+        """Largest error of the tabulated pair potentials
+
+        Returns
+        -------
+        errors : dict
+            For each tabulated potential label, the maximum error of "V" and
+        "dVdr" against the analytic form, absolute and relative (see
+        tabulated.TabulatedPairPotential.errors).
+        """
+        errors = {}
+        for columns, block in self.compile().pair_families:
+            if isinstance(block, tabulated.TabulatedPairPotential):
+                block_errors = block.errors(n_points=n_points)
+                errors[block.prefix_label] = { method:float(np.max(err))
+                                    for method, err in block_errors.items() }
+        return errors
+
+    def use_kernels(self, backend="numba"):
+        """Evaluate the potential families with compiled kernels
+
+        With backend="numba" the bond, angle, dihedral and pair families
+        supported by kernels.ELEMENTS are evaluated by fused loops, parallel
+        over frames, instead of NumPy expressions with several full-size
+        temporaries. Falls back to NumPy with a warning if numba can't be
+        imported. Check agreement with kernels.conformance.
+
+        Parameters
+        ----------
+        backend : str [numba, numpy] (opt.)
+        """
+        if backend not in ["numba", "numpy"]:
+            raise ValueError("backend must be 'numba' or 'numpy', not {}".format(backend))
+        if (backend == "numba") and not kernels.available():
+            util.numba_missing_warning()
+            backend = "numpy"
+        self._kernel_backend = backend
+        self._invalidate()
+
+    def set_precision(self, precision="double", accumulate="double"):
+        """Floating point precision of energy and force evaluations
+
+        mdtraj stores coordinates in float32 but the parameters are float64,
+        so by default every interaction energy is upcast to float64. With
+        precision="single" the parameters, internal coordinates and the
+        energy, force or dV/deps of each interaction stay in float32, which
+        halves memory and bandwidth. Sums over interactions can still be
+        taken in float64 with accumulate="double", so totals only carry the
+        rounding error of each term and not that of a long running sum.
+        Check the deviation from double precision with check_precision.
+
+        Parameters
+        ----------
+        precision : str [single, double] (opt.)
+            Precision of coordinates, parameters and per-interaction values.
+        accumulate : str [single, double] (opt.)
+            Precision of total energies.
+        """
+        self._precision = compiled.precision_dtypes(precision, accumulate)
+        self._invalidate()
+
+    def _invalidate(self):
+        """Drop the compiled snapshot after the interactions changed"""
+        self._compiled = None
+
+    def _parameters_changed(self, pair):
+        """Called by a pair of this Hamiltonian after set_epsilon
+
+        Stored pairs already wrote the new epsilon to their row of the
+        table (see storage.TableParameter).
+        """
+        self._invalidate()
+
+    def _key_index(self, kind):
+        """Row of each interaction of a kind by its _key
+
+        Built from the tables when first needed after a bulk insertion or a
+        change of parameters that are part of the keys.
+        """
+        if self._index[kind] is None:
+            keys = self._tables[kind].keys()
+            self._index[kind] = dict(zip(keys, range(len(keys))))
+        return self._index[kind]
+
+    def _register(self, kind, pot, warn=True):
+        """Add an interaction unless an equivalent one already exists
+
+        Interactions are looked up by their potential label, atom indices
+        and, for bonded potentials, parameters (see _key), so checking for
+        duplicates doesn't depend on how many interactions there are.
+
+        Returns
+        -------
+        added : bool
+            False if the interaction already existed.
+        """
+        key = pot._key()
+        index = self._key_index(kind)
+        if key in index:
+            if warn:
+                util.interaction_exists_warning(pot)
+            return False
+
+        table = self._tables[kind]
+        index[key] = len(table)
+        table.append(pot)
+        if self._storage == "objects":
+            getattr(self, "_" + kind).append(pot)
+        if kind == "pairs":
+            # Pairs tell the Hamiltonian when their parameters change.
+            pot._owner = self
+        self._invalidate()
+        return True
 
     def describe(self):
         """Describe the terms of the Hamiltonian"""
@@ -120,34 +337,22 @@ class Hamiltonian(object):
     def _add_bond(self, code, atm1, atm2, *args):
         """Add a bond interaction"""
         b = bonded.BOND_POTENTIALS[code](atm1, atm2, *args)
-        if b not in self._bonds:
-            self._bonds.append(b)
-        else:
-            util.interaction_exists_warning(b)
+        self._register("bonds", b)
 
     def _add_angle(self, code, atm1, atm2, atm3, *args):
         """Add an angle interaction"""
         ang = bonded.ANGLE_POTENTIALS[code](atm1, atm2, atm3, *args)
-        if ang not in self._angles:
-            self._angles.append(ang)
-        else:
-            util.interaction_exists_warning(ang)
+        self._register("angles", ang)
 
     def _add_dihedral(self, code, atm1, atm2, atm3, atm4, *args):
         """Add a dihedral interaction"""
         dih = bonded.DIHEDRAL_POTENTIALS[code](atm1, atm2, atm3, atm4, *args)
-        if dih not in self._dihedrals:
-            self._dihedrals.append(dih)
-        else:
-            util.interaction_exists_warning(dih)
+        self._register("dihedrals", dih)
 
     def _add_pair(self, code, atm1, atm2, *args):
         """Add a pair interaction"""
         p = pairwise.PAIR_POTENTIALS[code](atm1, atm2, *args)
-        if p not in self._pairs:
-            self._pairs.append(p)
-        else:
-            util.interaction_exists_warning(p)
+        self._register("pairs", p)
 
     def _add_bonds(self, bond_params):
         """Add a set of bond interactions"""
@@ -169,26 +374,142 @@ class Hamiltonian(object):
         for p in pair_params:
             self._add_pair(p[0], p[1], p[2], *p[3:])
 
+    def _add_from_arrays(self, kind, pot_class, atom_idxs, param_arrays):
+        """Add one interaction per row of atom index and parameter arrays"""
+        if self.topology is None:
+            raise AttributeError("Need a topology to add interactions by atom index")
+
+        atom_idxs = np.stack([ np.asarray(idxs, int) for idxs in atom_idxs ], axis=1)
+        n_new = len(atom_idxs)
+        if n_new == 0:
+            return np.zeros(0, bool)
+
+        atoms = list(self.topology.atoms)
+        if pot_class._param_names is None:
+            # Potentials without parameter columns, e.g. CUSTOM.
+            params = [ np.broadcast_to(np.asarray(p), (n_new,)).tolist()
+                        for p in param_arrays ]
+            added = np.zeros(n_new, bool)
+            for k in range(n_new):
+                args = [ atoms[idx] for idx in atom_idxs[k].tolist() ] + [ p[k] for p in params ]
+                added[k] = self._register(kind, pot_class(*args), warn=False)
+        else:
+            added = self._extend(kind, pot_class, atom_idxs, param_arrays, atoms)
+
+        n_existing = n_new - np.sum(added)
+        if n_existing > 0:
+            util.interactions_exist_warning(n_existing, pot_class.__name__)
+        return added
+
+    def _extend(self, kind, pot_class, atom_idxs, param_arrays, atoms):
+        """Add the new rows of a bulk insertion with array operations"""
+        n_new = len(atom_idxs)
+        if len(param_arrays) != len(pot_class._param_names):
+            raise ValueError("{} takes parameters {}, got {} arrays".format(
+                    pot_class.__name__, ", ".join(pot_class._param_names),
+                    len(param_arrays)))
+        params = np.stack([ np.broadcast_to(np.asarray(p, float), (n_new,))
+                            for p in param_arrays ], axis=1)
+        for name in getattr(pot_class, "_int_param_names", ()):
+            values = params[:,pot_class._param_names.index(name)]
+            if np.any(values != np.round(values)):
+                raise ValueError("{} of {} must be an integer".format(name, pot_class.__name__))
+
+        table = self._tables[kind]
+        # One object gives the label; the rest is stored as columns.
+        first = pot_class(*([ atoms[idx] for idx in atom_idxs[0].tolist() ] +
+                            table._row_params(pot_class, params[0])))
+        added = table.new_rows(first, atom_idxs, params)
+        start = len(table)
+        table.extend(first, atom_idxs[added], params[added])
+        self._index[kind] = None
+
+        if self._storage == "objects":
+            getattr(self, "_" + kind).extend(table[i] for i in range(start, len(table)))
+        self._invalidate()
+        return added
+
+    def add_bonds_from_arrays(self, code, idx_i, idx_j, *param_arrays):
+        """Add bond interactions of one potential from arrays
+
+        Parameters
+        ----------
+        code : str
+            Key of the potential in bonded.BOND_POTENTIALS.
+        idx_i, idx_j : array(int)
+            Atom indices of each bond.
+        *param_arrays : array(float) or float
+            Parameters in the order the potential takes them, e.g. kb, r0.
+            Scalars are used for every bond.
+
+        Returns
+        -------
+        added : array(bool)
+            False for the bonds that already existed and were skipped.
+        """
+        return self._add_from_arrays("bonds", bonded.BOND_POTENTIALS[code],
+                                     [idx_i, idx_j], param_arrays)
+
+    def add_angles_from_arrays(self, code, idx_i, idx_j, idx_k, *param_arrays):
+        """Add angle interactions of one potential from arrays
+
+        See add_bonds_from_arrays. Parameters are e.g. ka, theta0.
+        """
+        return self._add_from_arrays("angles", bonded.ANGLE_POTENTIALS[code],
+                                     [idx_i, idx_j, idx_k], param_arrays)
+
+    def add_dihedrals_from_arrays(self, code, idx_i, idx_j, idx_k, idx_l, *param_arrays):
+        """Add dihedral interactions of one potential from arrays
+
+        See add_bonds_from_arrays. Parameters are e.g. kd, phi0, mult.
+        """
+        return self._add_from_arrays("dihedrals", bonded.DIHEDRAL_POTENTIALS[code],
+                                     [idx_i, idx_j, idx_k, idx_l], param_arrays)
+
+    def add_pairs_from_arrays(self, code, idx_i, idx_j, *param_arrays):
+        """Add pair interactions of one potential from arrays
+
+        Much faster than adding pairs one at a time for large sets of pairs,
+        e.g. all-pairs nonnative interactions.
+
+        Parameters
+        ----------
+        code : str
+            Key of the potential in pairwise.PAIR_POTENTIALS.
+        idx_i, idx_j : array(int)
+            Atom indices of each pair.
+        *param_arrays : array(float) or float
+            Parameters in the order the potential takes them, e.g. eps, r0
+            for LJ1210 or eps, rNC, r0, width for LJ12GAUSSIAN. Scalars are
+            used for every pair.
+
+        Returns
+        -------
+        added : array(bool)
+            False for the pairs that already existed and were skipped.
+        """
+        return self._add_from_arrays("pairs", pairwise.PAIR_POTENTIALS[code],
+                                     [idx_i, idx_j], param_arrays)
+
     @property
     def _bond_idxs(self):
         """Indices of atoms in bond interactions"""
-        return np.array([[bond.atmi.index, bond.atmj.index] for bond in self.bonds ])
+        return self.compile().bond_idxs
 
     @property
     def _angle_idxs(self):
         """Indices of atoms in angle interactions"""
-        return np.array([[angle.atmi.index, angle.atmj.index, angle.atmk.index] for angle in self.angles ])
+        return self.compile().angle_idxs
 
     @property
     def _dihedral_idxs(self):
         """Indices of atoms in dihedral interactions"""
-        return np.array([[ dih.atmi.index, dih.atmj.index,
-                           dih.atmk.index, dih.atml.index] for dih in self.dihedrals ])
+        return self.compile().dihedral_idxs
 
     @property
     def _pair_idxs(self):
         """Indices of atoms in pair interactions"""
-        return np.array([[pair.atmi.index, pair.atmj.index] for pair in self.pairs ])
+        return self.compile().pair_idxs
 
     def add_custom_pair(self, atm1, atm2, func, *args):
         """Add a custom pair interaction function
@@ -207,10 +528,67 @@ class Hamiltonian(object):
         """
 
         p = pairwise.PAIR_POTENTIALS["CUSTOM"](atm1, atm2, func, *args)
-        if p not in self._pairs:
-            self._pairs.append(p)
-        else:
-            util.interaction_exists_warning(p)
+        self._register("pairs", p)
+
+    @contextlib.contextmanager
+    def geometry_cache(self, traj, max_bytes=2**30):
+        """Reuse the distances, angles and dihedrals of traj in a with block
+
+        Inside the block the energy calc_* methods, calc_dV_depsilons and the
+        contact group energies take the internal coordinates of traj from a
+        geometry.GeometryCache instead of recomputing them, e.g.
+
+            with hamiltonian.geometry_cache(traj) as cache:
+                E = hamiltonian.calc_pair_energy(traj)
+                E_native = hamiltonian.calc_contact_group_energy("native", traj)
+                r = cache.distances(my_pairs)
+
+        Entries are keyed on the index set and only used for this traj
+        object. The least recently used entries are dropped once the cache
+        holds more than max_bytes.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        max_bytes : int (opt.)
+            Memory budget of the cache.
+
+        Returns
+        -------
+        cache : geometry.GeometryCache
+        """
+        previous = self._geometry_cache
+        self._geometry_cache = geometry.GeometryCache(traj, max_bytes=max_bytes)
+        try:
+            yield self._geometry_cache
+        finally:
+            self._geometry_cache = previous
+
+    def _open_cache(self, traj):
+        """Geometry cache of traj, or None if none is open"""
+        cache = self._geometry_cache
+        if (cache is not None) and (cache.traj is traj):
+            return cache
+        return None
+
+    def _traj_geometry(self, kind, traj, idxs, frames=None, columns=None):
+        """Distances, angles or dihedrals of idxs[columns] in traj[frames]
+
+        Taken from the geometry cache if one is open for traj. Otherwise all
+        frames are computed with mdtraj, or a chunk of frames from the
+        coordinates with the geometry module.
+        """
+        cache = self._open_cache(traj)
+        if cache is not None:
+            return cache.get(kind, idxs, slice(None) if frames is None else frames, columns)
+        if columns is not None:
+            idxs = idxs[columns]
+        if frames is None:
+            return getattr(md, "compute_" + kind)(traj, idxs)
+        box = geometry.traj_box(traj)
+        return getattr(geometry, kind)(self._coordinates(traj.xyz[frames]), idxs,
+                                       None if box is None else box[frames])
 
     def calc_bond_energy(self, traj, sum=True):
         """Energy for bond interactions
@@ -222,18 +600,9 @@ class Hamiltonian(object):
         sum : bool (opt.)
             If sum=True return the total energy.
         """
-        r = md.compute_distances(traj, self._bond_idxs)
-        if sum:
-            Ebond = np.zeros(traj.n_frames, float)
-        else:
-            Ebond = np.zeros((traj.n_frames, self.n_bonds), float)
-
-        for i in range(self.n_bonds):
-            if sum:
-                Ebond += self._bonds[i].V(r[:,i])
-            else:
-                Ebond[:,i] = self._bonds[i].V(r[:,i])
-        return Ebond
+        c = self.compile()
+        r = self._traj_geometry("distances", traj, c.bond_idxs)
+        return compiled.family_energy(c.bond_families, r, sum, c.dtype, c.accumulate_dtype)
 
     def calc_angle_energy(self, traj, sum=True):
         """Energy for angle interactions
@@ -245,18 +614,9 @@ class Hamiltonian(object):
         sum : bool (opt.)
             If sum=True return the total energy.
         """
-        theta = md.compute_angles(traj, self._angle_idxs)
-        if sum:
-            Eangle = np.zeros(traj.n_frames, float)
-        else:
-            Eangle = np.zeros((traj.n_frames, self.n_angles), float)
-
-        for i in range(self.n_angles):
-            if sum:
-                Eangle += self._angles[i].V(theta[:,i])
-            else:
-                Eangle[:,i] = self._angles[i].V(theta[:,i])
-        return Eangle
+        c = self.compile()
+        theta = self._traj_geometry("angles", traj, c.angle_idxs)
+        return compiled.family_energy(c.angle_families, theta, sum, c.dtype, c.accumulate_dtype)
 
     def calc_dihedral_energy(self, traj, improper=False, sum=True):
         """Energy for dihedral interactions
@@ -268,26 +628,17 @@ class Hamiltonian(object):
         sum : bool (opt.)
             If sum=True return the total energy.
         """
-        phi = md.compute_dihedrals(traj, self._dihedral_idxs)
+        c = self.compile()
+        phi = self._traj_geometry("dihedrals", traj, c.dihedral_quartets)[:,c.dihedral_inverse]
         #if improper:
         #    phi = np.pi + md.compute_dihedrals(traj, self._dihedral_idxs) # ?
         #else:
         #    phi = -temp_phi.copy()
         #    phi[temp_phi > 0] = 2.*np.pi - temp_phi[temp_phi > 0]
 
-        if sum:
-            Edihedral = np.zeros(traj.n_frames, float)
-        else:
-            Edihedral = np.zeros((traj.n_frames, self.n_dihedrals), float)
-
-        for i in range(self.n_dihedrals):
-            if sum:
-                Edihedral += self._dihedrals[i].V(phi[:,i])
-            else:
-                Edihedral[:,i] = self._dihedrals[i].V(phi[:,i])
-        return Edihedral
+        return compiled.family_energy(c.dihedral_families, phi, sum, c.dtype, c.accumulate_dtype)
 
-    def calc_pair_energy(self, traj, sum=True):
+    def calc_pair_energy(self, traj, sum=True, tol=None, skin=0.1, chunk_size=None):
         """Energy for pair interactions
 
         Parameters
@@ -296,36 +647,1055 @@ class Hamiltonian(object):
 
         sum : bool (opt.)
             If sum=True return the total energy.
+        tol : float (opt.)
+            Turns on cutoff mode. Each pair is dropped beyond the distance
+            where its energy falls below tol (see PairPotential.cutoff), and
+            only pairs in a neighbor list of cutoff plus skin are evaluated.
+            Potentials that don't decay (FLATWELL, CUSTOM) are always
+            evaluated.
+        skin : float (opt.)
+            Neighbor list skin in nm for cutoff mode. A list is reused until
+            an atom moves more than skin/2.
+        chunk_size : int (opt.)
+            Number of frames evaluated at once. By default as many as keep
+            the distances of a chunk to 2**24 values (see
+            geometry.frames_per_chunk).
+        """
+        c = self.compile()
+        if chunk_size is None:
+            chunk_size = geometry.frames_per_chunk(c.n_pairs)
+        if tol is not None:
+            return self._calc_pair_energy_cutoff(traj, sum, tol, skin, chunk_size)
+
+        if sum:
+            E = np.zeros(traj.n_frames, c.accumulate_dtype)
+        else:
+            E = np.zeros((traj.n_frames, c.n_pairs), c.dtype)
+        for frames in geometry.frame_chunks(traj.n_frames, chunk_size):
+            r = self._traj_geometry("distances", traj, c.pair_idxs, frames)
+            E[frames] = compiled.family_energy(c.pair_families, r, sum, c.dtype,
+                                               c.accumulate_dtype)
+        return E
+
+    def pair_cutoffs(self, tol):
+        """Distance beyond which each pair's energy is below tol
+
+        Parameters
+        ----------
+        tol : float
+            Energy tolerance for each pair.
+
+        Returns
+        -------
+        cutoffs : np.ndarray (n_pairs,)
+            np.inf for pairs whose potential doesn't decay.
         """
-        r = md.compute_distances(traj, self._pair_idxs)
+        c = self.compile()
+        cutoffs = np.full(c.n_pairs, np.inf)
+        for columns, block in c.pair_families:
+            if hasattr(block, "cutoff"):
+                cutoffs[columns] = block.cutoff(tol)
+        return cutoffs
+
+    def _calc_pair_energy_cutoff(self, traj, sum, tol, skin, chunk_size):
+        """Pair energy evaluating only pairs within their cutoff"""
+        c = self.compile()
+        cutoffs = self.pair_cutoffs(tol)
+        nlist = neighbors.PairNeighborList(c.pair_idxs, cutoffs, skin=skin)
+
         if sum:
-            Epair = np.zeros(traj.n_frames, float)
+            E = np.zeros(traj.n_frames, c.accumulate_dtype)
         else:
-            Epair = np.zeros((traj.n_frames, self.n_pairs), float)
+            E = np.zeros((traj.n_frames, c.n_pairs), c.dtype)
+
+        box = geometry.traj_box(traj)
+        for frames in geometry.frame_chunks(traj.n_frames, chunk_size):
+            xyz = self._coordinates(traj.xyz[frames])
+            chunk_box = None if box is None else box[frames]
+            for seg, rows in nlist.segments(xyz, chunk_box):
+                seg_frames = slice(frames.start + seg.start, frames.start + seg.stop)
+                r = self._traj_geometry("distances", traj, c.pair_idxs, seg_frames, rows)
+                fams = c.family_subset("pairs", rows)
+                # Listed pairs beyond their cutoff count as zero.
+                Vpairs = compiled.family_energy(fams, r, sum=False, dtype=c.dtype)
+                Vpairs[r >= cutoffs[rows]] = 0.
+                if sum:
+                    E[seg_frames] = np.sum(Vpairs, axis=1, dtype=c.accumulate_dtype)
+                else:
+                    E[seg_frames,rows] = Vpairs
+        return E
+
+    def _coordinates(self, xyz):
+        """Coordinates in single precision if set with set_precision"""
+        if self._precision["dtype"] == np.float32:
+            return xyz.astype(np.float32, copy=False)
+        return xyz
+
+    def _term_energies(self, xyz, box=None, sum=True):
+        """Energy of each term for coordinates xyz (n_frames, n_atoms, 3)"""
+        c = self.compile()
+        xyz = self._coordinates(xyz)
+
+        # One distance computation serves both bonds and pairs.
+        r = geometry.distances(xyz, np.concatenate([c.bond_idxs, c.pair_idxs]), box)
+        theta = geometry.angles(xyz, c.angle_idxs, box)
+        phi = geometry.dihedrals(xyz, c.dihedral_quartets, box)
+        return self._geometry_energies(r[:,:c.n_bonds], r[:,c.n_bonds:], theta, phi, sum)
+
+    def _geometry_energies(self, r_bond, r_pair, theta, phi, sum=True):
+        """Energy of each term given its distances, angles and the dihedral
+        of each quartet"""
+        c = self.compile()
+        dtypes = (c.dtype, c.accumulate_dtype)
+        return {"bond":compiled.family_energy(c.bond_families, r_bond, sum, *dtypes),
+                "angle":compiled.family_energy(c.angle_families, theta, sum, *dtypes),
+                "dihedral":compiled.family_energy(c.dihedral_families,
+                                    phi[:,c.dihedral_inverse], sum, *dtypes),
+                "pair":compiled.family_energy(c.pair_families, r_pair, sum, *dtypes)}
+
+    def _chunk_term_energies(self, xyz, box=None, chunk_size=None, sum=True, cache=None):
+        """Energy of each term for chunks of frames of xyz (n_frames, n_atoms, 3)
 
-        for i in range(self.n_pairs):
-            if sum:
-                Epair += self._pairs[i].V(r[:,i])
+        By default chunks hold as many frames as keep the coordinates of
+        every interaction to 2**24 values (see geometry.frames_per_chunk).
+
+        Returns
+        -------
+        chunks : generator
+            (frames, Eterms) with frames a slice of frames and Eterms the
+        dict returned by _term_energies.
+        """
+        c = self.compile()
+        if chunk_size is None:
+            chunk_size = geometry.frames_per_chunk(c.n_interactions)
+        for frames in geometry.frame_chunks(xyz.shape[0], chunk_size):
+            chunk_box = None if box is None else box[frames]
+            if cache is None:
+                Echunk = self._term_energies(xyz[frames], chunk_box, sum)
             else:
-                Epair[:,i] = self._pairs[i].V(r[:,i])
-        return Epair
-
-    def define_contact_group(self, label, pairs):
-        # Use this to define a group of contacts by a label.
-        # The label can later be used to get their energy.
-        # e.g. 'native' [[1,10],[2,10]]
-        pass
-
-    def calc_contact_group_energy(self, label, traj):
-        # Calculate the energy of a group of contacts
-        pass
-
-    def select_parameters(self):
-        # Identify parameters by:
-        #   - parameter type: eps, r0,
-        #   - interaction type: bonds, angles, etc.
-        pass
-
-    def set_parameters(self):
-        # Some way to set parameters?
-        pass
+                Echunk = self._geometry_energies(cache.distances(c.bond_idxs, frames),
+                            cache.distances(c.pair_idxs, frames),
+                            cache.angles(c.angle_idxs, frames),
+                            cache.dihedrals(c.dihedral_quartets, frames), sum)
+            yield frames, Echunk
+
+    def calc_total_energy(self, traj, by_term=False, chunk_size=None):
+        """Energy of all interactions in a single pass over the trajectory
+
+        Each chunk of frames is read once and the distances, angles and
+        dihedrals of every term are computed from it together, instead of
+        one pass per calc_*_energy method.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        by_term : bool (opt.)
+            If by_term=True return the energy of each term.
+        chunk_size : int (opt.)
+            Number of frames evaluated at once. By default as many as keep
+            the coordinates of every interaction in a chunk to 2**24 values
+            (see geometry.frames_per_chunk).
+
+        Returns
+        -------
+        E : np.ndarray (n_frames,) or dict
+            Total energy. With by_term=True a dict with the energy of the
+        "bond", "angle", "dihedral" and "pair" terms.
+        """
+        return self._total_energy(traj.xyz, geometry.traj_box(traj), by_term,
+                                  chunk_size, self._open_cache(traj))
+
+    def _total_energy(self, xyz, box=None, by_term=False, chunk_size=None, cache=None):
+        """Total energy, or energy of each term, of xyz (n_frames, n_atoms, 3)"""
+        c = self.compile()
+        Eterms = {}
+        for frames, Echunk in self._chunk_term_energies(xyz, box, chunk_size, cache=cache):
+            for term, E in Echunk.items():
+                Eterms.setdefault(term, np.zeros(xyz.shape[0], c.accumulate_dtype))[frames] = E
+
+        if by_term:
+            return Eterms
+        else:
+            Etotal = np.zeros(xyz.shape[0], c.accumulate_dtype)
+            for E in Eterms.values():
+                Etotal += E
+            return Etotal
+
+    def energy_from_xyz(self, xyz, box=None, by_term=False, chunk_size=None):
+        """Energy of coordinates given as an array instead of a Trajectory
+
+        Geometry is computed on xyz directly, one chunk of frames at a time,
+        without building an mdtraj.Trajectory or copying the coordinates.
+        Memory-mapped arrays are only read chunk by chunk.
+
+        Parameters
+        ----------
+        xyz : array_like (n_frames, n_atoms, 3) or (n_atoms, 3)
+            Coordinates in nm, e.g. a np.ndarray, np.memmap or memoryview
+            of a float32 buffer.
+        box : array_like (3,), (n_frames, 3), (3, 3) or (n_frames, 3, 3) (opt.)
+            Rectangular box lengths, or triclinic box vectors (one vector
+            per row), for periodic boundaries.
+        by_term : bool (opt.)
+            If by_term=True return the energy of each term.
+        chunk_size : int (opt.)
+            Number of frames evaluated at once. By default as many as keep
+            the coordinates of every interaction in a chunk to 2**24 values
+            (see geometry.frames_per_chunk).
+
+        Returns
+        -------
+        E : np.ndarray (n_frames,) or dict
+            Total energy, a scalar array for a single frame. With
+        by_term=True a dict with the energy of the "bond", "angle",
+        "dihedral" and "pair" terms.
+        """
+        xyz = np.asarray(xyz)
+        single_frame = (xyz.ndim == 2)
+        if single_frame:
+            xyz = xyz[np.newaxis]
+        if (xyz.ndim != 3) or (xyz.shape[2] != 3):
+            raise ValueError("xyz must have shape (n_frames, n_atoms, 3), not {}".format(xyz.shape))
+        if box is not None:
+            box = np.asarray(box)
+            box_shape = (3, 3) if box.shape[-2:] == (3, 3) else (3,)
+            box = np.broadcast_to(box, (xyz.shape[0],) + box_shape)
+
+        E = self._total_energy(xyz, box, by_term, chunk_size)
+        if single_frame:
+            return { term:Eterm[0] for term, Eterm in E.items() } if by_term else E[0]
+        return E
+
+    def calc_residue_energy(self, traj, by_term=False, per_atom=False, chunk_size=None):
+        """Share of the energy of each residue
+
+        The energy of every interaction is split equally between its atoms
+        (half of a bond or pair to each partner, a third of an angle, a
+        quarter of a dihedral) and summed over the atoms of each residue.
+        The split is a sparse (n_residues, n_interactions) matrix per term,
+        so each chunk of frames takes one sparse product per term and no
+        arrays larger than the energies of the chunk. Summing over residues
+        gives the total energy.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        by_term : bool (opt.)
+            If by_term=True return the share of each term.
+        per_atom : bool (opt.)
+            If per_atom=True return the share of each atom (bead) instead
+            of each residue.
+        chunk_size : int (opt.)
+            Number of frames evaluated at once. By default as many as keep
+            the energies of every interaction in a chunk to 2**24 values
+            (see geometry.frames_per_chunk).
+
+        Returns
+        -------
+        E : np.ndarray (n_frames, n_residues) or dict
+            With by_term=True a dict with the share of the "bond", "angle",
+        "dihedral" and "pair" terms.
+        """
+        c = self.compile()
+        if per_atom:
+            owner = np.arange(traj.n_atoms)
+            n_owners = traj.n_atoms
+        else:
+            owner = np.array([ atom.residue.index for atom in traj.topology.atoms ], int)
+            n_owners = traj.topology.n_residues
+
+        # Share of each owner in the energy of each interaction, in the
+        # order of the terms. Owners appearing twice get both shares.
+        shares = {}
+        for term, idxs in [("bond", c.bond_idxs), ("angle", c.angle_idxs),
+                           ("dihedral", c.dihedral_idxs), ("pair", c.pair_idxs)]:
+            n, n_per = idxs.shape
+            shares[term] = scipy.sparse.csr_matrix((np.full(n*n_per, 1./n_per),
+                                (owner[idxs].reshape(-1), np.repeat(np.arange(n), n_per))),
+                                shape=(n_owners, n))
+
+        Eterms = { term:np.zeros((traj.n_frames, n_owners), c.accumulate_dtype) for term in shares }
+        for frames, Echunk in self._chunk_term_energies(traj.xyz, geometry.traj_box(traj),
+                                    chunk_size, sum=False, cache=self._open_cache(traj)):
+            for term, V in Echunk.items():
+                Eterms[term][frames] = shares[term].dot(V.T).T
+
+        if by_term:
+            return Eterms
+        else:
+            Etotal = np.zeros((traj.n_frames, n_owners), c.accumulate_dtype)
+            for E in Eterms.values():
+                Etotal += E
+            return Etotal
+
+    def atom_interactions(self, atoms, internal=False):
+        """Interactions involving a set of atoms
+
+        Parameters
+        ----------
+        atoms : array(int)
+            Atom indices.
+        internal : bool (opt.)
+            If internal=True only keep interactions whose atoms are all in
+            atoms, instead of those with at least one.
+
+        Returns
+        -------
+        rows : dict
+            Sorted indices of the "bonds", "angles", "dihedrals" and "pairs".
+        """
+        c = self.compile()
+        atoms = np.asarray(atoms, int).reshape(-1)
+        rows = {}
+        for kind in ["bonds", "angles", "dihedrals", "pairs"]:
+            kind_rows = c.atom_interactions(kind, atoms)
+            if internal:
+                idxs = getattr(c, kind[:-1] + "_idxs")[kind_rows]
+                kind_rows = kind_rows[np.all(np.isin(idxs, atoms), axis=1)]
+            rows[kind] = kind_rows
+        return rows
+
+    def calc_energy(self, traj, atoms=None, selection=None, internal=False,
+                    by_term=False, chunk_size=None):
+        """Energy of the interactions involving a selection of atoms
+
+        Only the interactions of the selected atoms are evaluated (see
+        atom_interactions), so studying e.g. one loop or an interface
+        doesn't compute every term.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        atoms : array(int) (opt.)
+            Indices of the selected atoms.
+        selection : str (opt.)
+            mdtraj selection string on traj.topology instead of atoms, e.g.
+            'resid 10 to 20'.
+        internal : bool (opt.)
+            If internal=True only include interactions between selected
+            atoms.
+        by_term : bool (opt.)
+            If by_term=True return the energy of each term.
+        chunk_size : int (opt.)
+            Number of frames evaluated at once. By default as many as keep
+            the coordinates of the selected interactions in a chunk to
+            2**24 values (see geometry.frames_per_chunk).
+
+        Returns
+        -------
+        E : np.ndarray (n_frames,) or dict
+            Energy of the selected interactions. With by_term=True a dict
+        with the energy of the "bond", "angle", "dihedral" and "pair" terms.
+        """
+        if (atoms is None) == (selection is None):
+            raise ValueError("Give either atoms or selection")
+        if selection is not None:
+            atoms = traj.topology.select(selection)
+
+        c = self.compile()
+        rows = self.atom_interactions(atoms, internal=internal)
+        if chunk_size is None:
+            chunk_size = geometry.frames_per_chunk(sum([ len(r) for r in rows.values() ]))
+        terms = [("bond", "bonds", "distances"), ("angle", "angles", "angles"),
+                 ("dihedral", "dihedrals", "dihedrals"), ("pair", "pairs", "distances")]
+        fams = { kind:c.family_subset(kind, rows[kind]) for term, kind, coord in terms }
+
+        Eterms = { term:np.zeros(traj.n_frames, c.accumulate_dtype) for term, kind, coord in terms }
+        for frames in geometry.frame_chunks(traj.n_frames, chunk_size):
+            for term, kind, coord in terms:
+                if len(rows[kind]) == 0:
+                    continue
+                x = self._traj_geometry(coord, traj, getattr(c, kind[:-1] + "_idxs"),
+                                        frames, rows[kind])
+                Eterms[term][frames] = compiled.family_energy(fams[kind], x, True,
+                                                c.dtype, c.accumulate_dtype)
+
+        if by_term:
+            return Eterms
+        else:
+            Etotal = np.zeros(traj.n_frames, c.accumulate_dtype)
+            for E in Eterms.values():
+                Etotal += E
+            return Etotal
+
+    def _term_forces(self, xyz, box=None):
+        """Force on each atom for coordinates xyz (n_frames, n_atoms, 3)"""
+        c = self.compile()
+        n_atoms = xyz.shape[1]
+
+        r, dr = geometry.distance_gradients(xyz, np.concatenate([c.bond_idxs, c.pair_idxs]), box)
+        dVdr = np.concatenate([
+                compiled.family_derivative(c.bond_families, r[:,:c.n_bonds], "dVdr", c.dtype),
+                compiled.family_derivative(c.pair_families, r[:,c.n_bonds:], "dVdr", c.dtype)], axis=1)
+        forces = geometry.scatter_to_atoms(-dVdr[:,:,np.newaxis,np.newaxis]*dr,
+                        np.concatenate([c.bond_idxs, c.pair_idxs]), n_atoms)
+
+        theta, dtheta = geometry.angle_gradients(xyz, c.angle_idxs, box)
+        dVdtheta = compiled.family_derivative(c.angle_families, theta, "dVdtheta", c.dtype)
+        forces += geometry.scatter_to_atoms(-dVdtheta[:,:,np.newaxis,np.newaxis]*dtheta,
+                        c.angle_idxs, n_atoms)
+
+        # Terms sharing a quartet add up before the chain rule.
+        phi, dphi = geometry.dihedral_gradients(xyz, c.dihedral_quartets, box)
+        dVdphi_terms = compiled.family_derivative(c.dihedral_families,
+                            phi[:,c.dihedral_inverse], "dVdphi", c.dtype)
+        dVdphi = np.zeros(phi.shape, c.dtype)
+        np.add.at(dVdphi, (slice(None), c.dihedral_inverse), dVdphi_terms)
+        forces += geometry.scatter_to_atoms(-dVdphi[:,:,np.newaxis,np.newaxis]*dphi,
+                        c.dihedral_quartets, n_atoms)
+        return forces
+
+    def calc_forces(self, traj, chunk_size=None):
+        """Force on each atom from all interactions
+
+        The derivative of each potential with respect to its distance, angle
+        or dihedral is multiplied by the gradient of that coordinate with
+        respect to the positions of its atoms and summed onto the atoms.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        chunk_size : int (opt.)
+            Number of frames evaluated at once. By default as many as keep
+            the coordinate gradients of a chunk to about 2**24 values (see
+            geometry.frames_per_chunk).
+
+        Returns
+        -------
+        forces : np.ndarray (n_frames, n_atoms, 3)
+            Forces in the units of energy per nm.
+        """
+        c = self.compile()
+        dtype = c.dtype
+        if chunk_size is None:
+            # Up to four atoms times three components per interaction.
+            chunk_size = geometry.frames_per_chunk(12*c.n_interactions)
+        box = geometry.traj_box(traj)
+        forces = np.zeros((traj.n_frames, traj.n_atoms, 3), dtype)
+        for frames in geometry.frame_chunks(traj.n_frames, chunk_size):
+            chunk_box = None if box is None else box[frames]
+            # Gradients lose too much precision in float32 coordinates,
+            # unless single precision was asked for.
+            xyz = traj.xyz[frames].astype(dtype)
+            forces[frames] = self._term_forces(xyz, chunk_box)
+        return forces
+
+    def calc_hessian(self, traj, frame=0):
+        """Second derivatives of the energy with respect to the coordinates
+
+        Assembled from the analytic second derivatives of each potential and
+        of its distance, angle or dihedral, one family of interactions at a
+        time. Each interaction only couples its own atoms, so the matrix is
+        stored sparse and stays small for large systems. Always computed in
+        double precision.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        frame : int (opt.)
+            Frame of traj to expand around.
+
+        Returns
+        -------
+        hessian : scipy.sparse.csr_matrix (3*n_atoms, 3*n_atoms)
+            Entry (3*a + x, 3*b + y) is the second derivative with respect to
+        coordinate x of atom a and coordinate y of atom b.
+        """
+        c = self.compile()
+        xyz = np.asarray(traj.xyz[frame:frame + 1], float)
+        box = geometry.traj_box(traj)
+        box = None if box is None else np.asarray(box[frame:frame + 1], float)
+
+        def derivatives(fams, x, deriv):
+            return (compiled.family_derivative(fams, x, deriv),
+                    compiled.family_derivative(fams, x, "d2" + deriv[1:] + "2"))
+
+        terms = []
+        for idxs, fams in [(c.bond_idxs, c.bond_families), (c.pair_idxs, c.pair_families)]:
+            r, dr, d2r = geometry.distance_hessians(xyz, idxs, box)
+            dV, d2V = derivatives(fams, r, "dVdr")
+            terms.append((geometry.chain_hessian(dV, d2V, dr, d2r)[0], idxs))
+
+        theta, dtheta, d2theta = geometry.angle_hessians(xyz, c.angle_idxs, box)
+        dV, d2V = derivatives(c.angle_families, theta, "dVdtheta")
+        terms.append((geometry.chain_hessian(dV, d2V, dtheta, d2theta)[0], c.angle_idxs))
+
+        # Terms sharing a quartet add up before the chain rule.
+        phi, dphi, d2phi = geometry.dihedral_hessians(xyz, c.dihedral_quartets, box)
+        dV_terms, d2V_terms = derivatives(c.dihedral_families, phi[:,c.dihedral_inverse], "dVdphi")
+        dV = np.zeros(phi.shape)
+        d2V = np.zeros(phi.shape)
+        np.add.at(dV, (slice(None), c.dihedral_inverse), dV_terms)
+        np.add.at(d2V, (slice(None), c.dihedral_inverse), d2V_terms)
+        terms.append((geometry.chain_hessian(dV, d2V, dphi, d2phi)[0], c.dihedral_quartets))
+        return geometry.sparse_hessian(terms, traj.n_atoms)
+
+    def normal_modes(self, traj, k=10, frame=0, sigma=None):
+        """Lowest eigenvalues and eigenvectors of the Hessian
+
+        Uses ARPACK in shift-invert mode (scipy.sparse.linalg.eigsh), which
+        factorizes the sparse Hessian minus sigma instead of forming a dense
+        (3*n_atoms, 3*n_atoms) matrix. The modes returned are those with
+        eigenvalues closest to sigma, i.e. the lowest ones around a minimum.
+        Atoms have unit mass. Without periodic boundaries six of the modes
+        are the rigid translations and rotations, with eigenvalues near zero.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        k : int (opt.)
+            Number of modes.
+        frame : int (opt.)
+            Frame of traj to expand around, e.g. a minimized structure.
+        sigma : float (opt.)
+            Shift the eigenvalues closest to are found. Default is just below
+            zero, -1e-12 times the largest diagonal element, so the zero modes
+            don't make the shifted matrix singular. Shifts farther from the
+            soft modes converge more slowly.
+
+        Returns
+        -------
+        eigenvalues : np.ndarray (k,)
+            In increasing order, in units of energy per nm^2.
+        modes : np.ndarray (3*n_atoms, k)
+            Column m is the normalized eigenvector of eigenvalue m.
+        """
+        hessian = self.calc_hessian(traj, frame)
+        if not (0 < k < hessian.shape[0]):
+            raise ValueError("k must be between 1 and {}, not {}".format(hessian.shape[0] - 1, k))
+        if sigma is None:
+            sigma = -1e-12*max(np.max(np.abs(hessian.diagonal())), 1.)
+        eigenvalues, modes = scipy.sparse.linalg.eigsh(hessian.tocsc(), k=k, sigma=sigma, which="LM")
+        order = np.argsort(eigenvalues)
+        return eigenvalues[order], modes[:,order]
+
+    def minimize(self, traj, frame=0, max_iter=1000, tol=1.):
+        """Relax a configuration to the nearest energy minimum
+
+        Runs L-BFGS (scipy.optimize.minimize with method="L-BFGS-B") on the
+        total energy, with the analytic forces as gradient. Each step
+        evaluates all terms vectorized over the interactions of each family.
+        The box of a periodic traj is kept fixed.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        frame : int (opt.)
+            Frame of traj to start from.
+        max_iter : int (opt.)
+            Maximum number of L-BFGS iterations.
+        tol : float (opt.)
+            Converged when no force component is larger than tol, in energy
+            per nm (emtol of GROMACS). Warns if it isn't reached.
+
+        Returns
+        -------
+        minimized : mdtraj.Trajectory
+            One frame with the relaxed coordinates.
+        """
+        minimized = traj[frame]
+        shape = minimized.xyz.shape
+        box = geometry.traj_box(minimized)
+        box = None if box is None else np.asarray(box, float)
+
+        def energy_and_gradient(x):
+            xyz = x.reshape(shape)
+            E = self._total_energy(xyz, box)[0]
+            forces = self._term_forces(xyz, box)
+            return float(E), -np.asarray(forces, float).reshape(-1)
+
+        # ftol=0 so that only the forces (or max_iter) stop the minimization,
+        # not a small relative change in energy.
+        result = scipy.optimize.minimize(energy_and_gradient,
+                        np.asarray(minimized.xyz, float).reshape(-1), jac=True,
+                        method="L-BFGS-B", options={"maxiter":max_iter, "gtol":tol, "ftol":0.})
+        max_force = np.max(np.abs(result.jac))
+        if max_force > tol:
+            util.minimization_warning("largest force {} is above tol {} ({})".format(
+                                        max_force, tol, result.message))
+        minimized.xyz = result.x.reshape(shape)
+        return minimized
+
+    def check_precision(self, traj, chunk_size=None):
+        """Largest deviation of the energies and forces from double precision
+
+        Evaluates traj with the precision set with set_precision and again
+        in double precision.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        chunk_size : int (opt.)
+            Number of frames evaluated at once, see calc_total_energy and
+            calc_forces.
+
+        Returns
+        -------
+        deviations : dict
+            Maximum absolute deviation over frames of the energy of the
+        "bond", "angle", "dihedral" and "pair" terms, of the "total" energy
+        and of the "forces" on any atom.
+        """
+        Eterms = self.calc_total_energy(traj, by_term=True, chunk_size=chunk_size)
+        forces = self.calc_forces(traj, chunk_size=chunk_size)
+
+        precision, snapshot = self._precision, self._compiled
+        self._precision = compiled.precision_dtypes()
+        self._compiled = None
+        try:
+            Eterms_ref = self.calc_total_energy(traj, by_term=True, chunk_size=chunk_size)
+            forces_ref = self.calc_forces(traj, chunk_size=chunk_size)
+        finally:
+            self._precision, self._compiled = precision, snapshot
+
+        def max_deviation(x, x_ref):
+            return float(np.max(np.abs(x.astype(float) - x_ref), initial=0.))
+
+        deviations = { term:max_deviation(Eterms[term], Eterms_ref[term]) for term in Eterms }
+        deviations["total"] = max_deviation(sum(Eterms.values()), sum(Eterms_ref.values()))
+        deviations["forces"] = max_deviation(forces, forces_ref)
+        return deviations
+
+    def _local_energy(self, kind, rows, xyz, moves, box=None):
+        """Energy of interactions rows before and after moving atoms
+
+        The coordinates of the atoms of each interaction are gathered into
+        a small array, so the cost doesn't depend on the system size.
+
+        Returns
+        -------
+        E : np.ndarray (2,)
+            Energy of the interactions in xyz and with the moves applied.
+        """
+        c = self.compile()
+        idxs = getattr(c, kind[:-1] + "_idxs")[rows]
+        local = np.asarray(xyz)[idxs]
+        moved = local.copy()
+        for atom, position in moves:
+            moved[idxs == atom] = position
+        local_xyz = np.stack([local, moved]).reshape(2, -1, 3)
+        local_idxs = np.arange(idxs.size).reshape(idxs.shape)
+        if box is not None:
+            box = np.broadcast_to(np.asarray(box, float), (2,) + np.shape(box))
+
+        function = {"bonds":geometry.distances, "angles":geometry.angles,
+                    "dihedrals":geometry.dihedrals, "pairs":geometry.distances}[kind]
+        x = function(self._coordinates(local_xyz), local_idxs, box)
+        return compiled.family_energy(c.family_subset(kind, rows), x, accumulate=float)
+
+    def delta_energy(self, xyz, atom_index, new_position, box=None):
+        """Change in energy when one atom moves, e.g. for a Monte Carlo move
+
+        Only the interactions involving atom_index are evaluated, found
+        with the atom to interaction adjacency of the compiled Hamiltonian
+        (see CompiledHamiltonian.atom_interactions). The cost of a move
+        grows with the number of interactions of the atom instead of the
+        size of the system.
+
+        Parameters
+        ----------
+        xyz : np.ndarray (n_atoms, 3)
+            Current coordinates.
+        atom_index : int
+            Atom to move.
+        new_position : np.ndarray (3,)
+            Trial position of the atom.
+        box : np.ndarray (3,) or (3, 3) (opt.)
+            Box lengths, or triclinic box vectors, for periodic boundaries.
+
+        Returns
+        -------
+        dE : float
+            Energy after the move minus energy before.
+        """
+        c = self.compile()
+        dE = 0.
+        for kind in ["bonds", "angles", "dihedrals", "pairs"]:
+            rows = c.atom_interactions(kind, atom_index)
+            if len(rows) > 0:
+                E = self._local_energy(kind, rows, xyz, [(atom_index, new_position)], box)
+                dE += E[1] - E[0]
+        return float(dE)
+
+    def calc_dV_depsilons(self, traj, params_to_fit_indices=None, out=None,
+                          chunk_size=None):
+        """Derivative of the pair energy with respect to each fitted epsilon
+
+        Builds the whole matrix one family at a time instead of calling
+        get_dV_depsilons for each pair. Switching pairs (LJ12GAUSSIANTANH)
+        use the branch chosen by the sign of their epsilon, and the average
+        of both branches for epsilon=0, as get_dV_depsilons does.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        params_to_fit_indices : array(int) (opt.)
+            Indices of the fitted pairs, see Model.assign_fitted_epsilons.
+            Default is all pairs.
+        out : np.ndarray (opt.)
+            Array of shape (n_frames, n_params) to write into, e.g. a
+            np.memmap for matrices that don't fit in memory.
+        chunk_size : int (opt.)
+            Number of frames evaluated at once. By default as many as keep
+            the distances of the fitted pairs in a chunk to 2**24 values
+            (see geometry.frames_per_chunk).
+
+        Returns
+        -------
+        dVdeps : np.ndarray (n_frames, n_params)
+            Column k holds dV/deps of pair params_to_fit_indices[k]. Zero for
+            pairs whose potential has no epsilon (e.g. FLATWELL, CUSTOM).
+        """
+        c = self.compile()
+        if params_to_fit_indices is None:
+            params_to_fit_indices = np.arange(c.n_pairs)
+        rows = np.asarray(params_to_fit_indices, int)
+        if chunk_size is None:
+            chunk_size = geometry.frames_per_chunk(len(rows))
+
+        shape = (traj.n_frames, len(rows))
+        if out is None:
+            out = np.zeros(shape, c.dtype)
+        elif out.shape != shape:
+            raise ValueError("out has shape {}, expected {}".format(out.shape, shape))
+        else:
+            out[:] = 0.
+
+        fams = [ (columns, block) for columns, block in
+                    compiled.families(self._tables["pairs"], rows, c.dtype)
+                    if "eps" in (getattr(block, "_param_names", None) or ()) ]
+
+        for frames in geometry.frame_chunks(traj.n_frames, chunk_size):
+            r = self._traj_geometry("distances", traj, c.pair_idxs, frames, rows)
+            for columns, block in fams:
+                out[frames,columns] = block.dV_depsilon(r[:,columns])
+        return out
+
+    def calc_dV_dparams(self, traj, selection, out=None, chunk_size=None):
+        """Derivative of the energy with respect to a selection of parameters
+
+        The counterpart of calc_dV_depsilons for any parameter of any kind
+        of interaction, e.g. dV/dr0 and dV/dwidth of the pairs or dV/dkb of
+        the bonds. Each family is evaluated as one block with the analytic
+        derivatives of its potential (see PairPotential.dV_dparam), so the
+        result can be streamed into an accumulators.DerivativeAccumulator
+        like dV/deps.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        selection : storage.ParameterSelection or str
+            Parameters to differentiate with respect to, from
+            select_parameters. A parameter name selects it in every kind.
+        out : np.ndarray (opt.)
+            Array of shape (n_frames, n_params) to write into.
+        chunk_size : int (opt.)
+            Number of frames evaluated at once. By default as many as keep
+            the coordinates of the selected interactions in a chunk to
+            2**24 values (see geometry.frames_per_chunk).
+
+        Returns
+        -------
+        dVdparams : np.ndarray (n_frames, n_params)
+            Column k holds the derivative with respect to entry k of
+        selection. Parameters of the same interaction fall in separate
+        columns.
+        """
+        if isinstance(selection, str):
+            selection = self.select_parameters(selection)
+        c = self.compile()
+        if chunk_size is None:
+            chunk_size = geometry.frames_per_chunk(len(selection))
+
+        shape = (traj.n_frames, len(selection))
+        if out is None:
+            out = np.zeros(shape, c.dtype)
+        elif out.shape != shape:
+            raise ValueError("out has shape {}, expected {}".format(out.shape, shape))
+
+        # Entries of a selection block with the same potential and parameter
+        # column form one group: (positions in rows, families, name).
+        blocks = []
+        start = 0
+        for kind, rows, columns in selection.blocks:
+            table = self._tables[kind]
+            unique, inverse = np.unique(np.column_stack([table.code_ids[rows], columns]),
+                                        axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+            groups = []
+            for group, (code_id, k) in enumerate(unique.tolist()):
+                positions = np.flatnonzero(inverse == group)
+                groups.append((positions, compiled.families(table, rows[positions], c.dtype),
+                               table.classes[code_id]._param_names[k]))
+            blocks.append((kind, rows, groups, start))
+            start += len(rows)
+
+        coords = {"bonds":"distances", "angles":"angles", "dihedrals":"dihedrals",
+                  "pairs":"distances"}
+        for frames in geometry.frame_chunks(traj.n_frames, chunk_size):
+            for kind, rows, groups, start in blocks:
+                x = self._traj_geometry(coords[kind], traj, getattr(c, kind[:-1] + "_idxs"),
+                                        frames, rows)
+                for positions, fams, name in groups:
+                    out[frames,start + positions] = compiled.family_param_derivative(
+                                            fams, x[:,positions], name, c.dtype)
+        return out
+
+    def calc_pair_energy_batch(self, traj, eps_matrix, chunk_size=None):
+        """Pair energy under many sets of epsilons at once
+
+        For families linear in epsilon the energy is the eps=0 energy plus
+        dV/deps times epsilon, so distances and dV/deps are computed once per
+        chunk and multiplied with all the parameter sets. Other families
+        (e.g. LJ12GAUSSIANTANH, which switches on the sign of epsilon) are
+        evaluated once for each parameter set.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        eps_matrix : np.ndarray (n_pairs, K)
+            Column k holds the epsilon of each pair in parameter set k, in
+            the order of _epsilons. Ignored for pairs without an epsilon.
+        chunk_size : int (opt.)
+            Number of frames evaluated at once. By default as many as keep
+            the distances and energies of a chunk to 2**24 values (see
+            geometry.frames_per_chunk).
+
+        Returns
+        -------
+        E : np.ndarray (n_frames, K)
+            Pair energy of each frame under each parameter set.
+        """
+        c = self.compile()
+        eps_matrix = np.asarray(eps_matrix, float)
+        if (eps_matrix.ndim != 2) or (eps_matrix.shape[0] != c.n_pairs):
+            raise ValueError("eps_matrix must have shape (n_pairs, K) = ({}, K), not {}".format(
+                c.n_pairs, eps_matrix.shape))
+        n_sets = eps_matrix.shape[1]
+        if chunk_size is None:
+            chunk_size = geometry.frames_per_chunk(c.n_pairs + n_sets)
+
+        E = np.zeros((traj.n_frames, n_sets), float)
+        for frames in geometry.frame_chunks(traj.n_frames, chunk_size):
+            r = self._traj_geometry("distances", traj, c.pair_idxs, frames)
+            for columns, block in c.pair_families:
+                r_fam = r[:,columns]
+                if "eps" not in (getattr(block, "_param_names", None) or ()):
+                    E[frames] += np.sum(block.V(r_fam), axis=1)[:,np.newaxis]
+                elif block._linear_in_epsilon:
+                    V0 = compiled.with_epsilon(block, np.zeros(len(columns))).V(r_fam)
+                    E[frames] += np.sum(V0, axis=1)[:,np.newaxis]
+                    E[frames] += np.dot(block.dVdeps(r_fam), eps_matrix[columns])
+                else:
+                    for k in range(n_sets):
+                        Vk = compiled.with_epsilon(block, eps_matrix[columns,k]).V(r_fam)
+                        E[frames,k] += np.sum(Vk, axis=1)
+        return E
+
+    def define_contact_group(self, label, pairs=None, pair_indices=None):
+        """Define a group of contacts by a label
+
+        The label can later be used to get their energy, see
+        calc_contact_group_energy. Groups are stored as indices into the
+        pair interactions, so they stay valid as more pairs are added.
+
+        Parameters
+        ----------
+        label : str
+            Name of the group, e.g. 'native'.
+        pairs : array(int) (n, 2) (opt.)
+            Atom indices of the contacts, e.g. [[1,10],[2,10]]. Every pair
+            interaction between those atoms joins the group.
+        pair_indices : array(int) (opt.)
+            Indices of the pair interactions in the group, instead of pairs.
+        """
+        if (pairs is None) == (pair_indices is None):
+            raise ValueError("Give either pairs or pair_indices")
+
+        c = self.compile()
+        if pair_indices is not None:
+            rows = np.asarray(pair_indices, int).reshape(-1)
+            if np.any(rows < 0) or np.any(rows >= c.n_pairs):
+                raise ValueError("pair_indices out of range for {} pairs".format(c.n_pairs))
+        else:
+            pairs = np.sort(np.asarray(pairs, int).reshape(-1, 2), axis=1)
+            table_pairs = np.sort(c.pair_idxs, axis=1)
+            # Match contacts to interactions as single integers.
+            n_atoms = max(table_pairs.max(initial=0), pairs.max(initial=0)) + 1
+            contact_codes = pairs[:,0]*n_atoms + pairs[:,1]
+            table_codes = table_pairs[:,0]*n_atoms + table_pairs[:,1]
+            missing = ~np.isin(contact_codes, table_codes)
+            if np.any(missing):
+                raise ValueError("No pair interaction between atoms {}".format(
+                    pairs[missing].tolist()))
+            rows = np.flatnonzero(np.isin(table_codes, contact_codes))
+        self._contact_groups[label] = rows
+
+    @property
+    def contact_groups(self):
+        """Labels of the defined contact groups"""
+        return list(self._contact_groups.keys())
+
+    def _pair_group_energies(self, groups, traj, chunk_size=None):
+        """Energy of groups of pairs, given as arrays of pair indices
+
+        Every pair in any group is evaluated once per chunk of frames and
+        the groups are summed with one segmented reduction.
+
+        Returns
+        -------
+        E : np.ndarray (n_frames, n_groups)
+        """
+        c = self.compile()
+        sizes = np.array([ len(rows) for rows in groups ], int)
+        members = np.concatenate([ np.zeros(0, int) ] + [ np.asarray(rows, int) for rows in groups ])
+        if chunk_size is None:
+            chunk_size = geometry.frames_per_chunk(len(members))
+
+        # Evaluate only the pairs that belong to a group.
+        rows, member_columns = np.unique(members, return_inverse=True)
+        fams = c.family_subset("pairs", rows)
+
+        E = np.zeros((traj.n_frames, len(groups)), c.accumulate_dtype)
+        nonempty = sizes > 0
+        starts = (np.cumsum(sizes) - sizes)[nonempty]
+        for frames in geometry.frame_chunks(traj.n_frames, chunk_size):
+            if len(members) == 0:
+                break
+            r = self._traj_geometry("distances", traj, c.pair_idxs, frames, rows)
+            Vpairs = compiled.family_energy(fams, r, sum=False, dtype=c.dtype)
+            E[frames,nonempty] = np.add.reduceat(Vpairs[:,member_columns], starts,
+                                                 axis=1, dtype=c.accumulate_dtype)
+        return E
+
+    def calc_contact_group_energy(self, label, traj, chunk_size=None):
+        """Energy of one or more groups of contacts
+
+        Parameters
+        ----------
+        label : str or list
+            Label of a group defined with define_contact_group, or a list
+            of labels to evaluate in a single pass.
+        traj : mdtraj.Trajectory
+
+        chunk_size : int (opt.)
+            Number of frames evaluated at once. By default as many as keep
+            the energies of the grouped pairs in a chunk to 2**24 values
+            (see geometry.frames_per_chunk).
+
+        Returns
+        -------
+        E : np.ndarray (n_frames,) or dict
+            Energy of the group, or a dict with the energy of each group if
+            label is a list.
+        """
+        labels = [label] if isinstance(label, str) else list(label)
+        for name in labels:
+            if name not in self._contact_groups:
+                raise KeyError("No contact group {}, see define_contact_group".format(name))
+
+        E = self._pair_group_energies([ self._contact_groups[name] for name in labels ],
+                                      traj, chunk_size=chunk_size)
+        if isinstance(label, str):
+            return E[:,0]
+        else:
+            return { name:E[:,i] for i, name in enumerate(labels) }
+
+    def select_parameters(self, param, kind=None, code=None):
+        """Select parameters by parameter and interaction type
+
+        Parameters
+        ----------
+        param : str
+            Parameter name, e.g. eps, r0, width, rNC, kb, ka, kd.
+        kind : str or list (opt.)
+            Interaction kinds to select from: bonds, angles, dihedrals,
+            pairs. Default is every kind that has the parameter.
+        code : str or list (opt.)
+            Potential labels to select from, e.g. LJ1210.
+
+        Returns
+        -------
+        selection : storage.ParameterSelection
+            Writable flat vector of the selected parameters, ordered by
+            kind and then by interaction.
+        """
+        kinds = ["bonds", "angles", "dihedrals", "pairs"] if kind is None else kind
+        kinds = [kinds] if isinstance(kinds, str) else list(kinds)
+        codes = [code] if isinstance(code, str) else code
+        for name in kinds:
+            if name not in self._tables:
+                raise ValueError("kind must be one of {}, not {}".format(
+                    list(self._tables.keys()), name))
+
+        blocks = []
+        for name in kinds:
+            table = self._tables[name]
+            # Column of the parameter for each potential type, -1 if absent.
+            class_columns = np.full(len(table.classes) + 1, -1, int)
+            for code_id, (pot_class, label) in enumerate(zip(table.classes, table.labels)):
+                names = pot_class._param_names or ()
+                if (param in names) and ((codes is None) or (label in codes)):
+                    class_columns[code_id] = names.index(param)
+            columns = class_columns[table.code_ids]
+            rows = np.flatnonzero(columns >= 0)
+            if len(rows) > 0:
+                blocks.append((name, rows, columns[rows]))
+        return _storage.ParameterSelection(self, blocks)
+
+    def set_parameters(self, selection, values):
+        """Assign the parameters of a selection in bulk
+
+        Values are written to the interaction tables with one array
+        assignment per kind. Stored potential objects read their parameters
+        from the tables (see storage.TableParameter), so no object is
+        touched and references to them see the new values.
+
+        Parameters
+        ----------
+        selection : storage.ParameterSelection
+            From select_parameters.
+        values : array(float) or float
+            New values, one for each selected parameter.
+        """
+        values = np.broadcast_to(np.asarray(values, float), (len(selection),))
+        start = 0
+        for kind, rows, columns in selection.blocks:
+            # Integer parameters (e.g. mult) must stay integers, as the
+            # objects created from the table round them.
+            table = self._tables[kind]
+            block_values = values[start:start + len(rows)]
+            code_ids = table.code_ids[rows]
+            for code_id in np.unique(code_ids).tolist():
+                pot_class = table.classes[code_id]
+                for name in getattr(pot_class, "_int_param_names", ()):
+                    k = pot_class._param_names.index(name)
+                    new = block_values[(code_ids == code_id) & (columns == k)]
+                    if np.any(new != np.round(new)):
+                        raise ValueError("{} of {} must be an integer".format(
+                                            name, table.labels[code_id]))
+            start += len(rows)
+
+        start = 0
+        for kind, rows, columns in selection.blocks:
+            stop = start + len(rows)
+            table = self._tables[kind]
+            table.params[rows, columns] = values[start:stop]
+            if any( table.classes[code_id]._key_param_names for code_id in
+                        np.unique(table.code_ids[rows]).tolist() ):
+                # The keys of e.g. bonds include their parameters.
+                self._index[kind] = None
+            start = stop
+        self._invalidate()
+
@@ -0,0 +1,307 @@
+"""Optional compiled kernels for the potential families
+
+If numba is importable, the supported families can be evaluated by fused
+kernels. Each kernel makes one pass over the (n_frames, n_interactions)
+block, parallel over frames, and writes straight into the output. The
+NumPy expressions instead create a temporary for every operation (e.g.
+three for 5*x**12 - 6*x**10). Without numba the NumPy blocks are used
+unchanged.
+"""
+
+import math
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+from . import bonded
+from . import pairwise
+from . import util
+
+def available():
+    """True if numba can be imported"""
+    return numba is not None
+
+def _element(function):
+    """Compile a scalar function with numba, if available"""
+    if numba is None:
+        return function
+    return numba.njit(function)
+
+# Energy and derivative of one interaction for each potential, written like
+# the NumPy methods of pairwise.py and bonded.py. Parameters come in the order
+# of _param_names, padded to four.
+
+@_element
+def _lj12_V(r, eps, r0, p2, p3):
+    x = r0/r
+    return eps*(x**12)
+
+@_element
+def _lj12_dV(r, eps, r0, p2, p3):
+    x = r0/r
+    return eps*((-12./r0)*(x**13))
+
+@_element
+def _lj126_V(r, eps, r0, p2, p3):
+    x = r0/r
+    return eps*(4*((x**12) - (x**6)))
+
+@_element
+def _lj126_dV(r, eps, r0, p2, p3):
+    x = r0/r
+    return eps*((-24/r0)*(2.*(x**13) - (x**7)))
+
+@_element
+def _lj1210_V(r, eps, r0, p2, p3):
+    x = r0/r
+    return eps*(5.*(x**12) - 6.*(x**10))
+
+@_element
+def _lj1210_dV(r, eps, r0, p2, p3):
+    x = r0/r
+    return eps*((-60./r0)*((x**13) - (x**11)))
+
+@_element
+def _tanhrep_V(r, eps, r0, width, p3):
+    alpha = 1./width
+    return eps*(0.5*(math.tanh(-alpha*(r - (r0 + width))) + 1.))
+
+@_element
+def _tanhrep_dV(r, eps, r0, width, p3):
+    alpha = 1./width
+    return eps*(-0.5*alpha*(1. - (math.tanh(-alpha*(r - (r0 + width))))**2))
+
+@_element
+def _lj12tanhrep_V(r, eps, rNC, r0, width):
+    return _tanhrep_V(r, eps, r0, width, 0.) + (rNC/r)**12
+
+@_element
+def _lj12tanhrep_dV(r, eps, rNC, r0, width):
+    return _tanhrep_dV(r, eps, r0, width, 0.) - (12./rNC)*((rNC/r)**13)
+
+@_element
+def _gaussian_V(r, eps, r0, width, p3):
+    return eps*(-math.exp(-((r - r0)**2)/(2.*(width**2))))
+
+@_element
+def _gaussian_dV(r, eps, r0, width, p3):
+    return eps*(((r - r0)/(width**2))*math.exp(-((r - r0)**2)/(2.*(width**2))))
+
+@_element
+def _lj12gaussian_V(r, eps, rNC, r0, width):
+    G = _gaussian_V(r, 1., r0, width, 0.)
+    L = _lj12_V(r, 1., rNC, 0., 0.)
+    return (eps*G) + L + (L*G)
+
+@_element
+def _lj12gaussian_dV(r, eps, rNC, r0, width):
+    G = _gaussian_V(r, 1., r0, width, 0.)
+    dG = _gaussian_dV(r, 1., r0, width, 0.)
+    L = _lj12_V(r, 1., rNC, 0., 0.)
+    dL = _lj12_dV(r, 1., rNC, 0., 0.)
+    return (eps*dG) + dL + (dL*G) + (L*dG)
+
+@_element
+def _harmonic_V(x, k, x0, p2, p3):
+    return k*(0.5*(x - x0)**2)
+
+@_element
+def _harmonic_dV(x, k, x0, p2, p3):
+    return k*(x - x0)
+
+@_element
+def _cosine_V(phi, kd, phi0, mult, p3):
+    return kd*(1. - math.cos(mult*(phi - phi0)))
+
+@_element
+def _cosine_dV(phi, kd, phi0, mult, p3):
+    return kd*(mult*math.sin(mult*(phi - phi0)))
+
+# Potential class: (energy, derivative, name of the derivative method)
+ELEMENTS = {pairwise.LJ12Potential:(_lj12_V, _lj12_dV, "dVdr"),
+            pairwise.LJ126Potential:(_lj126_V, _lj126_dV, "dVdr"),
+            pairwise.LJ1210Potential:(_lj1210_V, _lj1210_dV, "dVdr"),
+            pairwise.TanhRepPotential:(_tanhrep_V, _tanhrep_dV, "dVdr"),
+            pairwise.LJ12TanhRepPotential:(_lj12tanhrep_V, _lj12tanhrep_dV, "dVdr"),
+            pairwise.GaussianPotential:(_gaussian_V, _gaussian_dV, "dVdr"),
+            pairwise.LJ12GaussianPotential:(_lj12gaussian_V, _lj12gaussian_dV, "dVdr"),
+            bonded.HarmonicBondPotential:(_harmonic_V, _harmonic_dV, "dVdr"),
+            bonded.HarmonicAnglePotential:(_harmonic_V, _harmonic_dV, "dVdtheta"),
+            bonded.HarmonicDihedralPotential:(_harmonic_V, _harmonic_dV, "dVdphi"),
+            bonded.CosineDihedralPotential:(_cosine_V, _cosine_dV, "dVdphi")}
+
+def _make_kernel(element):
+    """Parallel loop applying element to every entry of a block"""
+    @numba.njit(parallel=True)
+    def kernel(x, p0, p1, p2, p3, out):
+        for f in numba.prange(x.shape[0]):
+            for k in range(x.shape[1]):
+                out[f,k] = element(x[f,k], p0[k], p1[k], p2[k], p3[k])
+    return kernel
+
+def _python_kernel(element):
+    """The loop of _make_kernel in plain Python, only used by conformance"""
+    def kernel(x, p0, p1, p2, p3, out):
+        for f in range(x.shape[0]):
+            for k in range(x.shape[1]):
+                out[f,k] = element(x[f,k], p0[k], p1[k], p2[k], p3[k])
+    return kernel
+
+_kernels = {}
+
+def _kernel(element):
+    # Elements are shared between potentials, so is their compiled kernel.
+    if element not in _kernels:
+        _kernels[element] = _make_kernel(element)
+    return _kernels[element]
+
+class KernelBlock(object):
+
+    def __init__(self, block):
+        """Family of interactions evaluated by compiled kernels
+
+        Other attributes (e.g. dVdeps, eps) are those of the NumPy block.
+
+        Parameters
+        ----------
+        block : potential with a class in ELEMENTS
+            NumPy block of the family, see compiled.families.
+
+        """
+        if not available():
+            raise ImportError("Compiled kernels need numba")
+        self._setup(block, _kernel)
+
+    @classmethod
+    def _uncompiled(cls, block):
+        """Kernel block running its kernels as plain Python loops
+
+        Only for checking the kernel formulas without numba, see
+        conformance. Much slower than NumPy.
+        """
+        kernel_block = cls.__new__(cls)
+        kernel_block._setup(block, _python_kernel)
+        return kernel_block
+
+    def _setup(self, block, make_kernel):
+        V, dV, derivative = ELEMENTS[type(block)]
+        self.numpy_block = block
+        self._make_kernel = make_kernel
+        self._V_kernel = make_kernel(V)
+        self._dV_kernel = make_kernel(dV)
+
+        params = [ np.ascontiguousarray(np.atleast_1d(getattr(block, name)))
+                    for name in block._param_names ]
+        padding = np.zeros(params[0].shape, params[0].dtype)
+        self._params = params + [padding]*(4 - len(params))
+        setattr(self, derivative, self._derivative)
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the kernel block itself.
+        if name == "numpy_block":
+            raise AttributeError(name)
+        return getattr(self.numpy_block, name)
+
+    def subset(self, columns):
+        """Kernel block of only some interactions of the family"""
+        block = self.numpy_block
+        params = [ np.atleast_1d(getattr(block, name))[columns] for name in block._param_names ]
+        kernel_block = type(self).__new__(type(self))
+        kernel_block._setup(block.block(*params), self._make_kernel)
+        return kernel_block
+
+    def _evaluate(self, kernel, x):
+        x = np.ascontiguousarray(x)
+        out = np.empty(x.shape, np.result_type(x, self._params[0]))
+        kernel(x, *(self._params + [out]))
+        return out
+
+    def V(self, x):
+        return self._evaluate(self._V_kernel, x)
+
+    def _derivative(self, x):
+        return self._evaluate(self._dV_kernel, x)
+
+def accelerate_families(fams):
+    """Replace the blocks of the supported families by kernel blocks
+
+    Parameters
+    ----------
+    fams : list
+        (columns, block) tuples from compiled.families.
+    """
+    return [ (columns, KernelBlock(block) if type(block) in ELEMENTS else block)
+                for columns, block in fams ]
+
+def conformance(n_frames=20, n_interactions=50, seed=0, tol=1e-10, require_numba=False):
+    """Check that the kernels agree with the NumPy potentials
+
+    Every supported potential is evaluated with random parameters on
+    random coordinates by both backends. The kernels pass if the deviation
+    |kernel - numpy|/max(|numpy|, 1) is at most tol everywhere. In double
+    precision the deviations are rounding errors of about 1e-14.
+
+    Without numba the kernel functions are checked as plain Python loops,
+    with a warning, so the result only covers the formulas and not their
+    compilation, unless require_numba=True.
+
+    Parameters
+    ----------
+    n_frames : int (opt.)
+
+    n_interactions : int (opt.)
+
+    seed : int (opt.)
+
+    tol : float (opt.)
+        Largest deviation allowed.
+    require_numba : bool (opt.)
+        If True raise ImportError without numba instead of checking the
+        plain Python loops.
+
+    Returns
+    -------
+    passed : bool
+        True if every potential is within tol.
+    deviations : dict
+        For each potential label, a dict with the maximum deviation for "V"
+    and the derivative (e.g. "dVdr").
+    """
+    if not available():
+        if require_numba:
+            raise ImportError("Compiled kernels need numba")
+        util.uncompiled_kernels_warning()
+
+    rng = np.random.RandomState(seed)
+    ranges = {"eps":(-2., 2.), "r0":(0.3, 0.8), "rNC":(0.3, 0.5), "width":(0.03, 0.1),
+              "kb":(10., 1e4), "ka":(10., 100.), "theta0":(1., 2.5), "kd":(0.1, 5.),
+              "phi0":(-np.pi, np.pi)}
+
+    deviations = {}
+    for pot_class, (V, dV, derivative) in ELEMENTS.items():
+        params = []
+        for name in pot_class._param_names:
+            if name == "mult":
+                params.append(rng.randint(1, 4, n_interactions).astype(float))
+            else:
+                low, high = ranges[name]
+                params.append(rng.uniform(low, high, n_interactions))
+        block = pot_class.block(*params)
+        if derivative == "dVdr":
+            x = rng.uniform(0.25, 1.5, (n_frames, n_interactions))
+        else:
+            x = rng.uniform(-np.pi, np.pi, (n_frames, n_interactions))
+
+        fast = KernelBlock(block) if available() else KernelBlock._uncompiled(block)
+        deviations[block.prefix_label] = {}
+        for method in ["V", derivative]:
+            ref = getattr(block, method)(x)
+            diff = np.abs(getattr(fast, method)(x) - ref)/np.maximum(np.abs(ref), 1.)
+            deviations[block.prefix_label][method] = float(np.max(diff))
+
+    passed = all( deviation <= tol for methods in deviations.values()
+                    for deviation in methods.values() )
+    return passed, deviations
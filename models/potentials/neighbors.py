@@ -0,0 +1,197 @@
+"""Neighbor search for evaluating pairs within a cutoff"""
+
+import itertools
+import numpy as np
+
+from . import geometry
+
+def _ranges(start, counts):
+    """Concatenation of range(start[k], start[k] + counts[k]) over k"""
+    position = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return np.repeat(start, counts) + position
+
+def periodic_cells(box, cutoff):
+    """Whether a cell list works in a periodic box, see cell_list_pairs"""
+    if np.ndim(box) == 2:
+        # Triclinic box vectors, cells would need to follow the box shape.
+        return False
+    return np.all(np.floor(np.asarray(box)/cutoff) >= 3)
+
+def cell_list_pairs(xyz, cutoff, box=None):
+    """Pairs of atoms closer than cutoff in one frame, found with a cell list
+
+    Atoms are binned into cells of side at least cutoff, so only atoms in
+    the same or neighboring cells are compared.
+
+    Parameters
+    ----------
+    xyz : np.ndarray (n_atoms, 3)
+
+    cutoff : float
+
+    box : np.ndarray (3,) (opt.)
+        Box lengths for periodic boundaries. Cells then wrap around the box,
+        which needs at least three cells along each side (see
+        periodic_cells).
+
+    Returns
+    -------
+    pairs : np.ndarray (n, 2)
+        Atom indices i < j of each pair.
+    """
+    n_atoms = xyz.shape[0]
+    if box is None:
+        cells = np.floor((xyz - xyz.min(axis=0))/cutoff).astype(int)
+        n_cells = cells.max(axis=0) + 1
+    else:
+        box = np.asarray(box, float)
+        if not periodic_cells(box, cutoff):
+            raise ValueError("box {} is too small for cells of side {}".format(box, cutoff))
+        n_cells = np.floor(box/cutoff).astype(int)
+        cells = np.floor((xyz % box)/(box/n_cells)).astype(int) % n_cells
+
+    def cell_ids(cells):
+        return (cells[:,0]*n_cells[1] + cells[:,1])*n_cells[2] + cells[:,2]
+
+    order = np.argsort(cell_ids(cells), kind="stable")
+    sorted_ids = cell_ids(cells)[order]
+
+    pairs = []
+    for offset in itertools.product((-1, 0, 1), repeat=3):
+        neighbor = cells + np.array(offset)
+        if box is None:
+            valid = np.all((neighbor >= 0) & (neighbor < n_cells), axis=1)
+        else:
+            neighbor %= n_cells
+            valid = np.ones(n_atoms, bool)
+        neighbor_ids = cell_ids(neighbor)
+        start = np.searchsorted(sorted_ids, neighbor_ids, side="left")
+        stop = np.searchsorted(sorted_ids, neighbor_ids, side="right")
+        counts = np.where(valid, stop - start, 0)
+
+        # Every atom against every atom of its neighboring cell.
+        i = np.repeat(np.arange(n_atoms), counts)
+        j = order[_ranges(start, counts)]
+        keep = i < j
+        pairs.append(np.column_stack([i[keep], j[keep]]))
+    pairs = np.concatenate(pairs)
+
+    d = xyz[pairs[:,1]] - xyz[pairs[:,0]]
+    if box is not None:
+        d -= box*np.round(d/box)
+    return pairs[np.sum(d**2, axis=1) < cutoff**2]
+
+class PairNeighborList(object):
+
+    def __init__(self, pair_idxs, cutoffs, skin=0.1):
+        """Verlet list of the pair interactions within their cutoff
+
+        The list holds the interactions closer than their cutoff plus skin
+        in a reference frame. It stays valid for later frames as long as no
+        atom has moved more than skin/2 from the reference.
+
+        Parameters
+        ----------
+        pair_idxs : np.ndarray (n_pairs, 2)
+            Atom indices of the pair interactions.
+        cutoffs : np.ndarray (n_pairs,)
+            Cutoff of each interaction, np.inf to always keep it.
+        skin : float (opt.)
+            Extra distance so the list can be reused over several frames.
+
+        """
+        self.pair_idxs = pair_idxs
+        self.cutoffs = cutoffs
+        self.skin = skin
+
+        self._always = np.flatnonzero(~np.isfinite(cutoffs))
+        self._finite = np.flatnonzero(np.isfinite(cutoffs))
+        pairs = np.sort(pair_idxs[self._finite], axis=1)
+        self._n_atoms = int(pair_idxs.max(initial=0)) + 1
+        # Only these atoms can move pairs across their cutoff.
+        self._atoms = np.unique(pairs)
+        # Atom pairs as sorted integer codes, to look up close atoms quickly.
+        codes = pairs[:,0]*self._n_atoms + pairs[:,1]
+        self._order = np.argsort(codes, kind="stable")
+        self._codes = codes[self._order]
+        self._max_cutoff = cutoffs[self._finite].max(initial=0.) + skin
+
+    def build(self, xyz, box=None):
+        """Interactions within cutoff plus skin of each other in one frame
+
+        Parameters
+        ----------
+        xyz : np.ndarray (n_atoms, 3)
+            Reference frame.
+        box : np.ndarray (3,) or (3, 3) (opt.)
+            Box lengths or triclinic box vectors for periodic boundaries.
+            If the box is triclinic or less than three times the largest
+            cutoff plus skin along a side, the distances of all
+            interactions are checked directly instead of with a cell list.
+
+        Returns
+        -------
+        rows : np.ndarray
+            Sorted indices of the listed interactions.
+        """
+        if len(self._finite) == 0:
+            return self._always
+        if (box is None) or periodic_cells(box, self._max_cutoff):
+            close = cell_list_pairs(xyz[:self._n_atoms], self._max_cutoff, box)
+            close_codes = close[:,0]*self._n_atoms + close[:,1]
+            start = np.searchsorted(self._codes, close_codes, side="left")
+            stop = np.searchsorted(self._codes, close_codes, side="right")
+            candidates = self._finite[self._order[_ranges(start, stop - start)]]
+        else:
+            candidates = self._finite
+        r = geometry.distances(xyz[np.newaxis], self.pair_idxs[candidates],
+                               None if box is None else np.asarray(box)[np.newaxis])[0]
+        listed = candidates[r < self.cutoffs[candidates] + self.skin]
+        return np.sort(np.concatenate([listed, self._always]))
+
+    def segments(self, xyz, box=None):
+        """Split frames into runs that can share one list
+
+        Parameters
+        ----------
+        xyz : np.ndarray (n_frames, n_atoms, 3)
+
+        box : np.ndarray (n_frames, 3) or (n_frames, 3, 3) (opt.)
+
+        Returns
+        -------
+        segments : generator
+            (frames, rows) with frames a slice of frames and rows the listed
+            interactions, built at the first frame of the slice.
+        """
+        n_frames = xyz.shape[0]
+        start = 0
+        while start < n_frames:
+            rows = self.build(xyz[start], None if box is None else box[start])
+            stop = self._first_moved(xyz, box, start)
+            yield slice(start, stop), rows
+            start = stop
+
+    def _first_moved(self, xyz, box, start):
+        """First frame after start where an atom moved more than skin/2
+
+        Frames are checked in windows that double in size, so finding a
+        segment costs about as many displacements as it has frames.
+        """
+        n_frames = xyz.shape[0]
+        if len(self._finite) == 0:
+            return n_frames
+        ref = xyz[start,self._atoms]
+        frame, window = start + 1, 1
+        while frame < n_frames:
+            frames = slice(frame, min(frame + window, n_frames))
+            d = xyz[frames,self._atoms] - ref
+            if box is not None:
+                # Atoms wrapped around the box haven't moved.
+                d = geometry.minimum_image(d, box[start:start + 1])
+            moved = np.flatnonzero(np.max(np.sum(d**2, axis=2), axis=1) > (0.5*self.skin)**2)
+            if len(moved) > 0:
+                return frame + moved[0]
+            frame = frames.stop
+            window *= 2
+        return n_frames
@@ -1,23 +1,72 @@
 import numpy as np
 
-# TODO: Add derivatives of potential w.r.t. all parameters
-
 ############################################################################
 # Pair potentials
 ############################################################################
 
+# Cutoff rules shared by the potentials. Each returns the distance beyond
+# which that part of the potential is smaller than tol in magnitude.
+def _lj12_cutoff(rNC, tol):
+    # (rNC/r)**12 < tol
+    return rNC*(tol**(-1./12))
+
+def _gaussian_cutoff(eps, r0, width, tol):
+    # |eps|*exp(-(r - r0)**2/(2*width**2)) < tol
+    return r0 + width*np.sqrt(2.*np.log(np.maximum(np.abs(eps), tol)/tol))
+
+def _tanh_cutoff(eps, r0, width, tol):
+    # 0.5*|eps|*(tanh(-(r - r0 - width)/width) + 1) < |eps|*exp(-2*(r - r0 - width)/width) < tol
+    return r0 + width + 0.5*width*np.log(np.maximum(np.abs(eps), tol)/tol)
+
 class PairPotential(object):
 
+    # Constructor arguments that parameterize the potential, in order. A
+    # family of pairs is packed into one array per name, see block().
+    _param_names = ()
+
+    # Leading _param_names that also identify the pair (see _key). Empty for
+    # pairs, so a pair of atoms has one interaction of each potential.
+    _key_param_names = ()
+
+    # Hamiltonian holding this pair, told when a parameter changes.
+    _owner = None
+
+    # Whether V(r) = eps*dVdeps(r) + V(r) at eps=0, so the energy under new
+    # epsilons is a linear combination of dVdeps.
+    _linear_in_epsilon = False
+
     def __init__(self, atmi, atmj):
         self.atmi = atmi
         self.atmj = atmj
 
+    @classmethod
+    def block(cls, *params):
+        """Potential for a family of pairs evaluated all at once
+
+        Parameters
+        ----------
+        *params : array(float)
+            One array of shape (n_pairs,) for each name in _param_names.
+
+        Returns
+        -------
+        block : PairPotential
+            Potential holding arrays as parameters. Its methods take distances
+            of shape (n_frames, n_pairs) and broadcast over the pairs.
+        """
+        return cls(None, None, *params)
+
     def describe(self):
         """interaction description"""
         return "{}:{:>12}{:>12}".format(self.prefix_label, self.atmi, self.atmj)
 
     def set_epsilon(self, value):
         self.eps = value
+        self._parameters_changed()
+
+    def _parameters_changed(self):
+        if self._owner is not None:
+            self._owner._parameters_changed(self)
 
     def get_V_epsilons(self, r):
         """ Returns function V(epsilons)
@@ -67,6 +116,51 @@ class PairPotential(object):
 
         return func
 
+    def dV_depsilon(self, r):
+        """ dV/depsilon at the current epsilon
+
+        Same as get_dV_depsilons(r)(self.eps), without creating a function.
+        Works on a block of pairs as well.
+        """
+        return self.dVdeps(r)
+
+    def dV_dparam(self, r, name):
+        """ dV/dparam for the parameter name, one of _param_names
+
+        Uses the method dVd<name>, except for eps where dV_depsilon is used
+        so switching potentials follow the sign convention of
+        get_dV_depsilons. Works on a block of pairs as well.
+        """
+        if name not in (self._param_names or ()):
+            raise ValueError("{} has no parameter {}".format(self.prefix_label, name))
+        if name == "eps":
+            return self.dV_depsilon(r)
+        return getattr(self, "dVd" + name)(r)
+
+    def cutoff(self, tol):
+        """ Distance beyond which |V(r)| stays below tol
+
+        Pairs farther apart are dropped in cutoff mode, see
+        Hamiltonian.calc_pair_energy. Potentials that don't decay to zero
+        (e.g. FLATWELL, CUSTOM) have no cutoff.
+
+        Parameters
+        ----------
+        tol : float
+            Energy tolerance for each dropped pair.
+        """
+        return np.inf
+
+    @property
+    def other_params(self):
+        """Parameters after eps, as listed in pairwise parameter files"""
+        return [ getattr(self, name) for name in (self._param_names or ())[1:] ]
+
+    def _key(self):
+        """Identifies the interaction in a Hamiltonian, regardless of order"""
+        i, j = self.atmi.index, self.atmj.index
+        return (self.prefix_label, min(i, j), max(i, j))
+
     def __hash__(self):
         hash_value = hash(self.prefix_label)
         hash_value ^= hash(self.atmi)
@@ -93,11 +187,13 @@ class PairPotential(object):
 
 class LJPotential(PairPotential):
 
+    _param_names = ("eps", "r0")
+    _linear_in_epsilon = True
+
     def __init__(self, atmi, atmj, eps, r0):
         PairPotential.__init__(self, atmi, atmj)
         self.eps = eps
         self.r0 = r0
-        self.other_params = [r0]
 
 class LJ12Potential(LJPotential):
 
@@ -119,6 +215,18 @@ class LJ12Potential(LJPotential):
         x = self.r0/r
         return (-12./self.r0)*(x**13)
 
+    def d2Vdr2(self, r):
+        x = self.r0/r
+        return self.eps*156.*(x**12)/(r**2)
+
+    def dVdr0(self, r):
+        x = self.r0/r
+        return self.eps*(12./self.r0)*(x**12)
+
+    def cutoff(self, tol):
+        # |eps|*x**12 < tol
+        return self.r0*((np.maximum(np.abs(self.eps), tol)/tol)**(1./12))
+
 class LJ126Potential(LJPotential):
 
     def __init__(self, atmi, atmj, eps, r0):
@@ -139,6 +247,18 @@ class LJ126Potential(LJPotential):
         x = self.r0/r
         return (-24/self.r0)*(2.*(x**13) - (x**7))
 
+    def d2Vdr2(self, r):
+        x = self.r0/r
+        return self.eps*4.*(156.*(x**12) - 42.*(x**6))/(r**2)
+
+    def dVdr0(self, r):
+        x = self.r0/r
+        return self.eps*(24./self.r0)*(2.*(x**12) - (x**6))
+
+    def cutoff(self, tol):
+        # |4*eps*(x**12 - x**6)| < 8*|eps|*x**6 < tol for r > r0
+        return self.r0*((np.maximum(8.*np.abs(self.eps), tol)/tol)**(1./6))
+
 class LJ1210Potential(LJPotential):
 
     def __init__(self, atmi, atmj, eps, r0):
@@ -159,6 +279,18 @@ class LJ1210Potential(LJPotential):
         x = self.r0/r
         return (-60./self.r0)*((x**13) - (x**11))
 
+    def d2Vdr2(self, r):
+        x = self.r0/r
+        return self.eps*(780.*(x**12) - 660.*(x**10))/(r**2)
+
+    def dVdr0(self, r):
+        x = self.r0/r
+        return self.eps*(60./self.r0)*((x**12) - (x**10))
+
+    def cutoff(self, tol):
+        # |eps*(5*x**12 - 6*x**10)| < 11*|eps|*x**10 < tol for r > r0
+        return self.r0*((np.maximum(11.*np.abs(self.eps), tol)/tol)**(1./10))
+
 class LJ1210RepPotential(LJPotential):
 
     def __init__(self, atmi, atmj, eps, r0):
@@ -185,15 +317,31 @@ class LJ1210RepPotential(LJPotential):
         V[x <= 1] = (60./r0)*(x[x <= 1]**13 - x[x <= 1]**11)
         return V
 
+    def d2Vdr2(self, r):
+        x = self.r0/r
+        return self.eps*np.where(x > 1, 780.*(x**12) - 660.*(x**10),
+                                 -780.*(x**12) - 660.*(x**10))/(r**2)
+
+    def dVdr0(self, r):
+        x = self.r0/r
+        return self.eps*np.where(x > 1, (60./self.r0)*((x**12) - (x**10)),
+                                 (-60./self.r0)*((x**12) + (x**10)))
+
+    def cutoff(self, tol):
+        # |eps*(-5*x**12 - 6*x**10)| < 11*|eps|*x**10 < tol for r > r0
+        return self.r0*((np.maximum(11.*np.abs(self.eps), tol)/tol)**(1./10))
+
 class TanhRepPotential(PairPotential):
 
+    _param_names = ("eps", "r0", "width")
+    _linear_in_epsilon = True
+
     def __init__(self, atmi, atmj, eps, r0, width):
         PairPotential.__init__(self, atmi, atmj)
         self.prefix_label = "TANHREP"
         self.eps = eps
         self.r0 = r0
         self.width = width
-        self.other_params = [r0, width]
 
     def V(self,r):
         return self.eps*self.dVdeps(r)
@@ -211,8 +359,25 @@ class TanhRepPotential(PairPotential):
         r0prime = self.r0 + self.width
         return -0.5*alpha*(1. - (np.tanh(-alpha*(r - r0prime)))**2)
 
+    def d2Vdr2(self, r):
+        alpha = 1./self.width
+        r0prime = self.r0 + self.width
+        return 2.*alpha*np.tanh(-alpha*(r - r0prime))*self.dVdr(r)
+
+    def dVdr0(self, r):
+        return -self.dVdr(r)
+
+    def dVdwidth(self, r):
+        return -self.dVdr(r)*(r - self.r0)/self.width
+
+    def cutoff(self, tol):
+        return _tanh_cutoff(self.eps, self.r0, self.width, tol)
+
 class LJ12TanhRepPotential(PairPotential):
 
+    _param_names = ("eps", "rNC", "r0", "width")
+    _linear_in_epsilon = True
+
     def __init__(self, atmi, atmj, eps, rNC, r0, width):
         PairPotential.__init__(self, atmi, atmj)
         self.prefix_label = "LJ12TANHREP"
@@ -220,7 +385,6 @@ class LJ12TanhRepPotential(PairPotential):
         self.rNC = rNC
         self.r0 = r0
         self.width = width
-        self.other_params = [rNC, r0, width]
 
     def V(self,r):
         return self.eps*self.dVdeps(r) + (self.rNC/r)**12
@@ -238,15 +402,37 @@ class LJ12TanhRepPotential(PairPotential):
         r0prime = self.r0 + self.width
         return -0.5*alpha*(1. - (np.tanh(-alpha*(r - r0prime)))**2)
 
+    def d2Vdr2(self, r):
+        alpha = 1./self.width
+        r0prime = self.r0 + self.width
+        return (2.*alpha*np.tanh(-alpha*(r - r0prime))*self.eps*self.d2Vdrdeps(r) +
+                156.*((self.rNC/r)**12)/(r**2))
+
+    def dVdrNC(self, r):
+        return (12./self.rNC)*((self.rNC/r)**12)
+
+    def dVdr0(self, r):
+        return -self.eps*self.d2Vdrdeps(r)
+
+    def dVdwidth(self, r):
+        return -self.eps*self.d2Vdrdeps(r)*(r - self.r0)/self.width
+
+    def cutoff(self, tol):
+        # Each of the two terms below tol/2.
+        return np.maximum(_tanh_cutoff(self.eps, self.r0, self.width, 0.5*tol),
+                          _lj12_cutoff(self.rNC, 0.5*tol))
+
 class GaussianPotential(PairPotential):
 
+    _param_names = ("eps", "r0", "width")
+    _linear_in_epsilon = True
+
     def __init__(self, atmi, atmj, eps, r0, width):
         PairPotential.__init__(self, atmi, atmj)
         self.prefix_label = "GAUSSIAN"
         self.eps = eps
         self.r0 = r0
         self.width = width
-        self.other_params = [r0, width]
 
     def V(self, r):
         return self.eps*self.dVdeps(r)
@@ -260,8 +446,25 @@ class GaussianPotential(PairPotential):
     def d2Vdrdeps(self, r):
         return ((r - self.r0)/(self.width**2))*np.exp(-((r - self.r0)**2)/(2.*(self.width**2)))
 
+    def d2Vdr2(self, r):
+        return self.eps*((1. - ((r - self.r0)/self.width)**2)/(self.width**2))*np.exp(
+                            -((r - self.r0)**2)/(2.*(self.width**2)))
+
+    def dVdr0(self, r):
+        return -self.dVdr(r)
+
+    def dVdwidth(self, r):
+        return -self.dVdr(r)*(r - self.r0)/self.width
+
+    def cutoff(self, tol):
+        return _gaussian_cutoff(self.eps, self.r0, self.width, tol)
+
 class LJ12GaussianPotential(PairPotential):
 
+    # The LJ12-Gaussian cross term doesn't depend on eps.
+    _param_names = ("eps", "rNC", "r0", "width")
+    _linear_in_epsilon = True
+
     def __init__(self, atmi, atmj, eps, rNC, r0, width):
         PairPotential.__init__(self, atmi, atmj)
         self.prefix_label = "LJ12GAUSSIAN"
@@ -269,9 +472,16 @@ class LJ12GaussianPotential(PairPotential):
         self.rNC = rNC
         self.r0 = r0
         self.width = width
-        self.gaussian = GaussianPotential(atmi, atmj, 1.0, r0, width)
-        self.lj12 = LJ12Potential(atmi, atmj, 1.0, rNC)
-        self.other_params = [rNC, r0, width]
+
+    # Parts built from the current parameters, which may live in a table
+    # (see storage.TableParameter).
+    @property
+    def gaussian(self):
+        return GaussianPotential(self.atmi, self.atmj, 1.0, self.r0, self.width)
+
+    @property
+    def lj12(self):
+        return LJ12Potential(self.atmi, self.atmj, 1.0, self.rNC)
 
     def V(self, r):
         return (self.eps * self.gaussian.V(r)) + self.lj12.V(r) + (self.lj12.V(r) * self.gaussian.V(r))
@@ -285,11 +495,30 @@ class LJ12GaussianPotential(PairPotential):
     def d2Vdrdeps(self, r):
         return self.gaussian.d2Vdrdeps(r)
 
-    def set_epsilon(self, value):
-        self.eps = value
+    def d2Vdr2(self, r):
+        return ((self.eps + self.lj12.V(r))*self.gaussian.d2Vdr2(r) +
+                self.lj12.d2Vdr2(r)*(1. + self.gaussian.V(r)) +
+                2.*self.lj12.dVdr(r)*self.gaussian.dVdr(r))
+
+    def dVdrNC(self, r):
+        return self.lj12.dVdr0(r)*(1. + self.gaussian.V(r))
+
+    def dVdr0(self, r):
+        return (self.eps + self.lj12.V(r))*self.gaussian.dVdr0(r)
+
+    def dVdwidth(self, r):
+        return (self.eps + self.lj12.V(r))*self.gaussian.dVdwidth(r)
+
+    def cutoff(self, tol):
+        # |V| < |eps|*G + LJ12 with G the Gaussian, each term below tol/2.
+        return np.maximum(_gaussian_cutoff(self.eps, self.r0, self.width, 0.5*tol),
+                          _lj12_cutoff(self.rNC, 0.5*tol))
 
 class LJ12GaussTanhSwitching(PairPotential):
     """ LJ12 Potential with Gaussian attractive and tanh repulsive"""
+
+    _param_names = ("eps", "rNC", "r0", "width")
+
     def __init__(self, atmi, atmj, eps, rNC, r0, width):
         PairPotential.__init__(self, atmi, atmj)
         self.prefix_label = "LJ12GAUSSIANTANH"
@@ -297,10 +526,24 @@ class LJ12GaussTanhSwitching(PairPotential):
         self.rNC = rNC
         self.r0 = r0
         self.width = width
-        self.attractive = LJ12GaussianPotential(atmi, atmj, np.abs(eps), rNC, r0, width)
-        self.repulsive = LJ12TanhRepPotential(atmi, atmj, np.abs(eps), rNC, r0, width)
-        self.determine_current()
-        self.other_params = [rNC, r0, width]
+
+    @property
+    def attractive(self):
+        return LJ12GaussianPotential(self.atmi, self.atmj, np.abs(self.eps),
+                                     self.rNC, self.r0, self.width)
+
+    @property
+    def repulsive(self):
+        return LJ12TanhRepPotential(self.atmi, self.atmj, np.abs(self.eps),
+                                    self.rNC, self.r0, self.width)
+
+    @property
+    def current(self):
+        """ If eps > 0, return attractive, otherwise return repulsive"""
+        if self.eps < 0:
+            return self.repulsive
+        else:
+            return self.attractive
 
     def V(self, r):
         return self.current.V(r)
@@ -312,20 +555,27 @@ class LJ12GaussTanhSwitching(PairPotential):
         return self.current.dVdeps(r)
 
     def d2Vdrdeps(self, r):
-        return self.current.d2Vdrdeps(self, r)
+        return self.current.d2Vdrdeps(r)
 
-    def determine_current(self):
-        """ If eps > 0, return attractive, otherwise return repulsive"""
-        if self.eps < 0:
-            self.current = self.repulsive
-        else:
-            self.current = self.attractive
+    def d2Vdr2(self, r):
+        return self.current.d2Vdr2(r)
 
-    def set_epsilon(self, value):
-        self.eps = value
-        self.attractive.set_epsilon(np.abs(value))
-        self.repulsive.eps = np.abs(value)
-        self.determine_current()
+    def dVdrNC(self, r):
+        return self.current.dVdrNC(r)
+
+    def dVdr0(self, r):
+        return self.current.dVdr0(r)
+
+    def dVdwidth(self, r):
+        return self.current.dVdwidth(r)
+
+    @classmethod
+    def block(cls, eps, rNC, r0, width):
+        return LJ12GaussTanhSwitchingBlock(eps, rNC, r0, width)
+
+    def cutoff(self, tol):
+        # Covers both branches, whatever the sign of eps.
+        return np.maximum(self.attractive.cutoff(tol), self.repulsive.cutoff(tol))
 
     def get_V_epsilons(self, r):
         constants_list_att = self.attractive.dVdeps(r)
@@ -352,32 +602,88 @@ class LJ12GaussTanhSwitching(PairPotential):
 
         return func
 
+    def dV_depsilon(self, r):
+        dVdeps_att = self.attractive.dVdeps(r)
+        dVdeps_rep = self.repulsive.dVdeps(r)
+        dVdeps_average = (dVdeps_att + dVdeps_rep) / 2.
+        return np.where(self.eps < 0, dVdeps_rep,
+                        np.where(self.eps > 0, dVdeps_att, dVdeps_average))
+
+class LJ12GaussTanhSwitchingBlock(LJ12GaussTanhSwitching):
+    """ Family of LJ12GAUSSIANTANH pairs, switched by the sign of each eps"""
+
+    def __init__(self, eps, rNC, r0, width):
+        LJ12GaussTanhSwitching.__init__(self, None, None, eps, rNC, r0, width)
+
+    def V(self, r):
+        return np.where(self.eps < 0, self.repulsive.V(r), self.attractive.V(r))
+
+    def dVdr(self, r):
+        return np.where(self.eps < 0, self.repulsive.dVdr(r), self.attractive.dVdr(r))
+
+    def dVdeps(self, r):
+        return np.where(self.eps < 0, self.repulsive.dVdeps(r), self.attractive.dVdeps(r))
+
+    def d2Vdrdeps(self, r):
+        return np.where(self.eps < 0, self.repulsive.d2Vdrdeps(r), self.attractive.d2Vdrdeps(r))
+
+    def d2Vdr2(self, r):
+        return np.where(self.eps < 0, self.repulsive.d2Vdr2(r), self.attractive.d2Vdr2(r))
+
+    def dVdrNC(self, r):
+        return np.where(self.eps < 0, self.repulsive.dVdrNC(r), self.attractive.dVdrNC(r))
+
+    def dVdr0(self, r):
+        return np.where(self.eps < 0, self.repulsive.dVdr0(r), self.attractive.dVdr0(r))
+
+    def dVdwidth(self, r):
+        return np.where(self.eps < 0, self.repulsive.dVdwidth(r), self.attractive.dVdwidth(r))
 
+    # Branches are chosen per pair in each method.
+    current = None
 
 class FlatBottomWell(PairPotential):
 
+    _param_names = ("kb", "rNC", "r0")
+
     def __init__(self, atmi, atmj, kb, rNC, r0):
         PairPotential.__init__(self, atmi, atmj)
         self.prefix_label = "FLATWELL"
         self.kb = kb
         self.rNC = rNC
         self.r0 = r0
-        self.other_params = [kb, rNC, r0]
+
+    @property
+    def other_params(self):
+        return [self.kb, self.rNC, self.r0]
 
     def V(self, r):
-        V = np.zeros(r.shape[0])
-        V[r < self.r0] = (self.rNC/r[r < self.r0])**12
-        V[r >= self.r0] = 0.5*self.kb*((r[r >= self.r0] - self.r0)**2)
-        return V
+        return np.where(r < self.r0, (self.rNC/r)**12,
+                        0.5*self.kb*((r - self.r0)**2))
 
     def dVdr(self, r):
-        dVdr = np.zeros(r.shape[0])
-        dVdr[r < self.r0] = -(12./self.rNC)*((self.rNC/r[r < self.r0])**13)
-        dVdr[r >= self.r0] = self.kb*(r[r >= self.r0] - self.r0)
-        return dVdr
+        return np.where(r < self.r0, -(12./self.rNC)*((self.rNC/r)**13),
+                        self.kb*(r - self.r0))
+
+    def d2Vdr2(self, r):
+        return np.where(r < self.r0, 156.*((self.rNC/r)**12)/(r**2),
+                        self.kb*np.ones(np.shape(r)))
+
+    def dVdkb(self, r):
+        return np.where(r < self.r0, 0., 0.5*((r - self.r0)**2))
+
+    def dVdrNC(self, r):
+        return np.where(r < self.r0, (12./self.rNC)*((self.rNC/r)**12), 0.)
+
+    def dVdr0(self, r):
+        # The jump of V at r0 is left out.
+        return np.where(r < self.r0, 0., -self.kb*(r - self.r0))
 
 class CustomPairPotential(PairPotential):
 
+    # Arbitrary functions can't be packed into arrays.
+    _param_names = None
+
     def __init__(self, atmi, atmj, func, *args):
         PairPotential.__init__(self, atmi, atmj)
         self.prefix_label = "CUSTOM"
@@ -390,6 +696,27 @@ class CustomPairPotential(PairPotential):
     def dVdr(self, r):
         return np.gradient(self.func(r, *self.args), r[1] - r[0])
 
+class PairPotentialGroup(object):
+    """ Pairs that can't be vectorized, evaluated one at a time
+
+    Stands in for the block of a family whose potential has no array form
+    (e.g. CUSTOM) so every family can be evaluated the same way.
+    """
+
+    def __init__(self, pots):
+        self.pots = pots
+
+    def V(self, r):
+        return np.column_stack([ pot.V(r[:,i]) for i, pot in enumerate(self.pots) ])
+
+    def dVdr(self, r, h=1e-6):
+        # CUSTOM dVdr differentiates along an evenly spaced grid of r, which
+        # a column of distances over frames is not. Use a central difference.
+        return (self.V(r + h) - self.V(r - h))/(2.*h)
+
+    def d2Vdr2(self, r, h=1e-4):
+        return (self.V(r + h) - 2.*self.V(r) + self.V(r - h))/(h**2)
+
 PAIR_POTENTIALS = {"LJ1210":LJ1210Potential,
                 "GAUSSIAN":GaussianPotential,
                 "LJ12GAUSSIAN":LJ12GaussianPotential,
@@ -0,0 +1,298 @@
+"""Predict energies and observables under new epsilons by reweighting"""
+
+import os
+import numpy as np
+
+from . import compiled
+from . import geometry
+from . import pairwise
+
+class Reweighter(object):
+
+    def __init__(self, hamiltonian, params_to_fit_indices=None, beta=1.,
+                 directory=None, proposals=None):
+        """Reweight sampled frames to a proposed set of epsilons
+
+        Trajectories are streamed through add_traj in chunks. For every chunk
+        the epsilon-independent part of the energy of each fitted pair is
+        computed (dV/deps, or both branches for LJ12GAUSSIANTANH pairs), so a
+        proposed epsilon vector is scored with a matrix product instead of
+        recomputing distances.
+
+        By default nothing per frame is kept: each chunk is scored against
+        the given proposals and folded into running log-sum-exp sums of the
+        weights and of the weighted observables, so memory doesn't grow with
+        the number of frames. Only these proposals can then be reweighted.
+
+        Pass directory to keep the basis of every chunk instead, in .npy
+        files mapped from disk, so any proposal can be scored later. It holds
+        n_frames x (n_linear + 3*n_switching + n_observables) values in the
+        precision of the Hamiltonian (see Hamiltonian.set_precision), where
+        n_switching counts the fitted LJ12GAUSSIANTANH pairs.
+
+        Parameters
+        ----------
+        hamiltonian : Hamiltonian
+            Hamiltonian the frames were sampled with.
+        params_to_fit_indices : array(int) (opt.)
+            Indices of the fitted pairs, see Model.assign_fitted_epsilons.
+            Default is all pairs.
+        beta : float (opt.)
+            Inverse temperature 1/kT in inverse energy units.
+        directory : str (opt.)
+            Existing directory to save each chunk to as .npy files, which are
+            then read through memory maps.
+        proposals : np.ndarray (n_params,) or (n_params, K) (opt.)
+            Epsilons of the fitted pairs to reweight to while streaming, or K
+            proposals at once. Required unless directory is given.
+
+        """
+        if directory is None and proposals is None:
+            raise ValueError("Give the proposals to reweight to, or a directory to store frames in")
+
+        c = hamiltonian.compile()
+        if params_to_fit_indices is None:
+            params_to_fit_indices = np.arange(c.n_pairs)
+
+        self.hamiltonian = hamiltonian
+        self.params_to_fit_indices = np.asarray(params_to_fit_indices, int)
+        self.beta = beta
+        self.directory = directory
+        self._dtype = c.dtype
+        self._eps_old = c.epsilons[self.params_to_fit_indices]
+
+        # Pairs whose energy doesn't depend on epsilon are left out.
+        self._linear = []
+        self._switching = []
+        for columns, block in compiled.families(hamiltonian._tables["pairs"],
+                                                self.params_to_fit_indices):
+            if "eps" not in (getattr(block, "_param_names", None) or ()):
+                continue
+            elif block._linear_in_epsilon:
+                self._linear.append((columns, block))
+            elif isinstance(block, pairwise.LJ12GaussTanhSwitching):
+                self._switching.append((columns, block))
+            else:
+                raise ValueError("Can't reweight {} pairs".format(block.prefix_label))
+        self._linear_columns = np.concatenate([ np.zeros(0, int) ] +
+                                    [ columns for columns, block in self._linear ])
+        self._switching_columns = np.concatenate([ np.zeros(0, int) ] +
+                                    [ columns for columns, block in self._switching ])
+
+        self._chunks = []
+        self._n_frames = 0
+
+        # Running sums over streamed frames of exp(log_w - _shift) for each
+        # proposal, rescaled whenever the largest log weight grows.
+        self.proposals = None if proposals is None else np.asarray(proposals, float)
+        if self.proposals is not None:
+            K = self.proposals.shape[1:]
+            self._shift = np.full(K, -np.inf)
+            self._sum_w = np.zeros(K)
+            self._sum_w2 = np.zeros(K)
+            self._sum_w_obs = None
+
+    @property
+    def n_frames(self):
+        return self._n_frames
+
+    def add_traj(self, traj, observables=None, chunk_size=None):
+        """Add the energy basis and observables of the frames of traj
+
+        The chunks are folded into the sums for the proposals, and also kept
+        if a directory was given.
+
+        Parameters
+        ----------
+        traj : mdtraj.Trajectory
+
+        observables : function (opt.)
+            Called with each chunk of traj, returns an array of shape
+            (n_chunk_frames,) or (n_chunk_frames, n_observables).
+        chunk_size : int (opt.)
+            Number of frames evaluated at once. By default as many as keep
+            the distances of the fitted pairs in a chunk to 2**24 values
+            (see geometry.frames_per_chunk).
+        """
+        pair_idxs = self.hamiltonian.compile().pair_idxs
+        if chunk_size is None:
+            chunk_size = geometry.frames_per_chunk(len(self.params_to_fit_indices))
+        for frames in geometry.frame_chunks(traj.n_frames, chunk_size):
+            r = self.hamiltonian._traj_geometry("distances", traj, pair_idxs, frames,
+                                                self.params_to_fit_indices)
+
+            dtype = self._dtype
+            dVdeps = np.zeros((r.shape[0], len(self._linear_columns)), dtype)
+            start = 0
+            for columns, block in self._linear:
+                dVdeps[:,start:start + len(columns)] = block.dVdeps(r[:,columns])
+                start += len(columns)
+
+            # Switching pairs have a slope for each sign of epsilon, plus the
+            # jump in energy between the two branches at eps=0.
+            n_switching = len(self._switching_columns)
+            dVdeps_att = np.zeros((r.shape[0], n_switching), dtype)
+            dVdeps_rep = np.zeros((r.shape[0], n_switching), dtype)
+            V_jump = np.zeros((r.shape[0], n_switching), dtype)
+            start = 0
+            for columns, block in self._switching:
+                r_fam = r[:,columns]
+                stop = start + len(columns)
+                zeros = np.zeros(len(columns))
+                dVdeps_att[:,start:stop] = block.attractive.dVdeps(r_fam)
+                dVdeps_rep[:,start:stop] = block.repulsive.dVdeps(r_fam)
+                V_jump[:,start:stop] = compiled.with_epsilon(block.attractive, zeros).V(r_fam) - \
+                                        compiled.with_epsilon(block.repulsive, zeros).V(r_fam)
+                start = stop
+
+            if observables is None:
+                obs = np.zeros((r.shape[0], 0), dtype)
+            else:
+                obs = np.asarray(observables(traj[frames]), dtype).reshape(r.shape[0], -1)
+
+            chunk = (dVdeps, dVdeps_att, dVdeps_rep, V_jump, obs)
+            if self.proposals is not None:
+                self._fold(chunk)
+            if self.directory is not None:
+                self._chunks.append(self._keep(chunk))
+            self._n_frames += r.shape[0]
+
+    def _fold(self, chunk):
+        """Add the weights of the frames of a chunk to the running sums"""
+        eps = self.proposals
+        eps_old = self._eps_old.reshape((-1,) + (1,)*(eps.ndim - 1))
+        dU = self._chunk_energy(chunk, eps) - self._chunk_energy(chunk, eps_old)
+        log_w = -self.beta*np.asarray(dU, float)
+
+        shift = np.maximum(self._shift, np.max(log_w, axis=0))
+        scale = np.exp(self._shift - shift)
+        w = np.exp(log_w - shift)
+        obs = np.asarray(chunk[-1], float)
+        if self._sum_w_obs is None:
+            self._sum_w_obs = np.zeros(eps.shape[1:] + obs.shape[1:])
+
+        self._shift = shift
+        self._sum_w = scale*self._sum_w + np.sum(w, axis=0)
+        self._sum_w2 = scale**2*self._sum_w2 + np.sum(w**2, axis=0)
+        self._sum_w_obs = np.expand_dims(scale, -1)*self._sum_w_obs + np.dot(np.transpose(w), obs)
+
+    def _keep(self, arrays):
+        """Arrays of a chunk as stored, saved to directory if one is given"""
+        if self.directory is None:
+            return arrays
+        kept = []
+        for k, array in enumerate(arrays):
+            filename = os.path.join(self.directory, "chunk{}_{}.npy".format(len(self._chunks), k))
+            np.save(filename, array)
+            kept.append(np.load(filename, mmap_mode="r"))
+        return tuple(kept)
+
+    def _stored_chunks(self):
+        if self.directory is None:
+            raise ValueError("Frames weren't stored, only the proposals can be "
+                             "reweighted (see directory)")
+        if len(self._chunks) == 0:
+            raise ValueError("No frames added, see add_traj")
+        return self._chunks
+
+    def _folded_sums(self, eps):
+        """Running sums of the proposals, or None if eps must be scored from stored frames"""
+        if eps is not None and self.directory is not None:
+            return None
+        elif eps is not None:
+            # Raises that the frames weren't stored.
+            self._stored_chunks()
+        elif self.proposals is None:
+            raise ValueError("No proposals given, pass eps")
+        elif self._n_frames == 0:
+            raise ValueError("No frames added, see add_traj")
+        return self._sum_w, self._sum_w2, self._sum_w_obs
+
+    def _chunk_energy(self, chunk, eps):
+        """Energy of the fitted pairs in a chunk, up to a constant, (n_chunk_frames[, K])"""
+        dVdeps, dVdeps_att, dVdeps_rep, V_jump, obs = chunk
+        eps_lin = eps[self._linear_columns]
+        eps_sw = eps[self._switching_columns]
+        attractive = (eps_sw >= 0).astype(float)
+        return (np.dot(dVdeps, eps_lin) +
+                np.dot(dVdeps_att, attractive*np.abs(eps_sw)) +
+                np.dot(dVdeps_rep, (1. - attractive)*np.abs(eps_sw)) +
+                np.dot(V_jump, attractive))
+
+    def _fitted_energy(self, eps):
+        """Energy of the fitted pairs, up to a constant, (n_frames[, K])"""
+        # One chunk at a time, so the stored arrays are never concatenated.
+        return np.concatenate([ self._chunk_energy(chunk, eps)
+                                for chunk in self._stored_chunks() ])
+
+    def delta_energy(self, eps):
+        """Change in energy of each stored frame for new epsilons
+
+        Parameters
+        ----------
+        eps : np.ndarray (n_params,) or (n_params, K)
+            Proposed epsilons of the fitted pairs, or K proposals at once.
+
+        Returns
+        -------
+        dU : np.ndarray (n_frames,) or (n_frames, K)
+        """
+        eps = np.asarray(eps, float)
+        eps_old = self._eps_old.reshape((-1,) + (1,)*(eps.ndim - 1))
+        return self._fitted_energy(eps) - self._fitted_energy(eps_old)
+
+    def weights(self, eps):
+        """Normalized Boltzmann weights of the stored frames under new epsilons
+
+        Parameters
+        ----------
+        eps : np.ndarray (n_params,) or (n_params, K)
+            Proposed epsilons of the fitted pairs, or K proposals at once.
+
+        Returns
+        -------
+        w : np.ndarray (n_frames,) or (n_frames, K)
+            Weights summing to one over frames.
+        """
+        log_w = -self.beta*self.delta_energy(eps)
+        w = np.exp(log_w - np.max(log_w, axis=0))
+        return w/np.sum(w, axis=0)
+
+    def effective_sample_size(self, eps=None):
+        """Number of effective frames, 1/sum(w**2), under new epsilons
+
+        Default eps are the proposals, whose sums were folded while streaming.
+        """
+        sums = self._folded_sums(eps)
+        if sums is not None:
+            sum_w, sum_w2, sum_w_obs = sums
+            return sum_w**2/sum_w2
+        w = self.weights(eps)
+        return 1./np.sum(w**2, axis=0)
+
+    def average(self, eps=None):
+        """Reweighted average of the observables under new epsilons
+
+        Parameters
+        ----------
+        eps : np.ndarray (n_params,) or (n_params, K) (opt.)
+            Proposed epsilons of the fitted pairs, or K proposals at once.
+            Default are the proposals, whose sums were folded while
+            streaming. Other epsilons need stored frames (see directory).
+
+        Returns
+        -------
+        avg : np.ndarray (n_observables,) or (K, n_observables)
+        """
+        sums = self._folded_sums(eps)
+        if sums is not None:
+            sum_w, sum_w2, sum_w_obs = sums
+            return sum_w_obs/np.expand_dims(sum_w, -1)
+        w = self.weights(eps)
+        avg = 0.
+        start = 0
+        for chunk in self._stored_chunks():
+            obs = chunk[-1]
+            avg = avg + np.dot(np.transpose(w[start:start + obs.shape[0]]), obs)
+            start += obs.shape[0]
+        return avg
@@ -8,8 +8,8 @@ from .hamiltonian import Hamiltonian
 
 class StructureBasedHamiltonian(Hamiltonian):
 
-    def __init__(self):
-        Hamiltonian.__init__(self)
+    def __init__(self, topology=None, storage="objects"):
+        Hamiltonian.__init__(self, topology=topology, storage=storage)
 
     def describe(self):
         pass
@@ -131,24 +131,13 @@ class StructureBasedHamiltonian(Hamiltonian):
         sum : bool (opt.)
             If sum=True return the total energy.
         """
-        r = md.compute_distances(traj, self._pair_idxs)
+        # Native pairs are the first n_native_pairs added.
         if sum:
-            Enat = np.zeros(traj.n_frames, float)
-            Enon = np.zeros(traj.n_frames, float)
+            native = np.arange(n_native_pairs)
+            nonnative = np.arange(n_native_pairs, self.n_pairs)
+            E = self._pair_group_energies([native, nonnative], traj)
+            return E[:,0], E[:,1]
         else:
-            Enat = np.zeros((traj.n_frames, n_native_pairs), float)
-            Enon = np.zeros((traj.n_frames, self.n_pairs - n_native_pairs), float)
-
-        for i in range(n_native_pairs):
-            if sum:
-                Enat += self._pairs[i].V(r[:,i])
-            else:
-                Enat[:,i] = self._pairs[i].V(r[:,i])
-
-        for i in range(n_native_pairs, self.n_pairs):
-            if sum:
-                Enon += self._pairs[i].V(r[:,i])
-            else:
-                Enon[:,i - n_native_pairs] = self._pairs[i].V(r[:,i])
-        return Enat, Enon
+            E = self.calc_pair_energy(traj, sum=False)
+            return E[:,:n_native_pairs], E[:,n_native_pairs:]
 
@@ -0,0 +1,444 @@
+"""Column storage for the interactions of a Hamiltonian"""
+
+import numpy as np
+
+BOND_ATOMS = ("atmi", "atmj")
+ANGLE_ATOMS = ("atmi", "atmj", "atmk")
+DIHEDRAL_ATOMS = ("atmi", "atmj", "atmk", "atml")
+PAIR_ATOMS = ("atmi", "atmj")
+
+def canonical_atom_idxs(atom_idxs):
+    """Atom indices of each row in the order used by the _key of potentials
+
+    A row and its reverse describe the same interaction; the one that is
+    lexicographically smaller is kept, e.g. (min(i, j), max(i, j)) for pairs.
+    """
+    atom_idxs = np.asarray(atom_idxs)
+    reverse = atom_idxs[:,::-1]
+    first = np.argmax(atom_idxs != reverse, axis=1)
+    rows = np.arange(len(atom_idxs))
+    flip = reverse[rows, first] < atom_idxs[rows, first]
+    return np.where(flip[:,None], reverse, atom_idxs)
+
+def _row_codes(keys):
+    """Integer code for each row of keys, equal for equal rows"""
+    keys = np.ascontiguousarray(keys)
+    return np.unique(keys, axis=0, return_inverse=True)[1].ravel()
+
+class TableParameter(object):
+
+    def __init__(self, name, column, is_int=False):
+        """Parameter attribute of a potential that can live in a table
+
+        Potentials keep their parameters as plain attributes until they are
+        bound to a row of an InteractionTable (see InteractionTable.bind).
+        From then on reads come from the row and writes go to the row
+        through the owner of the table, so stored objects never hold stale
+        copies and bulk changes of the table don't touch the objects.
+
+        Parameters
+        ----------
+        name : str
+            Name of the attribute, one of the _param_names of the potential.
+        column : int
+            Column of the parameter in the table.
+        is_int : bool (opt.)
+            Whether values are read back as integers.
+
+        """
+        self.name = name
+        self.column = column
+        self.is_int = is_int
+
+    def __get__(self, pot, pot_class=None):
+        if pot is None:
+            return self
+        table = pot.__dict__.get("_table")
+        if table is None:
+            try:
+                return pot.__dict__[self.name]
+            except KeyError:
+                raise AttributeError(self.name)
+        value = table._params[pot._row, self.column]
+        return int(value) if self.is_int else float(value)
+
+    def __set__(self, pot, value):
+        table = pot.__dict__.get("_table")
+        if table is None:
+            pot.__dict__[self.name] = value
+        else:
+            table.set_value(pot._row, self.column, value)
+
+class TableAtom(object):
+
+    def __init__(self, name):
+        """Atom attribute of a potential, fixed once bound to a table row
+
+        The row holds the atom indices, so changing the atoms of a stored
+        interaction would leave the table behind; it raises instead.
+
+        Parameters
+        ----------
+        name : str
+            Name of the attribute, e.g. atmi.
+
+        """
+        self.name = name
+
+    def __get__(self, pot, pot_class=None):
+        if pot is None:
+            return self
+        try:
+            return pot.__dict__[self.name]
+        except KeyError:
+            raise AttributeError(self.name)
+
+    def __set__(self, pot, value):
+        if pot.__dict__.get("_table") is not None:
+            raise AttributeError("Atoms of a stored interaction can't be changed, "
+                                 "add a new interaction instead")
+        pot.__dict__[self.name] = value
+
+def _add_table_attributes(pot_class, atom_names):
+    """Make the parameters and atoms of pot_class table attributes"""
+    int_names = getattr(pot_class, "_int_param_names", ())
+    for column, name in enumerate(pot_class._param_names):
+        if not isinstance(pot_class.__dict__.get(name), TableParameter):
+            setattr(pot_class, name, TableParameter(name, column, name in int_names))
+    for name in atom_names:
+        if not isinstance(pot_class.__dict__.get(name), TableAtom):
+            setattr(pot_class, name, TableAtom(name))
+
+class InteractionTable(object):
+
+    def __init__(self, atom_names, topology=None, owner=None, kind=None):
+        """Interactions of one kind stored as typed columns
+
+        Holds the potential type, atom indices and parameters of every
+        interaction in NumPy arrays instead of one Python object (plus nested
+        sub-potentials) per interaction. Supports the list operations used on
+        the interactions of a Hamiltonian: len, iteration, indexing and
+        append. Indexing creates a potential object on demand.
+
+        Potentials that can't be stored as columns (e.g. CUSTOM) are kept as
+        objects. The others are bound to their row when appended or created
+        by indexing (see bind), so their parameters are read from and
+        written to the table and their atoms can't be changed.
+
+        Parameters
+        ----------
+        atom_names : tuple
+            Names of the atom attributes of the potentials, e.g. BOND_ATOMS.
+        topology : mdtraj.Topology (opt.)
+            Topology the atom indices refer to. Taken from the first
+            interaction added if not given.
+        owner : Hamiltonian (opt.)
+            Set as the owner of the potential objects created on demand.
+            Parameters written through bound objects go through its
+            set_parameters.
+        kind : str (opt.)
+            Key of the table in owner._tables, e.g. pairs.
+
+        """
+        self.atom_names = atom_names
+        self.topology = topology
+        self.owner = owner
+        self.kind = kind
+
+        # Potential classes and labels, indexed by the code id of each row.
+        self.classes = []
+        self.labels = []
+        self.objects = {}
+
+        self._n = 0
+        self._code_ids = np.zeros(0, np.int16)
+        self._atom_idxs = np.zeros((0, len(atom_names)), np.int32)
+        self._params = np.zeros((0, 0), float)
+
+    def __len__(self):
+        return self._n
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self[i]
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ self[k] for k in range(*i.indices(self._n)) ]
+        if i < 0:
+            i += self._n
+        if not (0 <= i < self._n):
+            raise IndexError("interaction index out of range")
+        if i in self.objects:
+            return self.objects[i]
+
+        pot_class = self.classes[self._code_ids[i]]
+        atoms = [ self.topology.atom(idx) for idx in self._atom_idxs[i].tolist() ]
+        pot = pot_class(*(atoms + self._row_params(pot_class, self._params[i])))
+        if self.owner is not None:
+            pot._owner = self.owner
+        self.bind(pot, i)
+        return pot
+
+    def _row_params(self, pot_class, row):
+        names = pot_class._param_names
+        int_names = getattr(pot_class, "_int_param_names", ())
+        return [ int(value) if name in int_names else value for name, value in
+                    zip(names, row[:len(names)].tolist()) ]
+
+    def bind(self, pot, i):
+        """Keep the parameters of the potential object pot in row i
+
+        The parameter attributes of pot then read row i and write to it
+        (see TableParameter), so changing the table, e.g. with
+        Hamiltonian.set_parameters, needs no call per object. Its atoms
+        become read-only (see TableAtom).
+
+        Parameters
+        ----------
+        pot : potential
+            Object of the potential stored in row i.
+        i : int
+
+        """
+        pot_class = type(pot)
+        _add_table_attributes(pot_class, self.atom_names)
+        for name in pot_class._param_names:
+            pot.__dict__.pop(name, None)
+        pot._table = self
+        pot._row = i
+
+    def set_value(self, i, column, value):
+        """Set one parameter of row i, through the owner if there is one"""
+        if self.owner is None:
+            self._params[i, column] = value
+        else:
+            selection = ParameterSelection(self.owner,
+                    [(self.kind, np.array([i]), np.array([column]))])
+            self.owner.set_parameters(selection, value)
+
+    @property
+    def code_ids(self):
+        """Index into classes and labels for each interaction"""
+        return self._code_ids[:self._n]
+
+    @property
+    def atom_idxs(self):
+        """Atom indices of each interaction, shape (n, len(atom_names))"""
+        return self._atom_idxs[:self._n]
+
+    @property
+    def params(self):
+        """Parameters of each interaction in the order of _param_names"""
+        return self._params[:self._n]
+
+    def _code_id(self, pot):
+        code = (type(pot), pot.prefix_label)
+        for code_id, known in enumerate(zip(self.classes, self.labels)):
+            if known == code:
+                return code_id
+        self.classes.append(code[0])
+        self.labels.append(code[1])
+        return len(self.classes) - 1
+
+    def _reserve(self, n):
+        """Make room for n interactions, growing the columns geometrically"""
+        capacity = self._code_ids.shape[0]
+        if n <= capacity:
+            return
+        capacity = max(n, 2*capacity, 16)
+        self._code_ids = np.resize(self._code_ids, capacity)
+        atom_idxs = np.zeros((capacity, len(self.atom_names)), np.int32)
+        atom_idxs[:self._n] = self.atom_idxs
+        self._atom_idxs = atom_idxs
+        params = np.zeros((capacity, self._params.shape[1]), float)
+        params[:self._n] = self.params
+        self._params = params
+
+    def _widen(self, n_params):
+        if n_params > self._params.shape[1]:
+            params = np.zeros((self._params.shape[0], n_params), float)
+            params[:,:self._params.shape[1]] = self._params
+            self._params = params
+
+    def append(self, pot):
+        """Store an interaction in the table"""
+        if self.topology is None:
+            self.topology = getattr(pot, self.atom_names[0]).residue.chain.topology
+
+        i = self._n
+        self._reserve(i + 1)
+        self._code_ids[i] = self._code_id(pot)
+        self._atom_idxs[i] = [ getattr(pot, name).index for name in self.atom_names ]
+        if type(pot)._param_names is None:
+            self.objects[i] = pot
+        else:
+            self._widen(len(type(pot)._param_names))
+        self._n += 1
+        self.set_params(i, pot)
+        if i not in self.objects:
+            self.bind(pot, i)
+
+    def extend(self, pot, atom_idxs, params):
+        """Store interactions of the same potential as pot from columns"""
+        i, n = self._n, len(atom_idxs)
+        self._reserve(i + n)
+        self._widen(params.shape[1])
+        self._code_ids[i:i + n] = self._code_id(pot)
+        self._atom_idxs[i:i + n] = atom_idxs
+        self._params[i:i + n,:params.shape[1]] = params
+        self._n += n
+
+    def key_columns(self, pot_class, atom_idxs, params):
+        """Atom indices and parameters in the _key of pot_class, as columns"""
+        n_key = len(pot_class._key_param_names)
+        columns = np.hstack([canonical_atom_idxs(atom_idxs), params[:,:n_key]])
+        # Adding zero turns -0. into 0., which compares equal as a key.
+        return columns.astype(float) + 0.
+
+    def keys(self):
+        """The _key of every interaction, without creating potential objects"""
+        keys = [None]*self._n
+        for code_id, (pot_class, label) in enumerate(zip(self.classes, self.labels)):
+            rows = np.flatnonzero(self.code_ids == code_id)
+            columns = self.key_columns(pot_class, self.atom_idxs[rows], self.params[rows])
+            # Floats compare and hash equal to the ints in _key.
+            for row, key in zip(rows.tolist(), columns.tolist()):
+                keys[row] = (label,) + tuple(key)
+        return keys
+
+    def new_rows(self, pot, atom_idxs, params):
+        """Which rows are interactions not yet stored, like pot
+
+        Rows count as stored if an interaction with the same _key is in the
+        table or earlier in the rows themselves. Keys are compared as
+        arrays, without creating potential objects.
+
+        Returns
+        -------
+        new : array(bool)
+        """
+        pot_class = type(pot)
+        keys = self.key_columns(pot_class, atom_idxs, params)
+        if pot.prefix_label in self.labels:
+            same = np.flatnonzero(np.array(self.labels)[self.code_ids] == pot.prefix_label)
+            stored = self.key_columns(pot_class, self.atom_idxs[same], self.params[same])
+        else:
+            stored = np.zeros((0, keys.shape[1]))
+        codes = _row_codes(np.vstack([stored, keys]))
+        stored_codes, codes = codes[:len(stored)], codes[len(stored):]
+
+        new = np.zeros(len(keys), bool)
+        new[np.unique(codes, return_index=True)[1]] = True
+        new &= ~np.isin(codes, stored_codes)
+        return new
+
+    def set_params(self, i, pot):
+        """Copy the parameters of a potential into row i"""
+        names = type(pot)._param_names
+        if names is not None:
+            self._params[i,:len(names)] = [ getattr(pot, name) for name in names ]
+
+class ParameterValues(np.ndarray):
+    """Selected parameters that are written back to the Hamiltonian
+
+    Returned by ParameterSelection.values. Item assignment and in-place
+    operations, also on slices, are passed on to Hamiltonian.set_parameters,
+    so values[:] = x or values *= 1.1 change the selected interactions.
+    Results of other operations are plain arrays.
+    """
+
+    def __new__(cls, selection):
+        values = np.asarray(selection._gather()).view(cls)
+        values._selection = selection
+        values._root = values
+        return values
+
+    def __array_finalize__(self, obj):
+        # Views share memory with the selected values and write back
+        # through them, copies are independent.
+        root = getattr(obj, "_root", None)
+        if (root is not None) and np.may_share_memory(self, root):
+            self._root = root
+        else:
+            self._root = None
+        self._selection = None
+
+    def _write_back(self):
+        root = self._root
+        if root is not None:
+            root._selection.owner.set_parameters(root._selection, np.asarray(root))
+
+    def __setitem__(self, key, value):
+        np.asarray(self)[key] = value
+        self._write_back()
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = [ np.asarray(x) if isinstance(x, ParameterValues) else x for x in inputs ]
+        out = kwargs.get("out", ())
+        if out:
+            kwargs["out"] = tuple( np.asarray(x) if isinstance(x, ParameterValues) else x
+                                    for x in out )
+        result = getattr(ufunc, method)(*inputs, **kwargs)
+        if not out:
+            return result
+        for x in out:
+            if isinstance(x, ParameterValues):
+                x._write_back()
+        return out[0] if len(out) == 1 else out
+
+class ParameterSelection(object):
+
+    def __init__(self, owner, blocks):
+        """Selected parameters of a Hamiltonian as one flat vector
+
+        Reads gather the selected entries of the interaction tables and
+        writes scatter back into them through Hamiltonian.set_parameters, so
+        selection[:] = values or selection[mask] *= 1.1 updates every
+        selected interaction at once. The selection covers the interactions
+        that existed when it was made.
+
+        Parameters
+        ----------
+        owner : Hamiltonian
+
+        blocks : list
+            (kind, rows, columns) tuples. Entry k of the selection in kind
+        is params[rows[k], columns[k]] of owner._tables[kind].
+
+        """
+        self.owner = owner
+        self.blocks = blocks
+
+    def __len__(self):
+        return sum([ len(rows) for kind, rows, columns in self.blocks ])
+
+    def _gather(self):
+        return np.concatenate([ np.zeros(0, float) ] +
+                [ self.owner._tables[kind].params[rows, columns]
+                    for kind, rows, columns in self.blocks ])
+
+    @property
+    def values(self):
+        """The selected parameters, see ParameterValues
+
+        The selected entries are scattered over the interaction tables, so
+        the array holds their values at the time of the call; writing to it
+        writes back to the tables, e.g. selection.values[:10] = 0.
+        """
+        return ParameterValues(self)
+
+    def __array__(self, dtype=None, copy=None):
+        values = self._gather()
+        return values if dtype is None else values.astype(dtype)
+
+    def __getitem__(self, key):
+        return self._gather()[key]
+
+    def __setitem__(self, key, value):
+        values = self._gather()
+        values[key] = value
+        self.owner.set_parameters(self, values)
+
+    def __repr__(self):
+        return "<ParameterSelection of {} parameters at 0x{:x}>".format(len(self), id(self))
@@ -0,0 +1,332 @@
+"""Pair potentials evaluated by interpolating tables"""
+
+import numpy as np
+
+from . import util
+
+# Potentials that call np.exp or np.tanh for every pair and frame.
+TRANSCENDENTAL = ("GAUSSIAN", "TANHREP", "LJ12TANHREP", "LJ12GAUSSIAN",
+                  "LJ12GAUSSIANTANH")
+
+# The transcendental part of each potential is a function of the reduced
+# distance s = (r - r0)/width alone, the same for every pair:
+#   GAUSSIAN  -exp(-s**2/2)
+#   TANHREP   0.5*(tanh(1 - s) + 1)
+# Each entry gives the function and its derivative, the range of s where it
+# differs from its limits by more than tol, and the limits below and above.
+def _gaussian_shape(s):
+    G = -np.exp(-0.5*(s**2))
+    return G, -s*G
+
+def _gaussian_range(tol):
+    s_max = np.sqrt(2.*np.log(1./tol))
+    return (-s_max, s_max), (0., 0.)
+
+def _tanh_shape(s):
+    t = np.tanh(1. - s)
+    return 0.5*(t + 1.), -0.5*(1. - t**2)
+
+def _tanh_range(tol):
+    # 0.5*(tanh(u) + 1) is within exp(-2|u|) of its limits.
+    u_max = 0.5*np.log(1./tol)
+    return (1. - u_max, 1. + u_max), (1., 0.)
+
+SHAPES = {"gaussian":(_gaussian_shape, _gaussian_range),
+          "tanh":(_tanh_shape, _tanh_range)}
+
+# Shape of each tabulated potential and whether it adds an LJ12 wall.
+_FORMS = {"GAUSSIAN":("gaussian", False), "TANHREP":("tanh", False),
+          "LJ12TANHREP":("tanh", True), "LJ12GAUSSIAN":("gaussian", True)}
+
+def _n_intervals(shape, ds, tail_tol):
+    (s_min, s_max), limits = SHAPES[shape][1](tail_tol)
+    return max(int(np.ceil((s_max - s_min)/ds)), 1)
+
+def _table_bytes(shape, kind, ds, tail_tol, dtype):
+    n_coef = 4 if kind == "linear" else 7
+    return _n_intervals(shape, ds, tail_tol)*n_coef*np.dtype(dtype).itemsize
+
+class ShapeTable(object):
+
+    def __init__(self, shape, kind="cubic", ds=0.01, tail_tol=1e-10, dtype=float):
+        """Interpolation table of one reduced shape function
+
+        The shape is sampled on s_min, s_min + ds, ..., s_max, the range
+        where it differs from its limits by more than tail_tol. Values and
+        derivatives are interpolated from per-interval polynomial
+        coefficients with one gather per value. Outside the range the limits
+        are used.
+
+        Parameters
+        ----------
+        shape : str [gaussian, tanh]
+            See SHAPES.
+        kind : str [linear, cubic] (opt.)
+            Linear interpolation of the value and derivative, or cubic
+            Hermite interpolation of the value using the exact derivative at
+            the grid points.
+        ds : float (opt.)
+            Grid spacing in units of width.
+        tail_tol : float (opt.)
+
+        dtype : np.dtype (opt.)
+            Type of the stored coefficients. Tables are always computed in
+            float64.
+
+        """
+        if kind not in ["linear", "cubic"]:
+            raise ValueError("kind must be 'linear' or 'cubic', not {}".format(kind))
+        function, span = SHAPES[shape]
+        (s_min, s_max), (self.left, self.right) = span(tail_tol)
+        self.shape = shape
+        self.kind = kind
+        self.ds = ds
+        self.s_min = s_min
+        self.n_intervals = _n_intervals(shape, ds, tail_tol)
+        self.s_max = s_min + self.n_intervals*ds
+
+        s = s_min + ds*np.arange(self.n_intervals + 1)
+        V, D = function(s)
+        V0, V1 = V[:-1], V[1:]
+        D0, D1 = D[:-1], D[1:]
+
+        # Polynomials in t = (s - s_k)/ds on each interval.
+        if kind == "linear":
+            V_coef = [V0, V1 - V0]
+            D_coef = [D0, D1 - D0]
+        else:
+            c2 = 3.*(V1 - V0) - ds*(2.*D0 + D1)
+            c3 = 2.*(V0 - V1) + ds*(D0 + D1)
+            V_coef = [V0, ds*D0, c2, c3]
+            D_coef = [D0, 2.*c2/ds, 3.*c3/ds]
+        self._V_coef = [ np.ascontiguousarray(c, dtype) for c in V_coef ]
+        self._D_coef = [ np.ascontiguousarray(c, dtype) for c in D_coef ]
+
+    @property
+    def nbytes(self):
+        return sum([ c.nbytes for c in self._V_coef + self._D_coef ])
+
+    def _interpolate(self, s, coef, left, right):
+        x = (np.ascontiguousarray(s) - self.s_min)*(1./self.ds)
+        k = x.astype(np.intp)
+        np.clip(k, 0, self.n_intervals - 1, out=k)
+        t = np.subtract(x, k, dtype=x.dtype)
+        values = coef[-1].take(k)
+        for c in coef[-2::-1]:
+            values = c.take(k) + t*values
+        values[x < 0] = left
+        values[x >= self.n_intervals] = right
+        return values
+
+    def V(self, s):
+        return self._interpolate(s, self._V_coef, self.left, self.right)
+
+    def dVds(self, s):
+        return self._interpolate(s, self._D_coef, 0., 0.)
+
+    def errors(self, n_points=8):
+        """Largest deviation from the exact shape function
+
+        Returns
+        -------
+        errors : dict
+            Maximum absolute error of "V" and "dVds" at n_points points
+        inside every grid interval and past both ends of the table.
+        """
+        n_test = (self.n_intervals + 2)*n_points
+        s = self.s_min - self.ds + (self.s_max - self.s_min + 2.*self.ds)*(np.arange(n_test) + 0.5)/n_test
+        V, D = SHAPES[self.shape][0](s)
+        return {"V":float(np.max(np.abs(self.V(s) - V))),
+                "dVds":float(np.max(np.abs(self.dVds(s) - D)))}
+
+_tables = {}
+
+def shape_table(shape, kind="cubic", ds=0.01, tail_tol=1e-10, dtype=float):
+    """ShapeTable shared by every family with the same settings"""
+    key = (shape, kind, ds, tail_tol, np.dtype(dtype).str)
+    if key not in _tables:
+        _tables[key] = ShapeTable(shape, kind, ds, tail_tol, dtype)
+    return _tables[key]
+
+def _subset(block, columns):
+    params = [ np.atleast_1d(getattr(block, name))[columns] for name in block._param_names ]
+    return block.block(*params)
+
+def _lj12(rNC, r):
+    # (rNC/r)**12 with multiplications instead of pow.
+    x2 = (rNC/r)**2
+    x4 = x2*x2
+    return x4*x4*x4
+
+class TabulatedPairPotential(object):
+
+    def __init__(self, block, kind="cubic", ds=0.01, tail_tol=1e-10, dtype=float):
+        """Family of pairs evaluated by interpolation of a reduced shape
+
+        The exp or tanh of each potential is a function of the reduced
+        distance s = (r - r0)/width only (see SHAPES), so one small table
+        serves every pair of the family, whatever its r0 and width, and is
+        shared with the other families. eps and the LJ12 wall (rNC/r)**12
+        are applied analytically. LJ12GAUSSIANTANH pairs are split by the
+        sign of eps into an LJ12TANHREP and an LJ12GAUSSIAN part.
+
+        Other attributes (e.g. dVdeps, eps) are those of the analytic block.
+
+        Parameters
+        ----------
+        block : PairPotential
+            Analytic block of the family, see compiled.families.
+        kind : str [linear, cubic] (opt.)
+            See ShapeTable.
+        ds : float (opt.)
+            Grid spacing in units of width.
+        tail_tol : float (opt.)
+            The table ends where the shape is within tail_tol of its limits.
+        dtype : np.dtype (opt.)
+
+        """
+        self.analytic = block
+        self.kind = kind
+        self._settings = (kind, ds, tail_tol, dtype)
+        label = block.prefix_label
+        if label == "LJ12GAUSSIANTANH":
+            eps = np.atleast_1d(block.eps)
+            self._branches = []
+            for columns, branch in [(np.flatnonzero(eps < 0), block.repulsive),
+                                    (np.flatnonzero(eps >= 0), block.attractive)]:
+                if len(columns) > 0:
+                    self._branches.append((columns, TabulatedPairPotential(
+                            _subset(branch, columns), kind, ds, tail_tol, dtype)))
+            self.tables = [ table for columns, branch in self._branches
+                                for table in branch.tables ]
+            return
+
+        self._branches = None
+        shape, self._lj12_wall = _FORMS[label]
+        self.table = shape_table(shape, kind, ds, tail_tol, dtype)
+        self.tables = [self.table]
+        self._gaussian = (shape == "gaussian")
+        self._r0 = np.asarray(block.r0, dtype)
+        self._inv_width = np.asarray(1./np.asarray(block.width), dtype)
+        self._eps = np.asarray(block.eps, dtype)
+        if self._lj12_wall:
+            self._rNC = np.asarray(block.rNC, dtype)
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the table itself.
+        if name == "analytic":
+            raise AttributeError(name)
+        return getattr(self.analytic, name)
+
+    def subset(self, columns):
+        """Tabulated block of only some pairs of the family"""
+        return TabulatedPairPotential(_subset(self.analytic, columns), *self._settings)
+
+    def _switch(self, r, method):
+        values = np.zeros(r.shape, np.result_type(r, self.analytic.eps))
+        for columns, branch in self._branches:
+            values[:,columns] = getattr(branch, method)(r[:,columns])
+        return values
+
+    def V(self, r):
+        if self._branches is not None:
+            return self._switch(r, "V")
+        S = self.table.V((r - self._r0)*self._inv_width)
+        V = self._eps*S
+        if self._lj12_wall:
+            L = _lj12(self._rNC, r)
+            V += L*(1. + S) if self._gaussian else L
+        return V
+
+    def dVdr(self, r):
+        if self._branches is not None:
+            return self._switch(r, "dVdr")
+        s = (r - self._r0)*self._inv_width
+        dS = self.table.dVds(s)*self._inv_width
+        dV = self._eps*dS
+        if self._lj12_wall:
+            L = _lj12(self._rNC, r)
+            dL = (-12.*L)/r
+            if self._gaussian:
+                dV += dL*(1. + self.table.V(s)) + L*dS
+            else:
+                dV += dL
+        return dV
+
+    def errors(self, n_points=8, n_pairs=200):
+        """Largest deviation from the analytic potential
+
+        Compares with the analytic V and dVdr of up to n_pairs pairs of the
+        family, at n_points distances inside every grid interval of the
+        table and past both of its ends.
+
+        Parameters
+        ----------
+        n_points : int (opt.)
+            Test points per grid interval.
+        n_pairs : int (opt.)
+            Number of pairs tested, spread evenly over the family.
+
+        Returns
+        -------
+        errors : dict
+            Maximum absolute error of "V" and "dVdr" of each tested pair.
+        "V_relative" and "dVdr_relative" hold the error relative to
+        max(|exact|, 1), which stays meaningful on the steep repulsive walls.
+        """
+        if self._branches is not None:
+            errors = {}
+            for columns, branch in self._branches:
+                for name, err in branch.errors(n_points, n_pairs).items():
+                    errors[name] = np.concatenate([errors.get(name, np.zeros(0)), err])
+            return errors
+
+        n = len(np.atleast_1d(self._r0))
+        columns = np.unique(np.linspace(0, n - 1, min(n, n_pairs)).astype(int))
+        table = self.table
+        n_test = (table.n_intervals + 2)*n_points
+        s = table.s_min - table.ds + (table.s_max - table.s_min + 2.*table.ds)*(
+                np.arange(n_test) + 0.5)/n_test
+        r0 = np.broadcast_to(np.atleast_1d(self.analytic.r0), (n,))[columns]
+        width = np.broadcast_to(np.atleast_1d(self.analytic.width), (n,))[columns]
+        # Distances below 0.1 nm aren't physical and overflow the LJ12 wall.
+        r = np.maximum(r0 + width*s[:,np.newaxis], 0.1)
+
+        tested = self.subset(columns)
+        errors = {}
+        for method in ["V", "dVdr"]:
+            exact = getattr(tested.analytic, method)(r)
+            approx = getattr(tested, method)(r)
+            errors[method] = np.max(np.abs(approx - exact), axis=0)
+            errors[method + "_relative"] = np.max(np.abs(approx - exact)/
+                                            np.maximum(np.abs(exact), 1.), axis=0)
+        return errors
+
+def tabulate_families(fams, codes=TRANSCENDENTAL, kind="cubic", ds=0.01, tail_tol=1e-10,
+                      dtype=float, max_bytes=2**26):
+    """Replace the blocks of the families in codes by tables
+
+    Parameters
+    ----------
+    fams : list
+        (columns, block) tuples from compiled.families.
+    codes : list (opt.)
+        Labels of the potentials to tabulate.
+    kind, ds, tail_tol, dtype : (opt.)
+        Passed to TabulatedPairPotential.
+    max_bytes : int (opt.)
+        Families whose tables would be larger than this (e.g. for a very
+        small ds) stay analytic, with a warning.
+    """
+    tabulated = []
+    for columns, block in fams:
+        label = getattr(block, "prefix_label", None)
+        if label in codes:
+            shapes = ["gaussian", "tanh"] if label == "LJ12GAUSSIANTANH" else [_FORMS[label][0]]
+            n_bytes = sum([ _table_bytes(shape, kind, ds, tail_tol, dtype) for shape in shapes ])
+            if n_bytes > max_bytes:
+                util.tabulation_size_warning(label, n_bytes, max_bytes)
+            else:
+                block = TabulatedPairPotential(block, kind, ds, tail_tol, dtype)
+        tabulated.append((columns, block))
+    return tabulated
@@ -3,11 +3,27 @@ import warnings
 def interaction_exists_warning(pot):
     warnings.warn("Interaction already exists! skipping: {}".format(pot.describe()))
 
+def interactions_exist_warning(n_existing, code):
+    warnings.warn("{} {} interactions already exist! skipping them".format(n_existing, code))
+
 def default_sbm_parameters_warning():
     warnings.warn("Using default SBM parameters")
 
 def default_sbm_potentials_warning():
     warnings.warn("Using default SBM parameters")
 
+def numba_missing_warning():
+    warnings.warn("numba is not installed, using the NumPy potentials")
+
+def uncompiled_kernels_warning():
+    warnings.warn("numba is not installed, checking the kernel functions as Python loops")
+
+def minimization_warning(message):
+    warnings.warn("Minimization didn't converge: {}".format(message))
+
+def tabulation_size_warning(label, n_bytes, max_bytes):
+    warnings.warn("Tables of {} would take {} bytes, more than {}: keeping it analytic".format(
+                    label, n_bytes, max_bytes))
+
 def missing_reference_warning():
     warnings.warn("Need to set reference structure model.set_reference()")
@@ -6,7 +6,7 @@ from .model import Model
 
 class StructureBasedModel(Model):
 
-    def __init__(self, topology, bead_repr=None):
+    def __init__(self, topology, bead_repr=None, storage="objects"):
         """Structure-based Model (SBM)
 
         Parameters
@@ -18,6 +18,10 @@ class StructureBasedModel(Model):
             A code specifying the desired coarse-grain mapping. The all-atom
         to coarse-grain mapping.
 
+        storage : str [objects, arrays] (opt.)
+            How the Hamiltonian stores its interactions, see Hamiltonian.
+            Use "arrays" for models with millions of interactions.
+
         Methods
         -------
         assign_* :
@@ -31,8 +35,9 @@ class StructureBasedModel(Model):
 
 
 
-        Model.__init__(self, topology, bead_repr=bead_repr)
-        self.Hamiltonian = potentials.StructureBasedHamiltonian()
+        Model.__init__(self, topology, bead_repr=bead_repr, storage=storage)
+        self.Hamiltonian = potentials.StructureBasedHamiltonian(self.mapping.top,
+                                                                storage=storage)
         self.mapping.add_atoms()
 
     def set_reference(self, traj):
@@ -54,6 +59,49 @@ class StructureBasedModel(Model):
         else:
             self.ref_traj.save(saveas)
 
+    def check_precision(self, traj):
+        """Largest deviation of energies and forces from double precision
+
+        See Hamiltonian.check_precision.
+        """
+        return self.Hamiltonian.check_precision(traj)
+
+    def minimize(self, max_iter=1000, tol=1., traj=None):
+        """Relax the starting configuration with L-BFGS
+
+        Minimizes the energy of the model's Hamiltonian from traj, or else
+        from the starting configuration (the reference structure if none
+        was set). The result becomes the starting configuration written by
+        save_starting_conf. See Hamiltonian.minimize.
+
+        Parameters
+        ----------
+        max_iter : int (opt.)
+            Maximum number of iterations.
+        tol : float (opt.)
+            Largest force component at convergence, in energy per nm.
+        traj : mdtraj.Trajectory (opt.)
+            Coarse-grained configuration to start from.
+
+        Returns
+        -------
+        minimized : mdtraj.Trajectory
+        """
+        if traj is None:
+            traj = getattr(self, "starting_traj", getattr(self, "ref_traj", None))
+        if traj is None:
+            raise ValueError("Give traj or set a reference structure first")
+        minimized = self.Hamiltonian.minimize(traj, max_iter=max_iter, tol=tol)
+        self.set_starting_conf(minimized)
+        return minimized
+
+    def normal_modes(self, k=10, sigma=None):
+        """Lowest normal modes of the Hamiltonian at the reference structure
+
+        See Hamiltonian.normal_modes.
+        """
+        return self.Hamiltonian.normal_modes(self.ref_traj, k=k, sigma=sigma)
+
     def assign_disulfides(self, disulfides, simple=False):
         self.mapping.add_disulfides(disulfides, simple=simple)
 
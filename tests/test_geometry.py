@@ -0,0 +1,67 @@
+import numpy as np
+import mdtraj as md
+
+from model_builder.models.potentials import geometry
+from model_builder.models.potentials.hamiltonian import Hamiltonian
+
+def _triclinic_traj(n_atoms=8, n_frames=4, seed=0):
+    """Chain of atoms near the edges of a skewed box, so images matter"""
+    top = md.Topology()
+    chain = top.add_chain()
+    for i in range(n_atoms):
+        res = top.add_residue("ALA", chain)
+        top.add_atom("CA", md.element.carbon, res)
+    rng = np.random.RandomState(seed)
+    xyz = rng.uniform(0., 2., size=(n_frames, n_atoms, 3)).astype(np.float32)
+    return md.Trajectory(xyz, top, unitcell_lengths=np.full((n_frames, 3), 2.),
+                         unitcell_angles=np.tile([60., 60., 90.], (n_frames, 1)))
+
+def _hamiltonian(top):
+    n_atoms = top.n_atoms
+    H = Hamiltonian(top)
+    i = np.arange(n_atoms)
+    H.add_bonds_from_arrays("HARMONIC_BOND", i[:-1], i[1:], 1000., 0.38)
+    H.add_angles_from_arrays("HARMONIC_ANGLE", i[:-2], i[1:-1], i[2:], 20., 1.8)
+    H.add_dihedrals_from_arrays("COSINE_DIHEDRAL", i[:-3], i[1:-2], i[2:-1], i[3:], 1., 0.5, 1)
+    pi, pj = np.triu_indices(n_atoms, 3)
+    H.add_pairs_from_arrays("LJ1210", pi, pj, 1., 0.5)
+    return H
+
+def test_triclinic_geometry_matches_mdtraj():
+    traj = _triclinic_traj()
+    box = geometry.traj_box(traj)
+    assert box.shape == (traj.n_frames, 3, 3)
+
+    pairs = np.array(np.triu_indices(traj.n_atoms, 1)).T
+    triplets = np.array([[0, 1, 2], [3, 5, 7], [6, 2, 4]])
+    quartets = np.array([[0, 1, 2, 3], [7, 2, 5, 1]])
+    np.testing.assert_allclose(geometry.distances(traj.xyz, pairs, box),
+                               md.compute_distances(traj, pairs), atol=1e-5)
+    np.testing.assert_allclose(geometry.angles(traj.xyz, triplets, box),
+                               md.compute_angles(traj, triplets), atol=1e-4)
+    np.testing.assert_allclose(geometry.dihedrals(traj.xyz, quartets, box),
+                               md.compute_dihedrals(traj, quartets), atol=1e-4)
+
+def test_triclinic_energies_and_forces():
+    traj = _triclinic_traj()
+    H = _hamiltonian(traj.top)
+
+    E = H.calc_total_energy(traj, by_term=True)
+    np.testing.assert_allclose(E["bond"], H.calc_bond_energy(traj), rtol=1e-4)
+    np.testing.assert_allclose(E["angle"], H.calc_angle_energy(traj), rtol=1e-4)
+    np.testing.assert_allclose(E["dihedral"], H.calc_dihedral_energy(traj), rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose(E["pair"], H.calc_pair_energy(traj), rtol=1e-4)
+    np.testing.assert_allclose(H.calc_pair_energy(traj, tol=1e-6), E["pair"], rtol=1e-4, atol=1e-5)
+    np.testing.assert_allclose(H.energy_from_xyz(traj.xyz, traj.unitcell_vectors),
+                               H.calc_total_energy(traj), rtol=1e-5)
+
+    # Forces are minus the numerical gradient of the energy.
+    xyz = traj.xyz[:1].astype(float)
+    box = traj.unitcell_vectors[:1]
+    F = H.calc_forces(traj[0])[0]
+    h = 1e-5
+    for atom, dim in [(0, 0), (3, 1), (7, 2)]:
+        step = np.zeros_like(xyz)
+        step[0,atom,dim] = h
+        dE = H.energy_from_xyz(xyz + step, box) - H.energy_from_xyz(xyz - step, box)
+        np.testing.assert_allclose(-dE[0]/(2*h), F[atom,dim], rtol=1e-3, atol=1e-3)
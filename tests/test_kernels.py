@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from model_builder.models.potentials import compiled, kernels, pairwise
+
+def test_conformance():
+    passed, deviations = kernels.conformance()
+    assert passed, deviations
+
+@pytest.mark.skipif(not kernels.available(), reason="numba is not installed")
+def test_conformance_compiled():
+    passed, deviations = kernels.conformance(require_numba=True)
+    assert passed, deviations
+
+def test_conformance_without_numba(monkeypatch):
+    monkeypatch.setattr(kernels, "numba", None)
+    with pytest.raises(ImportError):
+        kernels.conformance(require_numba=True)
+    with pytest.warns(UserWarning):
+        passed, deviations = kernels.conformance(n_frames=3, n_interactions=5)
+    assert passed, deviations
+
+def test_subset_keeps_kernels():
+    block = pairwise.LJ1210Potential.block(np.array([1., 0.5, -0.2]), np.array([0.4, 0.5, 0.6]))
+    kernel_block = kernels.KernelBlock._uncompiled(block)
+    subset = compiled.block_subset(kernel_block, np.array([0, 2]))
+    assert isinstance(subset, kernels.KernelBlock)
+    r = np.linspace(0.35, 0.8, 12).reshape(-1, 2)
+    np.testing.assert_allclose(subset.V(r), compiled.block_subset(block, [0, 2]).V(r))
@@ -0,0 +1,29 @@
+import numpy as np
+import mdtraj as md
+import pytest
+
+import model_builder as mdb
+from model_builder.models.output.internal import InternalFiles
+
+def _model():
+    top = md.Topology()
+    chain = top.add_chain()
+    for i in range(6):
+        res = top.add_residue("ALA", chain)
+        top.add_atom("CA", md.element.carbon, res)
+    model = mdb.models.Model(top, bead_repr="CA")
+    model.Hamiltonian.add_pairs_from_arrays("LJ1210", [0, 1], [3, 4], [1., 0.5], 0.5)
+    return model
+
+def test_pairs_without_epsilon_are_not_written(tmpdir):
+    model = _model()
+    with tmpdir.as_cwd():
+        InternalFiles(model).write_pairwise_parameters()
+        np.testing.assert_allclose(np.loadtxt("model_params"), [1., 0.5])
+
+        model.Hamiltonian.add_pairs_from_arrays("FLATWELL", [0], [5], 100., 0.4, 0.6)
+        model.assign_fitted_epsilons([0, 1])
+        with pytest.raises(ValueError, match="FLATWELL"):
+            InternalFiles(model).write_pairwise_parameters(suffix="_flat")
+        with pytest.raises(ValueError, match="FLATWELL"):
+            model.output_epsilons()
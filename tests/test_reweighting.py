@@ -0,0 +1,41 @@
+import numpy as np
+import mdtraj as md
+import pytest
+
+from model_builder.models.potentials import Hamiltonian
+from model_builder.models.potentials.reweighting import Reweighter
+
+def _hamiltonian_and_traj():
+    rng = np.random.RandomState(0)
+    top = md.Topology()
+    chain = top.add_chain()
+    for i in range(8):
+        res = top.add_residue("ALA", chain)
+        top.add_atom("CA", md.element.carbon, res)
+    xyz = np.cumsum(0.2*rng.randn(8, 3), axis=0)
+    traj = md.Trajectory((xyz + 0.03*rng.randn(12, 8, 3)).astype(np.float32), top)
+
+    H = Hamiltonian(top)
+    H.add_pairs_from_arrays("LJ1210", [0, 1, 2], [4, 5, 6], [1., 0.5, -0.2], 0.5)
+    H.add_pairs_from_arrays("LJ12GAUSSIANTANH", [0, 1], [6, 7], [0.3, -0.4], 0.4, 0.6, 0.05)
+    return H, traj
+
+def test_streamed_sums_match_stored_frames(tmpdir):
+    H, traj = _hamiltonian_and_traj()
+    proposals = np.array([[1.2, 0.5, 0.1, -0.3, 0.2],
+                          [0.8, -0.5, -0.2, 0.3, -0.4]]).T
+    observables = lambda t: t.xyz[:,0,:]
+
+    streamed = Reweighter(H, beta=2., proposals=proposals)
+    streamed.add_traj(traj, observables, chunk_size=5)
+    stored = Reweighter(H, beta=2., directory=str(tmpdir))
+    stored.add_traj(traj, observables, chunk_size=5)
+
+    assert streamed.n_frames == stored.n_frames == traj.n_frames
+    np.testing.assert_allclose(streamed.average(), stored.average(proposals))
+    np.testing.assert_allclose(streamed.effective_sample_size(),
+                               stored.effective_sample_size(proposals))
+    with pytest.raises(ValueError):
+        streamed.average(proposals[:,0])
+    with pytest.raises(ValueError):
+        Reweighter(H)
@@ -0,0 +1,67 @@
+import numpy as np
+import mdtraj as md
+import pytest
+
+from model_builder.models.potentials.hamiltonian import Hamiltonian
+
+def _chain_topology(n_atoms=6):
+    top = md.Topology()
+    chain = top.add_chain()
+    for i in range(n_atoms):
+        res = top.add_residue("ALA", chain)
+        top.add_atom("CA", md.element.carbon, res)
+    return top
+
+def _hamiltonian(storage):
+    top = _chain_topology()
+    H = Hamiltonian(top, storage=storage)
+    pi, pj = np.triu_indices(top.n_atoms, 2)
+    H.add_pairs_from_arrays("LJ12GAUSSIANTANH", pi, pj, 1., 0.4, 0.6, 0.05)
+    H.add_dihedrals_from_arrays("COSINE_DIHEDRAL", [0, 1], [1, 2], [2, 3], [3, 4], 1., 0.5, 1)
+    return H
+
+@pytest.mark.parametrize("storage", ["objects", "arrays"])
+def test_selection_values_write_back(storage):
+    H = _hamiltonian(storage)
+    sel = H.select_parameters("eps", kind="pairs")
+    pair = H._pairs[0]
+    E = H.compile()
+
+    sel.values[:] = np.arange(len(sel)) - 2.
+    sel.values[1:3] *= 2.
+    np.testing.assert_array_equal(sel, [-2., -2., 0.] + list(np.arange(3, len(sel)) - 2.))
+    assert H.compile() is not E
+    # Stored objects read their parameters from the table.
+    assert pair.eps == -2.
+    assert type(pair.current) is type(pair.repulsive)
+
+    values = sel.values
+    copy = values + 1.
+    copy[0] = 10.
+    assert sel[0] == -2.
+
+@pytest.mark.parametrize("storage", ["objects", "arrays"])
+def test_object_attributes_write_back(storage):
+    H = _hamiltonian(storage)
+    traj = md.Trajectory(np.random.RandomState(0).uniform(0., 1., (3, 6, 3)), H.topology)
+    E = H.calc_pair_energy(traj)
+
+    H._pairs[0].r0 = 0.7
+    H._pairs[1].set_epsilon(-1.)
+    assert H.select_parameters("r0", kind="pairs")[0] == 0.7
+    assert H._pairs[1].eps == -1.
+    expected = sum([ pair.V(r) for pair, r in zip(H.pairs, md.compute_distances(
+                        traj, H._pair_idxs).T) ])
+    np.testing.assert_allclose(H.calc_pair_energy(traj), expected, rtol=1e-6)
+    assert not np.allclose(H.calc_pair_energy(traj), E)
+
+    with pytest.raises(AttributeError):
+        H._pairs[0].atmi = H._pairs[0].atmj
+
+def test_integer_parameters_stay_integers():
+    H = _hamiltonian("objects")
+    sel = H.select_parameters("mult")
+    with pytest.raises(ValueError):
+        sel.values[0] = 2.5
+    sel.values[0] = 3
+    assert H._dihedrals[0].mult == 3